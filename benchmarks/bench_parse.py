@@ -0,0 +1,158 @@
+"""用原始响应存档测量parse_weibo的耗时
+
+从存档（见config.json中的archive）的getIndex响应中取出全部微博及其源微博，在当前代码和
+--baseline指定的git版本上分别解析，输出每条微博的平均耗时和两者的解析结果是否一致。
+各版本在单独的进程中运行，解析时不发出网络请求。例如对比单次遍历提取正文字段前后的实现：
+
+    python benchmarks/bench_parse.py --baseline 9aaee25 weibo/.archive
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = {
+    "user_id_list": ["1"],
+    "only_crawl_original": 0,
+    "since_date": 1,
+    "write_mode": ["csv"],
+    "original_pic_download": 0,
+    "retweet_pic_download": 0,
+    "original_video_download": 0,
+    "retweet_video_download": 0,
+    "original_live_photo_download": 0,
+    "retweet_live_photo_download": 0,
+    "download_comment": 0,
+    "comment_max_download_count": 0,
+    "download_repost": 0,
+    "repost_max_download_count": 0,
+    "user_id_as_folder_name": 1,
+    "remove_html_tag": 1,
+    "cookie": "",
+}
+
+
+def load_mblogs(paths):
+    """读取存档中各微博页里的微博，转发微博的源微博也作为单独的一条"""
+    sys.path.insert(0, ROOT)
+    from util.archive import archive_files, read_archive
+
+    mblogs = {}
+    for path in archive_files(paths):
+        for record in read_archive(path):
+            if record["kind"] != "getIndex" or record["page"] is None:
+                continue
+            try:
+                js = json.loads(record["body"])
+            except ValueError:
+                continue
+            cards = (js.get("data") or {}).get("cards") or []
+            for card in cards:
+                for card in card.get("card_group") or [card]:
+                    mblog = card.get("mblog") if card.get("card_type") == 9 else None
+                    if not mblog:
+                        continue
+                    mblogs[mblog["id"]] = mblog
+                    retweet = mblog.get("retweeted_status")
+                    if retweet and retweet.get("id") and retweet.get("user"):
+                        mblogs[retweet["id"]] = retweet
+    return list(mblogs.values())
+
+
+def export_tree(revision, directory):
+    """把git版本revision的代码导出到directory"""
+    archive_path = os.path.join(directory, "tree.tar")
+    with open(archive_path, "wb") as f:
+        subprocess.run(["git", "archive", revision], cwd=ROOT, stdout=f, check=True)
+    tree = os.path.join(directory, "tree")
+    with tarfile.open(archive_path) as tar:
+        tar.extractall(tree)
+    return tree
+
+
+def run_tree(tree, mblogs_path, remove_html_tag, repeat):
+    """在单独的进程中用tree中的代码解析，返回(每条微博的耗时秒数, 解析结果的摘要)"""
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", tree, mblogs_path,
+         str(remove_html_tag), str(repeat)],
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+    return result["seconds"], result["digest"]
+
+
+def worker(tree, mblogs_path, remove_html_tag, repeat):
+    sys.path[0] = tree
+    os.chdir(tempfile.mkdtemp())
+    import requests
+
+    def offline(*args, **kwargs):
+        raise requests.ConnectionError("bench_parse不发出网络请求")
+
+    requests.Session.request = offline
+    import weibo
+
+    logging.disable(logging.CRITICAL)
+    with open(mblogs_path, encoding="utf-8") as f:
+        mblogs = json.load(f)
+    wb = weibo.Weibo(dict(CONFIG, remove_html_tag=remove_html_tag))
+    results = [dict(wb.parse_weibo(dict(mblog))) for mblog in mblogs]
+    digest = hashlib.md5(
+        json.dumps(results, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for mblog in mblogs:
+            wb.parse_weibo(dict(mblog))
+        best = min(best, time.perf_counter() - start)
+    print(json.dumps({"seconds": best / len(mblogs), "digest": digest}))
+
+
+def main():
+    if sys.argv[1:2] == ["--worker"]:
+        tree, mblogs_path, remove_html_tag, repeat = sys.argv[2:]
+        worker(tree, mblogs_path, int(remove_html_tag), int(repeat))
+        return
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="存档文件或文件夹")
+    parser.add_argument("--baseline", help="对比的git版本，如9aaee25")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数，取最快的一次")
+    args = parser.parse_args()
+
+    mblogs = load_mblogs(args.paths)
+    if not mblogs:
+        sys.exit("存档中没有微博")
+    print("存档中共有{}条微博".format(len(mblogs)))
+    with tempfile.TemporaryDirectory() as directory:
+        mblogs_path = os.path.join(directory, "mblogs.json")
+        with open(mblogs_path, "w", encoding="utf-8") as f:
+            json.dump(mblogs, f, ensure_ascii=False)
+        baseline_tree = export_tree(args.baseline, directory) if args.baseline else None
+        for remove_html_tag in (1, 0):
+            current, current_digest = run_tree(ROOT, mblogs_path, remove_html_tag, args.repeat)
+            line = "remove_html_tag={}: 当前 {:.1f}us/条".format(remove_html_tag, current * 1e6)
+            if baseline_tree:
+                baseline, baseline_digest = run_tree(
+                    baseline_tree, mblogs_path, remove_html_tag, args.repeat
+                )
+                line += "，{} {:.1f}us/条，加速{:.2f}倍，解析结果{}".format(
+                    args.baseline,
+                    baseline * 1e6,
+                    baseline / current,
+                    "一致" if baseline_digest == current_digest else "不一致",
+                )
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
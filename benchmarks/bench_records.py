@@ -0,0 +1,99 @@
+"""测量用OrderedDict、dict和WeiboRecord保存微博时的内存占用和构建耗时
+
+默认构建50000条字段值各不相同的微博（统计值本身占用的内存）；指定存档时改为用parse_weibo
+解析存档中的微博，再按同样的字段和值循环构建，各结构共用同一批值，只统计结构本身的开销：
+
+    python benchmarks/bench_records.py
+    python benchmarks/bench_records.py weibo/.archive
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from util.records import WeiboRecord  # noqa: E402
+
+
+def synthetic_row(i):
+    """字段顺序与parse_weibo的结果相同，每条微博的值都是新的对象"""
+    return [
+        ("user_id", 1669879400),
+        ("screen_name", "user"),
+        ("id", 4000000000000000 + i),
+        ("bid", "Mabc%d" % i),
+        ("text", "text %d" % i),
+        ("article_url", ""),
+        ("pics", ""),
+        ("video_url", ""),
+        ("live_photo_url", ""),
+        ("location", ""),
+        ("created_at", "2026-10-18"),
+        ("source", "iPhone"),
+        ("attitudes_count", i),
+        ("comments_count", 3),
+        ("reposts_count", 1),
+        ("topics", ""),
+        ("at_users", ""),
+        ("full_created_at", "2026-10-18 12:00:00"),
+    ]
+
+
+def archive_rows(paths):
+    """用当前代码解析存档中的微博，返回各条微博的(字段, 值)列表"""
+    import requests
+
+    def offline(*args, **kwargs):
+        raise requests.ConnectionError("bench_records不发出网络请求")
+
+    requests.Session.request = offline
+    from bench_parse import CONFIG, load_mblogs
+
+    import weibo
+
+    logging.disable(logging.CRITICAL)
+    wb = weibo.Weibo(dict(CONFIG))
+    return [list(wb.parse_weibo(dict(mblog)).items()) for mblog in load_mblogs(paths)]
+
+
+def build(cls, count, rows):
+    items = []
+    for i in range(count):
+        row = rows[i % len(rows)] if rows else synthetic_row(i)
+        item = cls()
+        for key, value in row:
+            item[key] = value
+        items.append(item)
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="*", help="存档文件或文件夹，不指定时使用生成的微博")
+    parser.add_argument("--count", type=int, default=50000, help="构建的微博数")
+    args = parser.parse_args()
+
+    rows = archive_rows(args.paths) if args.paths else None
+    if args.paths:
+        if not rows:
+            sys.exit("存档中没有微博")
+        print("存档中共有{}条微博，循环构建{}条".format(len(rows), args.count))
+    for name, cls in (("OrderedDict", OrderedDict), ("dict", dict), ("WeiboRecord", WeiboRecord)):
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        items = build(cls, args.count, rows)
+        seconds = time.perf_counter() - start
+        size = (tracemalloc.get_traced_memory()[0] - base) / args.count
+        tracemalloc.stop()
+        del items
+        print("{:12s} {:6.0f} B/条  构建{:.2f}秒".format(name, size, seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+
+import weibo
+from util.archive import ArchiveReplay
+
+
+def main(paths):
+    """
+    用原始响应存档重新生成结果，不发出任何网络请求。
+
+    Parameters:
+        paths (list): 存档文件或存档文件夹，默认为config.json中archive的path。
+
+    Returns:
+        None
+    """
+    config = weibo.get_config()
+    archive_config = config.pop("archive", None) or {}
+    paths = paths or [archive_config.get("path", "./weibo/.archive")]
+    # 重新解析时不下载文件、不调用LLM，也不使用断点日志、任务队列、源微博缓存和多进程
+    for key in [
+        "original_pic_download",
+        "retweet_pic_download",
+        "original_video_download",
+        "retweet_video_download",
+        "original_live_photo_download",
+        "retweet_live_photo_download",
+    ]:
+        config[key] = 0
+    config.pop("llm_config", None)
+    config.pop("work_queue", None)
+    config.pop("retweet_cache", None)
+    config["page_journal"] = 0
+    config["crawl_processes"] = 1
+
+    replay = ArchiveReplay(paths)
+    wb = weibo.Weibo(config)
+    wb.replay = replay
+    wb.user_config_file_path = ""
+    # 只重新解析存档中出现过的用户，config中有的用户沿用其since_date和query_list
+    configured = {str(c["user_id"]): c for c in wb.user_config_list}
+    wb.user_config_list = [
+        configured.get(
+            user_id,
+            {"user_id": user_id, "since_date": wb.since_date, "query_list": wb.query_list},
+        )
+        for user_id in replay.user_ids()
+    ]
+    weibo.logger.info("从存档中读取到%d个用户", len(wb.user_config_list))
+    try:
+        wb.start()
+    finally:
+        replay.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='*', help='存档文件或文件夹')
+    args = parser.parse_args()
+
+    main(args.paths)
@@ -59,7 +59,8 @@ config = {
     "post_config": {
         "api_url": "https://api.example.com",
         "api_token": ""
-    }
+    },
+    "work_queue": None  # 多台机器共同抓取时设置为共享的任务队列，格式见README中的work_queue
 }
 
 app = Flask(__name__)
@@ -100,10 +101,15 @@ def run_refresh_task(task_id, config):
         wb = Weibo(config)
         tasks[task_id]['progress'] = 50
         
-        wb.start()  # 爬取微博信息
+        # 爬取微博信息；设置了work_queue时，先把本次的用户加入任务队列，
+        # 再不断从队列中租用任务（包括其他节点加入的任务）抓取，直到队列中没有可租用的任务
+        wb.start()
         tasks[task_id]['progress'] = 100
         tasks[task_id]['state'] = 'SUCCESS'
-        tasks[task_id]['result'] = {"message": "微博列表已刷新"}
+        if wb.work_queue:
+            tasks[task_id]['result'] = {"message": "任务队列中的任务已抓取完毕"}
+        else:
+            tasks[task_id]['result'] = {"message": "微博列表已刷新"}
         
     except Exception as e:
         tasks[task_id]['state'] = 'FAILED'
@@ -126,8 +132,10 @@ def refresh():
     config_data = new_func()
     user_id_list = config_data.get('user_id_list') if config_data else None
     
-    # 验证参数
-    if not user_id_list or not isinstance(user_id_list, list):
+    # 验证参数，使用任务队列时可以不指定用户，只抓取队列中已有的任务
+    if user_id_list is None and config.get('work_queue'):
+        user_id_list = []
+    if not isinstance(user_id_list, list) or not (user_id_list or config.get('work_queue')):
         return jsonify({
             'error': 'Invalid user_id_list parameter'
         }), 400
@@ -153,7 +161,7 @@ def refresh():
         }
         current_task_id = task_id
         
-    executor.submit(run_refresh_task, task_id, config_data)
+    executor.submit(run_refresh_task, task_id, get_config(user_id_list))
     return jsonify({
         'task_id': task_id,
         'status': 'Task started',
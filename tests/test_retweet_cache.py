@@ -0,0 +1,49 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from util.records import WeiboRecord
+from util.retweet_cache import RetweetCache
+
+
+class RetweetCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "retweets.db")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def record(self, **fields):
+        record = WeiboRecord()
+        for key, value in fields.items():
+            record[key] = value
+        return record
+
+    def test_file_cache_is_shared_with_same_fingerprint(self):
+        RetweetCache(path=self.path, fingerprint="a").put(1, self.record(id=1, text="x"))
+        cached = RetweetCache(path=self.path, fingerprint="a").get(1)
+        self.assertEqual(dict(cached), {"id": 1, "text": "x"})
+
+    def test_fingerprint_mismatch_is_a_miss(self):
+        RetweetCache(path=self.path, fingerprint="a").put(1, self.record(id=1, text="x"))
+        cache = RetweetCache(path=self.path, fingerprint="b")
+        self.assertIsNone(cache.get(1))
+        cache.put(1, self.record(id=1))
+        self.assertEqual(dict(RetweetCache(path=self.path, fingerprint="b").get(1)), {"id": 1})
+        self.assertIsNone(RetweetCache(path=self.path, fingerprint="a").get(1))
+
+    def test_cache_without_fingerprint_column_is_upgraded(self):
+        con = sqlite3.connect(self.path)
+        con.execute(
+            "CREATE TABLE retweets (id integer PRIMARY KEY, cached_at real NOT NULL, data text NOT NULL)"
+        )
+        con.execute("INSERT INTO retweets VALUES (1, 9e99, ?)", ('{"id": 1}',))
+        con.commit()
+        con.close()
+        self.assertIsNone(RetweetCache(path=self.path, fingerprint="a").get(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
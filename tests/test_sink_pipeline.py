@@ -0,0 +1,148 @@
+import threading
+import time
+import unittest
+
+from util.sink_pipeline import SinkPipeline
+
+
+class SinkError(Exception):
+    pass
+
+
+class SinkPipelineTest(unittest.TestCase):
+    def test_each_sink_and_on_done_see_batches_in_order(self):
+        seen = {"a": [], "b": []}
+        done = []
+
+        def sink(name, delay):
+            def run(batch):
+                time.sleep(delay)
+                seen[name].append(batch.payload)
+
+            return run
+
+        pipeline = SinkPipeline([("a", sink("a", 0.002)), ("b", sink("b", 0))], done.append, 2)
+        for i in range(20):
+            pipeline.submit(i)
+        pipeline.close()
+        self.assertEqual(seen, {"a": list(range(20)), "b": list(range(20))})
+        self.assertEqual(done, list(range(20)))
+
+    def test_once_runs_shared_work_once_per_batch(self):
+        calls = []
+        results = []
+        lock = threading.Lock()
+
+        def sink(batch):
+            value = batch.once("interactions", lambda: calls.append(batch.payload) or batch.payload * 2)
+            with lock:
+                results.append(value)
+
+        pipeline = SinkPipeline([("a", sink), ("b", sink), ("c", sink)], queue_size=1)
+        for i in range(5):
+            pipeline.submit(i)
+        pipeline.close()
+        self.assertEqual(sorted(calls), list(range(5)))
+        self.assertEqual(sorted(results), sorted([i * 2 for i in range(5)] * 3))
+
+    def test_submit_blocks_when_a_sink_falls_behind(self):
+        release = threading.Event()
+
+        def slow(batch):
+            release.wait()
+
+        pipeline = SinkPipeline([("slow", slow)], queue_size=2)
+        submitted = []
+
+        def producer():
+            for i in range(5):
+                pipeline.submit(i)
+                submitted.append(i)
+
+        thread = threading.Thread(target=producer)
+        thread.start()
+        time.sleep(0.2)
+        # 一批在处理中，两批在队列中，第四次submit等待
+        self.assertEqual(submitted, [0, 1, 2])
+        release.set()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        pipeline.close()
+        self.assertEqual(submitted, list(range(5)))
+
+    def test_batches_before_a_failure_are_still_finished(self):
+        done = []
+        slow_started = threading.Event()
+        failed = threading.Event()
+
+        def slow(batch):
+            if batch.payload == 0:
+                slow_started.set()
+                failed.wait(5)  # 第1批出错时第0批还在这个sink中处理
+
+        def failing(batch):
+            if batch.payload == 1:
+                slow_started.wait(5)
+                failed.set()
+                raise SinkError("batch 1")
+
+        pipeline = SinkPipeline([("slow", slow), ("failing", failing)], done.append, 4)
+        for i in range(3):
+            pipeline.submit(i)
+        with self.assertRaises(SinkError):
+            pipeline.close()
+        self.assertEqual(done, [0])
+
+    def test_error_is_raised_once(self):
+        def failing(batch):
+            raise SinkError(batch.payload)
+
+        pipeline = SinkPipeline([("failing", failing)], queue_size=1)
+        pipeline.submit(0)
+        with self.assertRaises(SinkError):
+            for i in range(1, 50):
+                time.sleep(0.01)
+                pipeline.submit(i)
+        pipeline.close()
+
+    def test_on_done_error_stops_later_batches(self):
+        done = []
+        handled = []
+
+        def on_done(payload):
+            if payload == 1:
+                raise SinkError("on_done")
+            done.append(payload)
+
+        pipeline = SinkPipeline([("a", lambda batch: handled.append(batch.payload))], on_done, 0)
+        pipeline.submit(0)
+        pipeline.submit(1)
+        deadline = time.time() + 5
+        while pipeline.error is None and time.time() < deadline:
+            time.sleep(0.01)
+        with self.assertRaises(SinkError):
+            pipeline.submit(2)
+        pipeline.close()  # 异常已由submit抛出，不再重复抛出
+        self.assertEqual(done, [0])
+        self.assertEqual(handled, [0, 1])
+
+    def test_close_waits_for_submitted_batches_and_stops_threads(self):
+        done = []
+        pipeline = SinkPipeline([("a", lambda batch: time.sleep(0.01))], done.append, 2)
+        for i in range(5):
+            pipeline.submit(i)
+        pipeline.close()
+        self.assertEqual(done, list(range(5)))
+        self.assertTrue(all(not thread.is_alive() for thread in pipeline.threads))
+        pipeline.close()  # 重复调用不报错
+
+    def test_pipeline_without_sinks_still_calls_on_done(self):
+        done = []
+        pipeline = SinkPipeline([], done.append)
+        pipeline.submit("a")
+        pipeline.close()
+        self.assertEqual(done, ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from util.sqlite_writer import SQLiteWriter
+
+
+class SQLiteWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "test.db")
+        con = sqlite3.connect(self.path)
+        con.executescript(
+            """
+            CREATE TABLE weibo (id varchar(20) PRIMARY KEY, text text, content_hash varchar(32),
+                                attitudes_count integer);
+            CREATE TABLE bins (id integer PRIMARY KEY, path text NOT NULL);
+            """
+        )
+        con.close()
+        self.writer = SQLiteWriter(self.path, batch_size=100, upsert_tables=("weibo",))
+
+    def tearDown(self):
+        self.writer.close()
+        self.dir.cleanup()
+
+    def rows(self, sql):
+        con = sqlite3.connect(self.path)
+        try:
+            return con.execute(sql).fetchall()
+        finally:
+            con.close()
+
+    def test_flush_writes_all_groups_in_one_batch(self):
+        self.writer.insert("weibo", {"id": "1", "text": "a", "attitudes_count": 1})
+        self.writer.insert("bins", {"id": 1, "path": "a.jpg"})
+        self.writer.flush()
+        self.assertEqual(self.rows("SELECT id, text FROM weibo"), [("1", "a")])
+        self.assertEqual(self.rows("SELECT path FROM bins"), [("a.jpg",)])
+        self.assertEqual(self.writer.stats["inserted"], 2)
+
+    def test_failed_group_does_not_drop_other_groups(self):
+        self.writer.insert("weibo", {"id": "124", "text": "valid", "attitudes_count": 3})
+        self.writer.insert("bins", {"id": 1, "path": None})  # 违反NOT NULL
+        self.writer.flush()
+        self.assertEqual(self.rows("SELECT id, text FROM weibo"), [("124", "valid")])
+        self.assertEqual(self.rows("SELECT * FROM bins"), [])
+        self.assertEqual(self.writer.stats["failed"], 1)
+        self.assertEqual(self.writer.stats["inserted"], 1)
+        self.assertEqual(self.writer.pending_count, 0)
+
+    def test_operational_error_keeps_pending_rows(self):
+        self.writer.insert("weibo", {"id": "124", "text": "valid", "attitudes_count": 3})
+        self.writer.insert("missing", {"id": 1})
+        with self.assertRaises(sqlite3.OperationalError):
+            self.writer.flush()
+        self.assertEqual(self.rows("SELECT * FROM weibo"), [])
+        self.assertEqual(self.writer.pending_count, 2)
+        self.assertEqual(self.writer.stats["inserted"], 0)
+
+        con = sqlite3.connect(self.path)
+        con.execute("CREATE TABLE missing (id integer PRIMARY KEY)")
+        con.commit()
+        con.close()
+        self.writer.flush()
+        self.assertEqual(self.rows("SELECT id FROM weibo"), [("124",)])
+        self.assertEqual(self.rows("SELECT id FROM missing"), [(1,)])
+        self.assertEqual(self.writer.stats["inserted"], 2)
+
+    def test_upsert_skips_unchanged_and_updates_counters(self):
+        self.writer.insert("weibo", {"id": "1", "text": "a", "attitudes_count": 1})
+        self.writer.flush()
+        self.writer.insert("weibo", {"id": "1", "text": "a", "attitudes_count": 1})
+        self.writer.flush()
+        self.writer.insert("weibo", {"id": "1", "text": "a", "attitudes_count": 5})
+        self.writer.flush()
+        self.assertEqual(self.rows("SELECT attitudes_count FROM weibo"), [(5,)])
+        self.assertEqual(self.writer.stats["unchanged"], 1)
+        self.assertEqual(self.writer.stats["counters"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import time
+import unittest
+
+from util.work_queue import SQLiteWorkQueue
+
+
+class SQLiteWorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.queue = SQLiteWorkQueue(os.path.join(self.dir.name, "queue.db"))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_page_range_jobs_are_separate(self):
+        self.queue.enqueue(
+            [
+                {"user_id": "1", "start_page": 1, "end_page": 10},
+                {"user_id": "1", "start_page": 11, "end_page": 20},
+                {"user_id": "1", "start_page": 1, "end_page": 10},
+            ],
+            3600,
+        )
+        first = self.queue.lease("a", 60)
+        second = self.queue.lease("b", 60)
+        self.assertEqual((first.payload["start_page"], second.payload["start_page"]), (1, 11))
+        self.assertIsNone(self.queue.lease("c", 60))
+
+    def test_failed_job_waits_before_retry(self):
+        self.queue.enqueue([{"user_id": "1"}, {"user_id": "2"}], 3600)
+        job = self.queue.lease("a", 60)
+        self.assertEqual(job.attempts, 1)
+        self.queue.fail(job, "a", 0.2, 3)
+        # 出错的任务延后重试，其他任务照常租用
+        self.assertEqual(self.queue.lease("a", 60).payload["user_id"], "2")
+        self.assertIsNone(self.queue.lease("a", 60))
+        time.sleep(0.3)
+        retried = self.queue.lease("b", 60)
+        self.assertEqual((retried.id, retried.attempts), (job.id, 2))
+
+    def test_job_is_not_retried_after_max_attempts(self):
+        self.queue.enqueue([{"user_id": "1"}], 3600)
+        for _ in range(2):
+            job = self.queue.lease("a", 60)
+            self.queue.fail(job, "a", 0, 2)
+        self.assertIsNone(self.queue.lease("a", 60))
+        # 失败超过requeue_after秒后重新加入时重置重试次数
+        self.queue.enqueue([{"user_id": "1"}], 0)
+        job = self.queue.lease("a", 60)
+        self.assertEqual(job.attempts, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+from requests import HTTPError
+
+from util import jsoncodec
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_FLUSH_INTERVAL = 100  # 每写入多少条记录刷新一次压缩流
+
+
+def default_compression():
+    """安装了zstandard时使用zstd压缩，否则使用gzip"""
+    return "zstd" if zstandard else "gzip"
+
+
+def response_kind(url):
+    """由请求url得到响应类型，如getIndex、hotflow、repostTimeline、detail"""
+    path = urlparse(url).path.rstrip("/")
+    if path.startswith("/detail/"):
+        return "detail"
+    return path.split("/")[-1]
+
+
+class ResponseArchive:
+    """只追加的原始响应存档
+
+    每次运行写入一个新的压缩JSONL文件，每行是一次请求的原始响应及其用户、页码和时间，
+    修改解析逻辑后可以用reparse.py从存档重新生成结果，而不必重新抓取。
+    """
+
+    def __init__(self, dir_path, compression=None):
+        compression = compression or default_compression()
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("使用zstd压缩需要先运行 pip install zstandard")
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+        name = "raw-{}-{}.jsonl.{}".format(
+            time.strftime("%Y%m%d%H%M%S"), os.getpid(), "zst" if compression == "zstd" else "gz"
+        )
+        self.path = os.path.join(dir_path, name)
+        self.compression = compression
+        self.lock = threading.Lock()
+        self.file = None
+        self.count = 0
+
+    def _open(self):
+        if self.compression == "zstd":
+            raw = open(self.path, "wb")
+            return zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return gzip.open(self.path, "wb")
+
+    def record(self, url, params, response, user_id="", query=""):
+        """记录一次请求的响应"""
+        params = dict(params or {})
+        line = jsoncodec.dumpb(
+            {
+                "time": time.time(),
+                "kind": response_kind(url),
+                "user_id": str(user_id),
+                "query": query,
+                "page": params.get("page"),
+                "url": url,
+                "params": params,
+                "status": response.status_code,
+                "body": response.text,
+            }
+        )
+        with self.lock:
+            if self.file is None:
+                self.file = self._open()
+            self.file.write(line + b"\n")
+            self.count += 1
+            if self.count % ARCHIVE_FLUSH_INTERVAL == 0:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_archive(path):
+    """逐条读取存档文件中的记录，程序中断时未写完的末尾会被忽略"""
+    for line in read_archive_lines(path):
+        yield jsoncodec.loads(line)
+
+
+def read_archive_lines(path):
+    """逐行读取存档文件中未解析的记录"""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError("读取zstd存档需要先运行 pip install zstandard")
+        raw = open(path, "rb")
+        f = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+    else:
+        f = gzip.open(path, "rb")
+    buffer = b""
+    try:
+        while True:
+            try:
+                chunk = f.read(64 * 1024)
+            except (EOFError, OSError, getattr(zstandard, "ZstdError", OSError)):
+                break
+            if not chunk:
+                break
+            buffer += chunk
+            lines = buffer.split(b"\n")
+            buffer = lines.pop()
+            yield from lines
+    finally:
+        f.close()
+
+
+def archive_files(paths):
+    """展开目录，按文件名（即写入时间）排序返回存档文件"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.endswith(".jsonl.gz") or name.endswith(".jsonl.zst")
+            )
+        else:
+            files.append(path)
+    return sorted(files, key=os.path.basename)
+
+
+class ArchivedResponse:
+    """从存档中还原的响应，提供weibo.py用到的requests.Response接口"""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.headers = {}
+
+    def json(self):
+        return jsoncodec.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError("{} (存档中没有该请求)".format(self.status_code), response=self)
+
+
+def is_usable(record):
+    """响应是否为可用的数据，而不是请求失败、验证码等页面"""
+    if record["status"] != 200:
+        return False
+    if record["kind"] == "detail":
+        return "$render_data" in record["body"]
+    try:
+        js = jsoncodec.loads(record["body"])
+    except ValueError:
+        return False
+    return isinstance(js, dict) and (js.get("ok") == 1 or "data" in js)
+
+
+class ArchiveReplay:
+    """用存档中的响应代替网络请求
+
+    同一请求有多条记录时使用最新的一条可用响应，都不可用时使用最新的一条。
+    存档解压后写入一个临时文件，内存中只保存各请求对应记录的位置。
+    """
+
+    def __init__(self, paths):
+        self.offsets = {}  # 请求: (是否可用, 记录在临时文件中的位置, 长度)
+        self.users = {}  # 存档中出现的用户id，保持首次出现的顺序
+        self.lock = threading.Lock()
+        self.file = tempfile.TemporaryFile()
+        offset = 0
+        for path in archive_files(paths):
+            for line in read_archive_lines(path):
+                record = jsoncodec.loads(line)
+                key = self.key(record["url"], record["params"])
+                usable = is_usable(record)
+                previous = self.offsets.get(key)
+                if previous is None or usable or not previous[0]:
+                    self.offsets[key] = (usable, offset, len(line))
+                self.file.write(line)
+                offset += len(line)
+                if record["user_id"]:
+                    self.users.setdefault(record["user_id"], None)
+
+    def user_ids(self):
+        return list(self.users)
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def key(url, params):
+        params = {k: str(v) for k, v in (params or {}).items()}
+        return url, json.dumps(params, sort_keys=True)
+
+    def get(self, url, params=None):
+        position = self.offsets.get(self.key(url, params))
+        if position is None:
+            if response_kind(url) == "getIndex" and "page" in (params or {}):
+                # 存档中没有的微博页视为已经没有更多微博
+                return ArchivedResponse(200, '{"ok": 0, "data": {}}')
+            return ArchivedResponse(404, "{}")
+        _, offset, length = position
+        with self.lock:
+            self.file.seek(offset)
+            line = self.file.read(length)
+        record = jsoncodec.loads(line)
+        return ArchivedResponse(record["status"], record["body"])
@@ -0,0 +1,22 @@
+class CrawlContext:
+    """单个用户（及关键词）的抓取状态
+
+    每个正在抓取的用户拥有独立的上下文，多个用户并行抓取时互不干扰。
+    """
+
+    def __init__(self, user_config=None, query=""):
+        self.user_config = user_config or {}  # 用户配置,包含用户id和since_date
+        self.query = query
+        self.user = {}  # 存储目标微博用户信息
+        self.weibo = []  # 存储爬取到的所有微博信息
+        self.seen_ids = set()  # 该用户本次运行已抓取的微博id，由SeenIndex提供
+        self.stored_ids = frozenset()  # 之前的运行中该用户已写入的微博id
+        self.got_count = 0  # 存储爬取到的微博数
+        self.start_date = ""  # 获取用户第一条微博时的日期
+        self.first_crawler = False  # append模式下本次运行是否尚未记录该用户的最新微博id
+        self.guess_pin = False  # 微博取消了“置顶”字样的显示，因此默认猜测第一条都是置顶
+        self.last_weibo_id = ""  # 上次抓取到的最新微博id
+        self.last_weibo_date = ""  # 上次抓取到的最新微博日期
+        self.latest_weibo_id = ""  # 本次抓取到的最新微博id
+        self.journal = None  # 抓取日志，未开启时为None
+        self.sink_pipeline = None  # 后台写入流水线，同步写入时为None
@@ -0,0 +1,36 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from tqdm import tqdm
+
+
+class DownloadPool:
+    """有界的媒体下载线程池，同一主机同时进行的下载数不超过per_host"""
+
+    def __init__(self, max_workers=4, per_host=2):
+        self.max_workers = max(1, max_workers)
+        self.per_host = max(1, per_host)
+        self.host_slots = {}
+        self.lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_slots[host]
+
+    def _run(self, func, job):
+        with self._host_slot(job[0]):
+            return func(*job)
+
+    def run(self, func, jobs, desc="Download progress"):
+        """并发执行func(*job)，job的第一个元素必须是url，返回失败(返回值为假)的job列表"""
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._run, func, job): job for job in jobs}
+            for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                if not future.result():
+                    failed.append(futures[future])
+        return failed
@@ -0,0 +1,112 @@
+from lxml import etree
+
+LOCATION_ICON = "timeline_card_small_location_default.png"
+# 不含这些字符的微博正文没有html标签和实体，lxml解析后只会去掉开头的空白
+MARKUP_CHARS = ("<", "&", "\r", "\x00", "﻿")
+HTML_LEADING_SPACE = " \t\n\x0c"
+
+
+class ExtractedText:
+    """从微博正文html中提取出的信息"""
+
+    __slots__ = ("text", "article_url", "location", "topics", "at_users")
+
+    def __init__(self, text, article_url="", location="", topics="", at_users=""):
+        self.text = text
+        self.article_url = article_url
+        self.location = location
+        self.topics = topics
+        self.at_users = at_users
+
+
+def join_text_list(text_list):
+    """拼接正文中的文本节点，以 @ 或 # 开始的文本与前一个文本合并，避免没有必要的换行"""
+    text_list_modified = []
+    for ele in range(len(text_list)):
+        if ele > 0 and (text_list[ele-1].startswith(('@','#')) or text_list[ele].startswith(('@','#'))):
+            text_list_modified[-1] += text_list[ele]
+        else:
+            text_list_modified.append(text_list[ele])
+    return "\n".join(text_list_modified)
+
+
+def has_markup(text_body):
+    return text_body.isspace() or any(c in text_body for c in MARKUP_CHARS)
+
+
+def extract(text_body, remove_html_tag):
+    """一次遍历提取微博正文、头条文章url、发布位置、话题和@用户
+
+    结果与分别用xpath提取时相同：正文为全部文本节点（remove_html_tag为0时为原始html），
+    位置为定位图标所在span之后的下一个span的文本，话题为class为surl-text且首尾为#的span，
+    @用户为文本等于"@"+href[3:]的链接。正文不含html标签和实体时不经过lxml解析。
+    """
+    if not has_markup(text_body):
+        text = text_body.lstrip(HTML_LEADING_SPACE) if remove_html_tag else text_body
+        return ExtractedText(text)
+
+    selector = etree.HTML(f"{text_body}<hr>" if text_body.isspace() else text_body)
+    texts = []  # 按文档顺序排列的文本节点，即 //text()
+    starts = []  # 正在遍历的各层元素开始时texts的长度，元素的string(.)为texts[start:]
+    article_url = None
+    location = None
+    location_pending = False  # 已找到定位图标，下一个span的文本即为位置
+    location_start = None
+    topic_list = []
+    at_list = []
+    for event, element in etree.iterwalk(selector, events=("start", "end", "comment", "pi")):
+        if event == "comment" or event == "pi":
+            # 注释的内容不是文本节点，但注释之后的文本是
+            if element.tail:
+                texts.append(element.tail)
+            continue
+        if event == "start":
+            starts.append(len(texts))
+            if element.text:
+                texts.append(element.text)
+            tag = element.tag
+            if tag == "span":
+                if location_pending:
+                    location_pending = False
+                    location_start = element
+                elif location is None and location_start is None:
+                    for child in element:
+                        if child.tag == "img" and "src" in child.attrib:
+                            if LOCATION_ICON in child.attrib["src"]:
+                                location_pending = True
+                            break
+            elif tag == "a" and article_url is None and "data-url" in element.attrib:
+                article_url = element.attrib["data-url"]
+            continue
+
+        start = starts.pop()
+        if element.tag in ("span", "a"):
+            tag = element.tag
+            string = "".join(texts[start:])
+            if tag == "span":
+                if element is location_start:
+                    location = string
+                    location_start = None
+                if element.get("class") == "surl-text":
+                    if len(string) > 2 and string[0] == "#" and string[-1] == "#":
+                        topic_list.append(string[1:-1])
+            elif tag == "a":
+                href = element.get("href")
+                if href is not None and "@" + href[3:] == string:
+                    at_list.append(string[1:])
+        if element.tail and element is not selector:
+            texts.append(element.tail)
+
+    if remove_html_tag:
+        text = join_text_list(texts)
+    else:
+        text = text_body
+    if not ("".join(texts).startswith("发布了头条文章") and article_url and article_url.startswith("http://t.cn")):
+        article_url = ""
+    return ExtractedText(
+        text,
+        article_url,
+        location or "",
+        ",".join(topic_list),
+        ",".join(at_list),
+    )
@@ -0,0 +1,97 @@
+import copy
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 默认的连接池、超时和重试配置，可通过config.json中的http_config覆盖，
+# http_config["hosts"]可以按主机单独设置这些值
+DEFAULT_HTTP_CONFIG = {
+    "timeout": [5, 30],  # (连接超时, 读取超时)，单位为秒
+    "pool_connections": 10,  # 每个adapter缓存的主机连接池数量
+    "pool_maxsize": 10,  # 每个主机保持的keep-alive连接数
+    "max_retries": 3,  # 连接错误及status_forcelist中状态码的重试次数
+    "backoff_factor": 0.5,
+    "status_forcelist": [500, 502, 503, 504],
+    "hosts": {},
+}
+
+_config = copy.deepcopy(DEFAULT_HTTP_CONFIG)
+_sessions = {}
+_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """未显式指定timeout的请求使用adapter的默认超时"""
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def configure(http_config):
+    """设置全局HTTP配置，配置变化时已创建的共享session会被重建"""
+    global _config
+    new_config = copy.deepcopy(DEFAULT_HTTP_CONFIG)
+    new_config.update(http_config or {})
+    with _lock:
+        if new_config != _config:
+            _config = new_config
+            _sessions.clear()
+
+
+def _make_adapter(options):
+    retry = Retry(
+        total=options["max_retries"],
+        backoff_factor=options["backoff_factor"],
+        status_forcelist=options["status_forcelist"],
+        raise_on_status=False,
+    )
+    return TimeoutHTTPAdapter(
+        timeout=tuple(options["timeout"]),
+        pool_connections=options["pool_connections"],
+        pool_maxsize=options["pool_maxsize"],
+        max_retries=retry,
+    )
+
+
+def create_session(**overrides):
+    """按全局配置创建一个新的session，overrides覆盖默认项（不影响按主机的配置）"""
+    with _lock:
+        config = copy.deepcopy(_config)
+    options = {k: v for k, v in config.items() if k != "hosts"}
+    options.update(overrides)
+    session = requests.Session()
+    adapter = _make_adapter(options)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    for host, host_options in config["hosts"].items():
+        merged = dict(options)
+        merged.update(host_options)
+        host_adapter = _make_adapter(merged)
+        session.mount("http://" + host, host_adapter)
+        session.mount("https://" + host, host_adapter)
+    return session
+
+
+def get_option(name):
+    """返回全局配置中的一项（不含按主机的覆盖）"""
+    with _lock:
+        return copy.deepcopy(_config[name])
+
+
+def get_session(name="default"):
+    """返回按名称共享的session，同名调用方复用同一组keep-alive连接"""
+    with _lock:
+        session = _sessions.get(name)
+    if session is None:
+        session = create_session()
+        with _lock:
+            session = _sessions.setdefault(name, session)
+    return session
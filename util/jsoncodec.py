@@ -0,0 +1,96 @@
+import json
+
+from util.records import Record
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _default(obj):
+    """记录类型按dict编码"""
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+    _fast_loads = orjson.loads
+
+    def _fast_dumps(obj, indent):
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=_default, option=option)
+
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    _decoder = msgspec.json.Decoder()
+    _encoder = msgspec.json.Encoder(enc_hook=_default)
+
+    def _fast_loads(data):
+        try:
+            return _decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+    def _fast_dumps(obj, indent):
+        try:
+            data = _encoder.encode(obj)
+        except msgspec.EncodeError as e:
+            raise TypeError(str(e)) from e
+        return msgspec.json.format(data, indent=2) if indent else data
+
+else:
+    BACKEND = "json"
+    _fast_loads = None
+    _fast_dumps = None
+
+
+def loads(data, strict=True):
+    """解析JSON，data可以是str或bytes
+
+    安装了orjson或msgspec时优先使用，解析失败（如含有未转义的控制字符、超过64位的整数）时
+    再交给标准库json，因此解析结果和抛出的异常（ValueError）都与json.loads相同。
+    """
+    if _fast_loads is not None:
+        try:
+            return _fast_loads(data)
+        except ValueError:
+            pass
+    return json.loads(data, strict=strict)
+
+
+def _json_dumps(obj, indent):
+    return json.dumps(
+        obj,
+        ensure_ascii=False,
+        default=_default,
+        indent=2 if indent else None,
+        separators=None if indent else (",", ":"),
+    )
+
+
+def dumpb(obj, indent=False):
+    """编码为UTF-8的JSON bytes，不转义非ASCII字符，记录类型按dict编码"""
+    if _fast_dumps is not None:
+        try:
+            return _fast_dumps(obj, indent)
+        except TypeError:
+            pass
+    return _json_dumps(obj, indent).encode("utf-8")
+
+
+def dumps(obj, indent=False):
+    """编码为JSON字符串，不转义非ASCII字符，记录类型按dict编码"""
+    if _fast_dumps is not None:
+        try:
+            return _fast_dumps(obj, indent).decode("utf-8")
+        except TypeError:
+            pass
+    return _json_dumps(obj, indent)
@@ -1,8 +1,9 @@
 import json
 import logging
-import requests
 from typing import Dict, Any, Optional
 
+from util import http_client
+
 logger = logging.getLogger(__name__)
 
 class LLMAnalyzer:
@@ -36,10 +37,11 @@ class LLMAnalyzer:
                 "temperature": self.config.get('temperature', 0.7)
             }
             
-            response = requests.post(
+            response = http_client.get_session("llm").post(
                 f"{self.api_base}/chat/completions",
                 headers=headers,
-                json=data
+                json=data,
+                timeout=self.config.get('timeout', 60)
             )
             
             if response.status_code == 200:
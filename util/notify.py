@@ -1,5 +1,5 @@
-import requests
 import const
+from util import http_client
 
 
 def push_deer(append_str):
@@ -8,4 +8,4 @@ def push_deer(append_str):
         'text': append_str,
     }
     # 这里为了避免证书验证，使用http而非https
-    requests.get(url="http://api2.pushdeer.com/message/push", params=params)
+    http_client.get_session("notify").get(url="http://api2.pushdeer.com/message/push", params=params)
@@ -0,0 +1,44 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PageWindow:
+    """按页码顺序返回结果，同时保持最多window个页面请求在途
+
+    fetch为阻塞的取页函数，在独立线程池中执行，调用方在事件循环中逐页解析已返回的页面，
+    解析期间后续页面的请求仍在进行。
+    """
+
+    def __init__(self, fetch, pages, window):
+        self.fetch = fetch
+        self.pages = iter(pages)
+        self.window = max(1, window)
+        self.pending = deque()
+        self.executor = ThreadPoolExecutor(max_workers=self.window)
+
+    def _fill(self):
+        loop = asyncio.get_running_loop()
+        while len(self.pending) < self.window:
+            page = next(self.pages, None)
+            if page is None:
+                return
+            # run_in_executor会立即提交请求，不必等到下一次await
+            self.pending.append((page, loop.run_in_executor(self.executor, self.fetch, page)))
+
+    async def next(self):
+        """返回下一页的(page, js)，没有更多页面时返回None"""
+        self._fill()
+        if not self.pending:
+            return None
+        page, future = self.pending.popleft()
+        js = await future
+        self._fill()
+        return page, js
+
+    def cancel(self):
+        """提前结束时取消尚未开始的请求，已在执行的请求结果会被丢弃"""
+        for _, future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,97 @@
+import os
+import threading
+
+from util import jsoncodec
+
+
+class PageJournal:
+    """单个用户（及关键词）的抓取日志，用于程序中断后从上次的页码继续抓取
+
+    每抓完一页就把该页解析出的微博追加写入日志并落盘，微博写入文件或数据库后再记录一次flush及其覆盖到的页码。
+    后台写入时，flush可能记在之后抓取的页面后面，只有不晚于flush页码的页面视为已写入。
+    程序重新运行时，未写入的微博会被重新写入，然后从日志中的下一页继续抓取。
+    用户抓取完成后日志文件会被删除。
+    """
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = dict(meta, type="meta")  # 抓取参数变化（如since_date）时不能沿用旧日志
+        self.file = None
+        self.lock = threading.Lock()  # 抓取线程记录页面，写入线程记录flush
+        self.last_page = None  # 最后记录的页码
+
+    def load(self):
+        """读取上次中断时的日志，返回(最后一页页码, 是否已到达结束条件, 未写入的微博, 已抓取的微博id)
+
+        没有可用的日志时返回None。
+        """
+        if not os.path.isfile(self.path):
+            return None
+        last_page = None
+        is_end = False
+        pending = []  # (页码, 该页的微博)
+        ids = []
+        with open(self.path, encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                try:
+                    record = jsoncodec.loads(line)
+                except ValueError:
+                    break  # 中断时写了一半的行
+                if i == 0:
+                    if record != self.meta:
+                        return None
+                elif record["type"] == "page":
+                    last_page = record["page"]
+                    is_end = record["end"]
+                    pending.append((record["page"], record["weibos"]))
+                    ids.extend(w["id"] for w in record["weibos"])
+                elif record["type"] == "flush":
+                    page = record.get("page")  # 旧版本的flush没有页码，表示此前的页面都已写入
+                    pending = [] if page is None else [p for p in pending if p[0] > page]
+        if last_page is None:
+            return None
+        self.last_page = last_page
+        return last_page, is_end, [w for _, weibos in pending for w in weibos], ids
+
+    def open(self, resume):
+        """开始记录日志，resume为False时丢弃旧日志"""
+        dir_path = os.path.dirname(self.path)
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+        if resume:
+            self._truncate_partial_line()
+            self.file = open(self.path, "a", encoding="utf-8")
+        else:
+            self.file = open(self.path, "w", encoding="utf-8")
+            self._write(self.meta)
+
+    def _truncate_partial_line(self):
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                f.truncate(end)
+
+    def _write(self, record):
+        with self.lock:
+            self.file.write(jsoncodec.dumps(record) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def record_page(self, page, weibos, is_end):
+        """记录已抓完的一页及其解析出的微博"""
+        self._write({"type": "page", "page": page, "end": bool(is_end), "weibos": weibos})
+        self.last_page = page
+
+    def record_flush(self, page=None):
+        """记录第page页及之前的微博都已写入文件或数据库，page为None时表示此前记录的全部页面"""
+        self._write({"type": "flush", "page": page})
+
+    def close(self, finished):
+        """关闭日志，finished为True时说明该用户已抓取完成，删除日志"""
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+        if finished and os.path.isfile(self.path):
+            os.remove(self.path)
@@ -0,0 +1,60 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger("weibo")
+
+
+class RateController:
+    """加性增、乘性减(AIMD)的请求速率控制器
+
+    所有请求在发出前调用acquire()排队取得发送时间。请求正常返回时速率加性增加，
+    遇到403/418、验证码或超时时速率乘性减小，速率始终限制在[min_rate, max_rate]内，单位为次/秒。
+    控制器是线程安全的，可在多个抓取线程间共享同一速率预算。
+    """
+
+    def __init__(
+        self,
+        initial_rate=0.5,
+        min_rate=1 / 60,
+        max_rate=1.0,
+        increase=0.02,
+        decrease=0.5,
+    ):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.rate = min(max(initial_rate, min_rate), max_rate)
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """根据config中的rate_limit配置创建控制器，未配置的项使用默认值"""
+        options = config.get("rate_limit") or {}
+        keys = ["initial_rate", "min_rate", "max_rate", "increase", "decrease"]
+        return cls(**{k: options[k] for k in keys if k in options})
+
+    def acquire(self):
+        """阻塞直到允许发出下一个请求"""
+        with self.lock:
+            now = time.monotonic()
+            send_time = max(now, self.next_time)
+            self.next_time = send_time + 1 / self.rate
+        wait = send_time - now
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self):
+        """请求正常返回，加性增加速率"""
+        with self.lock:
+            self.rate = min(self.rate + self.increase, self.max_rate)
+
+    def on_throttle(self, reason):
+        """请求被限制，乘性减小速率，并按新速率推迟下一个请求"""
+        with self.lock:
+            self.rate = max(self.rate * self.decrease, self.min_rate)
+            self.next_time = max(self.next_time, time.monotonic() + 1 / self.rate)
+            rate = self.rate
+        logger.warning("请求受限(%s)，请求间隔调整为%.1f秒", reason, 1 / rate)
@@ -0,0 +1,258 @@
+from collections.abc import MutableMapping
+
+_MISSING = object()
+
+
+class Record(MutableMapping):
+    """用__slots__保存字段的记录，读写方式与dict相同
+
+    每条微博、评论和用户信息在写入文件或数据库之前都保存在内存中，用OrderedDict时每条记录
+    都要维护哈希表和双向链表，改用__slots__后只保存各字段的值。未赋值的字段视为不存在，
+    不在fields中的字段（如LLM分析结果、写入数据库时添加的retweet_id）保存在extra中。
+    遍历顺序为fields中的顺序，其后是extra中的字段，与原来OrderedDict中的顺序一致。
+    只有写入json、MongoDB等需要真正dict的地方才调用to_dict转换。
+    """
+
+    __slots__ = ("extra",)
+    fields = ()
+    field_set = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.field_set = frozenset(cls.fields)
+
+    def __init__(self, data=None, **kwargs):
+        self.extra = None
+        if data is not None:
+            self.update(data)
+        if kwargs:
+            self.update(kwargs)
+
+    @classmethod
+    def from_dict(cls, data):
+        """由dict（如从抓取日志中读出的微博）创建记录"""
+        return cls(data)
+
+    def __getitem__(self, key):
+        if key in self.field_set:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.field_set:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.field_set:
+            if getattr(self, key, _MISSING) is _MISSING:
+                raise KeyError(key)
+            delattr(self, key)
+        elif self.extra is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self.field_set:
+            return getattr(self, key, _MISSING) is not _MISSING
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        for name in self.fields:
+            if getattr(self, name, _MISSING) is not _MISSING:
+                yield name
+        if self.extra:
+            yield from list(self.extra)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def copy(self):
+        """浅复制，与dict.copy相同"""
+        return type(self)(self)
+
+    __copy__ = copy
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.to_dict())
+
+    def to_dict(self):
+        """转换为dict，嵌套的记录（如转发微博的源微博）也一并转换"""
+        result = {}
+        for name in self.fields:
+            value = getattr(self, name, _MISSING)
+            if value is not _MISSING:
+                result[name] = value.to_dict() if isinstance(value, Record) else value
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        self.extra = None
+        self.update(state)
+
+
+# 可由weibo_fields配置是否解析和保存的微博字段，其余字段（用户id、昵称、微博id、bid、发布时间及源微博）总会保存
+WEIBO_FIELDS = (
+    "text",
+    "article_url",
+    "pics",
+    "video_url",
+    "live_photo_url",
+    "location",
+    "source",
+    "attitudes_count",
+    "comments_count",
+    "reposts_count",
+    "topics",
+    "at_users",
+    "llm_analysis",
+)
+
+# csv结果文件中微博的各列及其表头
+WEIBO_HEADERS = (
+    ("id", "id"),
+    ("bid", "bid"),
+    ("text", "正文"),
+    ("article_url", "头条文章url"),
+    ("pics", "原始图片url"),
+    ("video_url", "视频url"),
+    ("live_photo_url", "Live Photo视频url"),
+    ("location", "位置"),
+    ("created_at", "日期"),
+    ("source", "工具"),
+    ("attitudes_count", "点赞数"),
+    ("comments_count", "评论数"),
+    ("reposts_count", "转发数"),
+    ("topics", "话题"),
+    ("at_users", "@用户"),
+    ("full_created_at", "完整日期"),
+)
+
+
+class WeiboRecord(Record):
+    """一条微博，字段顺序与parse_weibo_info中的赋值顺序相同，决定csv中的列顺序
+
+    转发微博的源微博也使用WeiboRecord，只是没有retweet字段。
+    """
+
+    fields = (
+        "user_id",
+        "screen_name",
+        "id",
+        "bid",
+        "text",
+        "article_url",
+        "pics",
+        "video_url",
+        "live_photo_url",
+        "location",
+        "created_at",
+        "source",
+        "attitudes_count",
+        "comments_count",
+        "reposts_count",
+        "topics",
+        "at_users",
+        "llm_analysis",
+        "retweet",
+        "full_created_at",
+    )
+    __slots__ = fields
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls(data)
+        retweet = record.get("retweet")
+        if retweet is not None and not isinstance(retweet, Record):
+            record.retweet = cls(retweet)
+        return record
+
+
+class UserRecord(Record):
+    """微博用户信息，字段顺序与get_user_info中的赋值顺序相同"""
+
+    fields = (
+        "id",
+        "screen_name",
+        "gender",
+        "birthday",
+        "location",
+        "education",
+        "company",
+        "registration_time",
+        "sunshine",
+        "statuses_count",
+        "followers_count",
+        "follow_count",
+        "description",
+        "profile_url",
+        "profile_image_url",
+        "avatar_hd",
+        "urank",
+        "mbrank",
+        "verified",
+        "verified_type",
+        "verified_reason",
+    )
+    __slots__ = fields
+
+
+class CommentRecord(Record):
+    """写入数据库的一条评论"""
+
+    fields = (
+        "id",
+        "bid",
+        "root_id",
+        "created_at",
+        "weibo_id",
+        "user_id",
+        "user_screen_name",
+        "user_avatar_url",
+        "text",
+        "pic_url",
+        "like_count",
+    )
+    __slots__ = fields
+
+
+class RepostRecord(Record):
+    """写入数据库的一条转发"""
+
+    fields = (
+        "id",
+        "bid",
+        "created_at",
+        "weibo_id",
+        "user_id",
+        "user_screen_name",
+        "user_avatar_url",
+        "text",
+        "like_count",
+    )
+    __slots__ = fields
+
+
+def to_dict(value):
+    """把记录转换为dict，普通dict（如尚未获取到的用户信息）原样复制"""
+    if isinstance(value, Record):
+        return value.to_dict()
+    return {k: v.to_dict() if isinstance(v, Record) else v for k, v in value.items()}
@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from util import jsoncodec
+from util.records import WeiboRecord
+
+
+class RetweetCache:
+    """按源微博id缓存解析后的源微博，多个用户转发同一条微博时只解析（及获取长微博）一次
+
+    内存中为LRU，最多保存max_size条；指定path时同时保存到SQLite文件，供其他抓取进程和下次运行使用。
+    缓存超过ttl秒后视为过期，重新解析以更新转发、评论和点赞数。文件中的每条缓存都记录了
+    fingerprint（解析结果包含的字段等），与当前的fingerprint不同时视为没有缓存。
+    """
+
+    def __init__(self, max_size=1000, ttl=3600, path=None, fingerprint=""):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.path = path
+        self.fingerprint = fingerprint
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 源微博id: (缓存时间, 源微博)
+        self.stored = set()  # 本次解析后已写入SQLite结果的源微博id
+        if path:
+            dir_path = os.path.dirname(path)
+            if dir_path and not os.path.isdir(dir_path):
+                os.makedirs(dir_path, exist_ok=True)
+            con = self._connect()
+            try:
+                with con:
+                    con.execute(
+                        """CREATE TABLE IF NOT EXISTS retweets (
+                            id integer PRIMARY KEY
+                            ,cached_at real NOT NULL
+                            ,data text NOT NULL
+                            ,fingerprint text
+                        )"""
+                    )
+                    columns = [row[1] for row in con.execute("PRAGMA table_info(retweets)")]
+                    if "fingerprint" not in columns:
+                        # 旧版本的缓存没有fingerprint，读取时都视为没有缓存
+                        con.execute("ALTER TABLE retweets ADD COLUMN fingerprint text")
+            finally:
+                con.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _load(self, retweet_id):
+        con = self._connect()
+        try:
+            row = con.execute(
+                "SELECT cached_at, data, fingerprint FROM retweets WHERE id = ?", (retweet_id,)
+            ).fetchone()
+        finally:
+            con.close()
+        if row is None or row[2] != self.fingerprint:
+            return None
+        return row[0], WeiboRecord.from_dict(jsoncodec.loads(row[1]))
+
+    def get(self, retweet_id):
+        """返回缓存的源微博的副本，没有缓存或已过期时返回None"""
+        retweet_id = int(retweet_id)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(retweet_id)
+            if entry is not None:
+                self.entries.move_to_end(retweet_id)
+            elif self.path:
+                entry = self._load(retweet_id)
+                if entry is not None and now - entry[0] < self.ttl:
+                    self._remember(retweet_id, entry)
+            if entry is None or now - entry[0] >= self.ttl:
+                return None
+            return entry[1].copy()
+
+    def put(self, retweet_id, retweet):
+        """缓存新解析的源微博"""
+        retweet_id = int(retweet_id)
+        entry = (time.time(), retweet.copy())
+        with self.lock:
+            self._remember(retweet_id, entry)
+            self.stored.discard(retweet_id)
+            if self.path:
+                con = self._connect()
+                try:
+                    with con:
+                        con.execute(
+                            """INSERT OR REPLACE INTO retweets (id, cached_at, data, fingerprint)
+                               VALUES (?, ?, ?, ?)""",
+                            (retweet_id, entry[0], jsoncodec.dumps(entry[1]), self.fingerprint),
+                        )
+                finally:
+                    con.close()
+
+    def _remember(self, retweet_id, entry):
+        self.entries[retweet_id] = entry
+        self.entries.move_to_end(retweet_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def claim_store(self, retweet_id):
+        """源微博自上次解析后是否尚未写入SQLite，返回True时调用方负责写入"""
+        retweet_id = int(retweet_id)
+        with self.lock:
+            if retweet_id in self.stored:
+                return False
+            self.stored.add(retweet_id)
+            return True
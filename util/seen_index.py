@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import threading
+
+
+class SeenIndex:
+    """按用户记录已抓取的微博id
+
+    内存中为每个用户保存一个set，同一次运行中该用户的各个关键词共用，判断是否已抓取为O(1)；
+    指定path时，写入结果后的微博id还会保存到SQLite文件中，下次运行时由stored()读出之前的运行已写入的微博。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.user_ids = {}
+        self.stored_ids = {}
+        if path:
+            dir_path = os.path.dirname(path)
+            if dir_path and not os.path.isdir(dir_path):
+                os.makedirs(dir_path, exist_ok=True)
+            with self._connect() as con:
+                con.execute(
+                    """CREATE TABLE IF NOT EXISTS seen (
+                        user_id text NOT NULL
+                        ,weibo_id integer NOT NULL
+                        ,PRIMARY KEY (user_id, weibo_id)
+                    ) WITHOUT ROWID"""
+                )
+            con.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def ids(self, user_id):
+        """返回该用户本次运行已抓取微博id的set，调用方可以直接向其中添加本次抓取到的id"""
+        with self.lock:
+            return self.user_ids.setdefault(str(user_id), set())
+
+    def stored(self, user_id):
+        """返回之前的运行中该用户已写入结果的微博id，未指定path时为空"""
+        user_id = str(user_id)
+        with self.lock:
+            ids = self.stored_ids.get(user_id)
+            if ids is None:
+                ids = frozenset()
+                if self.path:
+                    con = self._connect()
+                    try:
+                        ids = frozenset(
+                            row[0]
+                            for row in con.execute(
+                                "SELECT weibo_id FROM seen WHERE user_id = ?", (user_id,)
+                            )
+                        )
+                    finally:
+                        con.close()
+                self.stored_ids[user_id] = ids
+            return ids
+
+    def persist(self, user_id, weibo_ids):
+        """保存已写入结果的微博id"""
+        if not self.path or not weibo_ids:
+            return
+        user_id = str(user_id)
+        con = self._connect()
+        try:
+            with con:
+                con.executemany(
+                    "INSERT OR IGNORE INTO seen (user_id, weibo_id) VALUES (?, ?)",
+                    [(user_id, int(weibo_id)) for weibo_id in weibo_ids],
+                )
+        finally:
+            con.close()
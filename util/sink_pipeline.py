@@ -0,0 +1,134 @@
+import threading
+from queue import Queue
+
+_STOP = object()
+
+
+class SinkBatch:
+    """流水线中的一批数据，payload由提交方决定"""
+
+    def __init__(self, payload, sink_count, index=0):
+        self.payload = payload
+        self.index = index  # 提交顺序
+        self.lock = threading.Lock()
+        self.remaining = sink_count
+        self.sinks_done = threading.Event()  # 所有sink都已处理完
+        self.done = threading.Event()  # on_done也已执行完
+        self.results = {}
+        self.result_lock = threading.Lock()
+        if sink_count == 0:
+            self.sinks_done.set()
+
+    def once(self, key, func):
+        """多个sink共用的结果（如评论和转发），func只在第一次调用时执行"""
+        with self.result_lock:
+            if key not in self.results:
+                self.results[key] = func()
+            return self.results[key]
+
+    def finish_sink(self):
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.sinks_done.set()
+
+
+class SinkPipeline:
+    """后台写入流水线
+
+    每个写入方式（sink）有一个工作线程和一个最多缓存queue_size批数据的队列。抓取线程submit一批数据后立即返回，
+    各sink并发地按提交顺序处理每一批；某个sink跟不上时它的队列被填满，submit阻塞，抓取随之放慢。
+    一批数据被所有sink处理完后，由完成线程按提交顺序调用on_done(payload)。
+    某批数据出错后，sink不再处理之后提交的批次，这些批次也不调用on_done；之前提交的批次照常处理并调用on_done，
+    之后的第一次submit或close抛出该异常。
+    """
+
+    def __init__(self, sinks, on_done=None, queue_size=2):
+        self.on_done = on_done
+        self.error = None
+        self.error_raised = False
+        self.error_lock = threading.Lock()
+        self.failed_index = None  # 第一批出错的数据的提交序号
+        self.submitted = 0
+        self.closed = False
+        self.queues = []
+        self.threads = []
+        for name, func in sinks:
+            queue = Queue(maxsize=max(1, queue_size))
+            self.queues.append(queue)
+            self.threads.append(
+                threading.Thread(
+                    target=self._run_sink, args=(func, queue), name="sink-" + name, daemon=True
+                )
+            )
+        self.done_queue = Queue()  # 在途的批数已受各sink队列的限制
+        self.threads.append(
+            threading.Thread(target=self._run_done, name="sink-done", daemon=True)
+        )
+        for thread in self.threads:
+            thread.start()
+
+    def _fail(self, batch, error):
+        with self.error_lock:
+            if self.error is None:
+                self.error = error
+            if self.failed_index is None or batch.index < self.failed_index:
+                self.failed_index = batch.index
+
+    def _skipped(self, batch):
+        """出错的批次及其后提交的批次不再处理"""
+        failed_index = self.failed_index
+        return failed_index is not None and batch.index >= failed_index
+
+    def _raise_error(self):
+        if self.error is not None and not self.error_raised:
+            self.error_raised = True
+            raise self.error
+
+    def _run_sink(self, func, queue):
+        while True:
+            batch = queue.get()
+            if batch is _STOP:
+                return
+            try:
+                if not self._skipped(batch):
+                    func(batch)
+            except BaseException as e:
+                self._fail(batch, e)
+            finally:
+                batch.finish_sink()
+
+    def _run_done(self):
+        while True:
+            batch = self.done_queue.get()
+            if batch is _STOP:
+                return
+            batch.sinks_done.wait()
+            try:
+                if not self._skipped(batch) and self.on_done:
+                    self.on_done(batch.payload)
+            except BaseException as e:
+                self._fail(batch, e)
+            finally:
+                batch.done.set()
+
+    def submit(self, payload):
+        """提交一批数据，某个sink的队列已满时等待，返回SinkBatch"""
+        self._raise_error()
+        batch = SinkBatch(payload, len(self.queues), self.submitted)
+        self.submitted += 1
+        self.done_queue.put(batch)
+        for queue in self.queues:
+            queue.put(batch)
+        return batch
+
+    def close(self):
+        """等待已提交的数据全部处理完并结束各线程，处理出错时抛出异常"""
+        if not self.closed:
+            self.closed = True
+            for queue in self.queues:
+                queue.put(_STOP)
+            self.done_queue.put(_STOP)
+            for thread in self.threads:
+                thread.join()
+        self._raise_error()
@@ -0,0 +1,96 @@
+import sqlite3
+
+# 数据库结构的各个版本，按版本号顺序升级，已发布的版本不要修改，改动结构时追加新版本
+# 版本1为建表，建表语句取决于weibo_fields，由调用方传入
+MIGRATIONS = (
+    (1, "建表", None),
+    (
+        2,
+        "添加查询索引",
+        (
+            # 按用户导出评论、按时间列出微博
+            "CREATE INDEX IF NOT EXISTS idx_weibo_user_created ON weibo(user_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_weibo_created ON weibo(created_at)",
+            # 按微博查询评论和转发
+            "CREATE INDEX IF NOT EXISTS idx_comments_weibo ON comments(weibo_id)",
+            "CREATE INDEX IF NOT EXISTS idx_comments_root ON comments(root_id)",
+            "CREATE INDEX IF NOT EXISTS idx_reposts_weibo ON reposts(weibo_id)",
+            # 下载文件前判断是否已存入数据库
+            "CREATE INDEX IF NOT EXISTS idx_bins_path ON bins(path)",
+        ),
+    ),
+    (
+        3,
+        "添加内容哈希列",
+        (
+            # 重新抓取时跳过内容未变化的行，见util/upsert.py
+            "ALTER TABLE weibo ADD COLUMN content_hash varchar(32)",
+            "ALTER TABLE user ADD COLUMN content_hash varchar(32)",
+            "ALTER TABLE comments ADD COLUMN content_hash varchar(32)",
+            "ALTER TABLE reposts ADD COLUMN content_hash varchar(32)",
+        ),
+    ),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(con):
+    """返回数据库当前的结构版本，没有schema_version表时为0"""
+    try:
+        row = con.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def migrate(con, create_sql):
+    """把数据库升级到最新版本，create_sql为建表语句（以分号分隔的多条语句）
+
+    每个版本在一个事务中执行并记入schema_version表，多个进程同时升级时只有一个会执行。
+    返回升级前的版本。
+    """
+    version = get_version(con)
+    if version >= SCHEMA_VERSION:
+        return version
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        con.execute(
+            """CREATE TABLE IF NOT EXISTS schema_version (
+                version integer PRIMARY KEY
+                ,description text
+                ,applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )"""
+        )
+        # 取得写锁后重新读取，其他进程可能已经升级
+        version = get_version(con)
+        for target, description, statements in MIGRATIONS:
+            if target <= version:
+                continue
+            if statements is None:
+                statements = [s for s in create_sql.split(";") if s.strip()]
+            for statement in statements:
+                con.execute(statement)
+            con.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (target, description),
+            )
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+    return version
+
+
+def add_missing_columns(con, table, columns):
+    """给表添加缺少的列，columns为(列名, 类型)列表
+
+    weibo_fields决定建表时有哪些列，之后在weibo_fields中增加字段时，已有的数据库中没有对应的列。
+    """
+    existing = {row[1] for row in con.execute("PRAGMA table_info({})".format(table))}
+    missing = [(name, column_type) for name, column_type in columns if name not in existing]
+    if not missing:
+        return []
+    with con:
+        for name, column_type in missing:
+            con.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, name, column_type))
+    return [name for name, _ in missing]
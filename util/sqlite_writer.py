@@ -0,0 +1,155 @@
+import functools
+import logging
+import sqlite3
+import threading
+from collections import Counter, OrderedDict
+
+from util import upsert
+
+logger = logging.getLogger("weibo")
+
+# WAL模式下读写互不阻塞，synchronous=NORMAL时只在检查点同步磁盘，程序崩溃不会损坏数据库
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",  # 64MB页缓存
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+@functools.lru_cache(maxsize=64)
+def insert_sql(table, keys):
+    """生成向SQLite表插入或替换一行的SQL，keys为列名元组"""
+    return "INSERT OR REPLACE INTO {table}({keys}) VALUES({values})".format(
+        table=table, keys=",".join(keys), values=",".join(["?"] * len(keys))
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def update_sql(table, keys):
+    """生成按id更新一行中keys各列的SQL"""
+    return "UPDATE {table} SET {sets} WHERE id=?".format(
+        table=table, sets=",".join("{}=?".format(key) for key in keys)
+    )
+
+
+def connect(path, timeout=30):
+    """打开SQLite数据库并设置WAL等参数"""
+    con = sqlite3.connect(path, timeout=timeout, check_same_thread=False, cached_statements=256)
+    for pragma in PRAGMAS:
+        con.execute(pragma)
+    return con
+
+
+class SQLiteWriter:
+    """长期持有连接的SQLite批量写入器
+
+    写入的行按(表, 列)分组缓存，缓存满batch_size行或调用flush时在一个事务中用executemany写入，
+    避免每行提交一次带来的磁盘同步。多个线程可以共用同一个写入器，因此一组数据有误时只丢弃这一组，
+    不影响同一批中其他组（可能来自其他用户）的写入。
+    upsert_tables中的表（需有id主键和content_hash列）写入前先与已保存的行比较：
+    未变化的行跳过，只有计数变化的行只更新计数列，内容变化的行原地UPDATE，不再先删除再插入。
+    """
+
+    def __init__(self, path, batch_size=500, upsert_tables=()):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.upsert_tables = frozenset(upsert_tables)
+        self.stats = Counter()  # 各类写入的行数
+        self.lock = threading.RLock()
+        self.con = connect(path)
+        self.pending = OrderedDict()  # (表, 列): [行]
+        self.pending_count = 0
+
+    def insert(self, table, data):
+        """写入一行，data为列名到值的映射"""
+        with self.lock:
+            if table in self.upsert_tables:
+                data = upsert.with_hash(data)
+            self.pending.setdefault((table, tuple(data.keys())), []).append(tuple(data.values()))
+            self.pending_count += 1
+            if self.pending_count >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """在一个事务中写入全部缓存的行
+
+        每组(表, 列)在各自的savepoint中写入，某组数据有误（如违反约束、值的类型不支持）时回滚并丢弃该组，
+        其他组照常提交；数据库被锁、磁盘错误等OperationalError时整个事务回滚，缓存的行全部保留，
+        异常抛给调用方，之后的flush会重新写入。
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            stats = Counter()
+            with self.con:
+                # 显式开始事务，否则最外层savepoint的RELEASE会直接提交
+                if not self.con.in_transaction:
+                    self.con.execute("BEGIN")
+                for (table, keys), rows in self.pending.items():
+                    self.con.execute("SAVEPOINT flush_group")
+                    try:
+                        if table in self.upsert_tables:
+                            self._upsert(table, keys, rows, stats)
+                        else:
+                            self.con.executemany(insert_sql(table, keys), rows)
+                            stats["inserted"] += len(rows)
+                    except sqlite3.OperationalError:
+                        raise
+                    except sqlite3.Error as e:
+                        self.con.execute("ROLLBACK TO flush_group")
+                        stats["failed"] += len(rows)
+                        logger.error("写入SQLite表%s失败，丢弃%d行: %s", table, len(rows), e)
+                    self.con.execute("RELEASE flush_group")
+            self.stats.update(stats)
+            self.pending.clear()
+            self.pending_count = 0
+
+    def _upsert(self, table, keys, rows, stats):
+        rows = [dict(zip(keys, row)) for row in rows]
+        counters = upsert.counters_of(rows[0])
+        stored = self._stored(table, counters, [row["id"] for row in rows])
+        new, changed, counter_only, unchanged = upsert.classify(rows, stored)
+        if new:
+            self.con.executemany(insert_sql(table, keys), [tuple(row.values()) for row in new])
+        columns = tuple(key for key in keys if key != "id")
+        if changed:
+            self.con.executemany(
+                update_sql(table, columns),
+                [tuple(row[key] for key in columns) + (row["id"],) for row in changed],
+            )
+        if counter_only:
+            self.con.executemany(
+                update_sql(table, tuple(counters)),
+                [tuple(row[key] for key in counters) + (row["id"],) for row in counter_only],
+            )
+        stats["inserted"] += len(new)
+        stats["updated"] += len(changed)
+        stats["counters"] += len(counter_only)
+        stats["unchanged"] += unchanged
+
+    def _stored(self, table, counters, ids):
+        """查询已保存的行的content_hash和计数列，返回{str(id): 行}"""
+        columns = ["id", upsert.HASH_FIELD] + counters
+        stored = {}
+        for chunk in upsert.chunks(ids):
+            sql = "SELECT {} FROM {} WHERE id IN ({})".format(
+                ",".join(columns), table, ",".join(["?"] * len(chunk))
+            )
+            for row in self.con.execute(sql, chunk):
+                stored[str(row[0])] = dict(zip(columns, row))
+        return stored
+
+    def query_one(self, sql, params=(), tables=()):
+        """查询一行，tables中的表有尚未写入的行时先写入"""
+        with self.lock:
+            if any(table in tables for table, _ in self.pending):
+                self.flush()
+            return self.con.execute(sql, params).fetchone()
+
+    def close(self):
+        with self.lock:
+            try:
+                self.flush()
+            finally:
+                self.con.close()
@@ -0,0 +1,68 @@
+import hashlib
+
+from util import jsoncodec
+
+# 保存内容哈希的列（MongoDB中为字段）
+HASH_FIELD = "content_hash"
+# 计数列，不计入内容哈希，只有这些列变化时只更新这些列
+COUNTER_FIELDS = frozenset(
+    [
+        "attitudes_count",
+        "comments_count",
+        "reposts_count",
+        "like_count",
+        "statuses_count",
+        "followers_count",
+        "follower_count",
+        "follow_count",
+    ]
+)
+
+
+def content_hash(data):
+    """计算一行除计数列外各列内容的哈希"""
+    items = [[key, data[key]] for key in sorted(data) if key not in COUNTER_FIELDS and key != HASH_FIELD]
+    return hashlib.blake2b(jsoncodec.dumpb(items), digest_size=16).hexdigest()
+
+
+def with_hash(data):
+    """返回加上content_hash的副本"""
+    row = dict(data)
+    row[HASH_FIELD] = content_hash(row)
+    return row
+
+
+def counters_of(row):
+    """一行中的计数列"""
+    return [key for key in row if key in COUNTER_FIELDS]
+
+
+def classify(rows, stored):
+    """按已保存的内容判断各行如何写入
+
+    rows中每行都含id和content_hash，同一id出现多次时以最后一次为准；
+    stored为{str(id): 已保存的行}，已保存的行含content_hash和计数列。
+    返回(新增的行, 内容有变化的行, 只有计数变化的行, 未变化的行数)。
+    """
+    latest = {}
+    for row in rows:
+        latest[str(row["id"])] = row
+    new, changed, counter_only = [], [], []
+    unchanged = 0
+    for row_id, row in latest.items():
+        old = stored.get(row_id)
+        if old is None:
+            new.append(row)
+        elif old.get(HASH_FIELD) != row[HASH_FIELD]:
+            changed.append(row)
+        elif any(old.get(key) != row[key] for key in counters_of(row)):
+            counter_only.append(row)
+        else:
+            unchanged += 1
+    return new, changed, counter_only, unchanged
+
+
+def chunks(items, size=500):
+    """按size个一组切分，用于拼接IN (...)查询"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
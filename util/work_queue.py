@@ -0,0 +1,237 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+
+def job_key(payload):
+    """任务的唯一标识：用户id和页码范围，since_date等随运行时间变化的配置不参与去重"""
+    return "{}:{}:{}".format(
+        payload["user_id"], payload.get("start_page", ""), payload.get("end_page", "")
+    )
+
+
+class Job:
+    """从队列中租到的一个抓取任务，payload为用户配置（可包含start_page/end_page页码范围）"""
+
+    def __init__(self, job_id, payload, attempts=1):
+        self.id = job_id
+        self.payload = payload
+        self.attempts = attempts  # 包括本次在内被租用的次数
+
+
+class WorkQueue(ABC):
+    """多节点共享的抓取任务队列接口
+
+    节点通过lease()租用任务，租约在lease_seconds秒内有效，抓取期间需定期heartbeat()续约；
+    节点崩溃后租约过期，任务会被其他节点重新租用；抓取出错的任务由fail()延后重试。
+    新的存储后端实现这些方法后注册到BACKENDS即可。
+    """
+
+    @abstractmethod
+    def enqueue(self, payloads, requeue_after):
+        """加入任务，已存在的相同任务不会重复加入；完成或失败超过requeue_after秒的任务重新变为待抓取"""
+
+    @abstractmethod
+    def lease(self, worker_id, lease_seconds):
+        """租用一个待抓取或租约已过期的任务，没有任务时返回None"""
+
+    @abstractmethod
+    def heartbeat(self, job, worker_id, lease_seconds):
+        """为任务续约，租约已被其他节点取得时返回False"""
+
+    @abstractmethod
+    def complete(self, job, worker_id):
+        """标记任务完成"""
+
+    @abstractmethod
+    def release(self, job, worker_id):
+        """放弃任务，使其立即可被其他节点租用"""
+
+    @abstractmethod
+    def fail(self, job, worker_id, retry_after, max_attempts):
+        """任务抓取出错：retry_after秒后可再次租用，已租用max_attempts次时标记为失败不再租用"""
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """以共享SQLite文件为存储的任务队列，各节点需能访问同一个文件"""
+
+    def __init__(self, path):
+        dir_path = os.path.dirname(path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+        self.path = path
+        con = self._connect()
+        try:
+            con.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id integer PRIMARY KEY AUTOINCREMENT
+                    ,job_key text NOT NULL UNIQUE
+                    ,payload text NOT NULL
+                    ,state varchar(10) NOT NULL DEFAULT 'pending'
+                    ,worker_id text
+                    ,lease_expires real
+                    ,finished_at real
+                    ,attempts integer NOT NULL DEFAULT 0
+                    ,available_at real
+                )"""
+            )
+            columns = [row[1] for row in con.execute("PRAGMA table_info(jobs)")]
+            if "available_at" not in columns:
+                # 兼容旧版本创建的任务队列
+                con.execute("ALTER TABLE jobs ADD COLUMN available_at real")
+        finally:
+            con.close()
+
+    def _connect(self):
+        # isolation_level=None时由BEGIN IMMEDIATE显式控制事务，保证租用操作的原子性
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _transaction(self, func):
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            result = func(con)
+            con.execute("COMMIT")
+            return result
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+    def enqueue(self, payloads, requeue_after):
+        def run(con):
+            now = time.time()
+            for payload in payloads:
+                key = job_key(payload)
+                data = json.dumps(payload, ensure_ascii=False)
+                con.execute(
+                    "INSERT OR IGNORE INTO jobs (job_key, payload) VALUES (?, ?)",
+                    (key, data),
+                )
+                con.execute(
+                    """UPDATE jobs SET state = 'pending', worker_id = NULL, payload = ?,
+                       attempts = 0, available_at = NULL
+                       WHERE job_key = ? AND state IN ('done', 'failed') AND finished_at < ?""",
+                    (data, key, now - requeue_after),
+                )
+
+        self._transaction(run)
+
+    def lease(self, worker_id, lease_seconds):
+        def run(con):
+            now = time.time()
+            row = con.execute(
+                """SELECT id, payload, attempts FROM jobs
+                   WHERE (state = 'pending' AND (available_at IS NULL OR available_at <= ?))
+                      OR (state = 'leased' AND lease_expires < ?)
+                   ORDER BY id LIMIT 1""",
+                (now, now),
+            ).fetchone()
+            if row is None:
+                return None
+            con.execute(
+                """UPDATE jobs SET state = 'leased', worker_id = ?, lease_expires = ?,
+                   attempts = attempts + 1 WHERE id = ?""",
+                (worker_id, now + lease_seconds, row[0]),
+            )
+            return Job(row[0], json.loads(row[1]), row[2] + 1)
+
+        return self._transaction(run)
+
+    def heartbeat(self, job, worker_id, lease_seconds):
+        def run(con):
+            cur = con.execute(
+                """UPDATE jobs SET lease_expires = ?
+                   WHERE id = ? AND state = 'leased' AND worker_id = ?""",
+                (time.time() + lease_seconds, job.id, worker_id),
+            )
+            return cur.rowcount == 1
+
+        return self._transaction(run)
+
+    def complete(self, job, worker_id):
+        def run(con):
+            con.execute(
+                """UPDATE jobs SET state = 'done', finished_at = ?, lease_expires = NULL
+                   WHERE id = ? AND worker_id = ?""",
+                (time.time(), job.id, worker_id),
+            )
+
+        self._transaction(run)
+
+    def release(self, job, worker_id):
+        def run(con):
+            con.execute(
+                """UPDATE jobs SET state = 'pending', worker_id = NULL, lease_expires = NULL
+                   WHERE id = ? AND state = 'leased' AND worker_id = ?""",
+                (job.id, worker_id),
+            )
+
+        self._transaction(run)
+
+    def fail(self, job, worker_id, retry_after, max_attempts):
+        def run(con):
+            now = time.time()
+            if job.attempts >= max_attempts:
+                con.execute(
+                    """UPDATE jobs SET state = 'failed', finished_at = ?, lease_expires = NULL
+                       WHERE id = ? AND state = 'leased' AND worker_id = ?""",
+                    (now, job.id, worker_id),
+                )
+            else:
+                con.execute(
+                    """UPDATE jobs SET state = 'pending', worker_id = NULL, lease_expires = NULL,
+                       available_at = ? WHERE id = ? AND state = 'leased' AND worker_id = ?""",
+                    (now + retry_after, job.id, worker_id),
+                )
+
+        self._transaction(run)
+
+
+BACKENDS = {"sqlite": SQLiteWorkQueue}
+
+
+def create_work_queue(options):
+    """根据config中的work_queue配置创建任务队列"""
+    backend = BACKENDS[options.get("backend", "sqlite")]
+    return backend(options.get("path", "./weibo/work_queue.db"))
+
+
+def default_worker_id():
+    """当前节点、进程和线程的唯一标识"""
+    return "{}-{}-{}".format(socket.gethostname(), os.getpid(), threading.get_ident())
+
+
+class LeaseKeeper:
+    """抓取期间在后台线程中定期为任务续约"""
+
+    def __init__(self, queue, job, worker_id, lease_seconds, logger):
+        self.queue = queue
+        self.job = job
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.logger = logger
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.lease_seconds / 3):
+            try:
+                if not self.queue.heartbeat(self.job, self.worker_id, self.lease_seconds):
+                    self.logger.warning("任务%s的租约已失效，可能已被其他节点重新抓取", self.job.id)
+                    return
+            except sqlite3.Error as e:
+                self.logger.warning("任务%s续约失败: %s", self.job.id, e)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import asyncio
 import codecs
 import copy
 import csv
@@ -8,29 +9,53 @@ import json
 import logging
 import logging.config
 import math
+import multiprocessing
 import os
 import random
 import re
 import sqlite3
 import sys
+import threading
 import warnings
 import webbrowser
+import zlib
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import date, datetime, timedelta
 from pathlib import Path
+from queue import Empty, Full
 from time import sleep
+from urllib.request import pathname2url
 
 import requests
 from requests.exceptions import RequestException
-from lxml import etree
-from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
 import const
-from util import csvutil
+from util import csvutil, html_extract, http_client, jsoncodec, sqlite_schema, upsert
 from util.dateutil import convert_to_days_ago
 from util.notify import push_deer
 from util.llm_analyzer import LLMAnalyzer  # 导入 LLM 分析器
+from util.page_fetcher import PageWindow
+from util.page_journal import PageJournal
+from util.archive import ResponseArchive, zstandard
+from util.crawl_context import CrawlContext
+from util.download_pool import DownloadPool
+from util.rate_limiter import RateController
+from util.records import (
+    WEIBO_FIELDS,
+    WEIBO_HEADERS,
+    CommentRecord,
+    RepostRecord,
+    UserRecord,
+    WeiboRecord,
+    to_dict,
+)
+from util.retweet_cache import RetweetCache
+from util.seen_index import SeenIndex
+from util.sink_pipeline import SinkPipeline
+from util.sqlite_writer import SQLiteWriter
+from util.work_queue import LeaseKeeper, create_work_queue, default_worker_id
 
 warnings.filterwarnings("ignore")
 
@@ -43,28 +68,88 @@ logger = logging.getLogger("weibo")
 
 # 日期时间格式
 DTFORMAT = "%Y-%m-%dT%H:%M:%S"
+# 下载图片/视频时每次写入磁盘的块大小
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# 多进程模式下SQLite写入队列的长度上限，以及写入进程每个事务写入的行数
+SQLITE_QUEUE_SIZE = 10000
+SQLITE_WRITE_BATCH_SIZE = 500
+# 写入前与已保存内容比较、跳过未变化行的SQLite表
+SQLITE_UPSERT_TABLES = ("weibo", "user", "comments", "reposts")
+# SQLite中weibo表的各列，未在weibo_fields中的字段不建列
+SQLITE_WEIBO_COLUMNS = (
+    ("id", "varchar(20) NOT NULL"),
+    ("bid", "varchar(12) NOT NULL"),
+    ("user_id", "varchar(20)"),
+    ("screen_name", "varchar(30)"),
+    ("text", "varchar(2000)"),
+    ("article_url", "varchar(100)"),
+    ("topics", "varchar(200)"),
+    ("at_users", "varchar(1000)"),
+    ("pics", "varchar(3000)"),
+    ("video_url", "varchar(1000)"),
+    ("live_photo_url", "varchar(1000)"),
+    ("location", "varchar(100)"),
+    ("created_at", "DATETIME"),
+    ("source", "varchar(30)"),
+    ("attitudes_count", "INT"),
+    ("comments_count", "INT"),
+    ("reposts_count", "INT"),
+    ("retweet_id", "varchar(20)"),
+)
+RETWEET_CACHE_FORMAT = 1  # 源微博缓存的格式版本，parse_weibo的解析结果变化时加一
+PARSE_POOL_MIN_BATCH = 8  # 一页中的微博少于此数时直接在当前进程解析
+# 需要解析微博正文html才能得到的字段
+HTML_FIELDS = frozenset(["text", "article_url", "location", "topics", "at_users"])
+# 长微博需要请求全文或详情页才能得到完整值的字段，都不在weibo_fields中时不请求长微博
+LONG_WEIBO_FIELDS = HTML_FIELDS | {"pics"}
+# 会写入评论和转发的写入方式，其中RECORD_SINKS写入解析后的评论和转发记录
+# csv默认只写入评论，设置csv_reposts后才写入转发
+RECORD_SINKS = frozenset(["json", "mysql", "mongo", "sqlite"])
+INTERACTION_SINKS = RECORD_SINKS | {"csv"}
+
+
+def context_property(name):
+    """把Weibo上的属性读写转发到当前线程的抓取上下文"""
+    return property(
+        lambda self: getattr(self.context, name),
+        lambda self, value: setattr(self.context, name, value),
+    )
+
 
 class Weibo(object):
+    # 以下属性属于单个用户的抓取状态，保存在当前线程的CrawlContext中
+    user_config = context_property("user_config")
+    query = context_property("query")
+    user = context_property("user")
+    weibo = context_property("weibo")
+    seen_ids = context_property("seen_ids")
+    stored_ids = context_property("stored_ids")
+    got_count = context_property("got_count")
+    start_date = context_property("start_date")
+    first_crawler = context_property("first_crawler")
+    guess_pin = context_property("guess_pin")
+    last_weibo_id = context_property("last_weibo_id")
+    last_weibo_date = context_property("last_weibo_date")
+    latest_weibo_id = context_property("latest_weibo_id")
+    journal = context_property("journal")
+    sink_pipeline = context_property("sink_pipeline")
+
     def __init__(self, config):
         """Weibo类初始化"""
         self.validate_config(config)
+        self.config = config
         self.only_crawl_original = config["only_crawl_original"]  # 取值范围为0、1,程序默认值为0,代表要爬取用户的全部微博,1代表只爬取用户的原创微博
         self.remove_html_tag = config[
             "remove_html_tag"
         ]  # 取值范围为0、1, 0代表不移除微博中的html tag, 1代表移除
-        since_date = config["since_date"]
         # since_date 若为整数，则取该天数之前的日期；若为 yyyy-mm-dd，则增加时间
-        if isinstance(since_date, int):
-            since_date = date.today() - timedelta(since_date)
-            since_date = since_date.strftime(DTFORMAT)
-        elif self.is_date(since_date):
-            since_date = "{}T00:00:00".format(since_date)
-        elif self.is_datetime(since_date):
-            pass
-        else:
-            logger.error("since_date 格式不正确，请确认配置是否正确")
-            sys.exit()
+        since_date = self.normalize_date(config["since_date"], "00:00:00")
         self.since_date = since_date  # 起始时间，即爬取发布日期从该值到现在的微博，形式为yyyy-mm-ddThh:mm:ss，如：2023-08-21T09:23:03
+        until_date = config.get("until_date", "")
+        # until_date 与 since_date 格式相同；若为 yyyy-mm-dd，则包含当天全天的微博
+        if until_date != "":
+            until_date = self.normalize_date(until_date, "23:59:59")
+        self.until_date = until_date  # 结束时间，只爬取发布日期不晚于该值的微博，为空代表爬取到最新的微博
         self.start_page = config.get("start_page", 1)  # 开始爬的页，如果中途被限制而结束可以用此定义开始页码
         self.write_mode = config[
             "write_mode"
@@ -85,6 +170,12 @@ class Weibo(object):
         # 新增Live Photo视频下载配置
         self.original_live_photo_download = config.get("original_live_photo_download", 0)
         self.retweet_live_photo_download = config.get("retweet_live_photo_download", 0)
+        self.download_pool = DownloadPool(
+            config.get("download_workers", 4), config.get("download_per_host", 2)
+        )  # 图片/视频并发下载线程数及同一主机的并发下载数
+        self.sqlite_lock = threading.Lock()  # 保护sqlite_writer的创建和关闭
+        self.sqlite_writer = None  # 单进程模式下批量写入SQLite，见get_sqlite_writer
+        self.sqlite_reader = None  # 多进程模式下抓取进程查询SQLite用的只读连接，见sqlite_query_one
         
         self.download_comment = config["download_comment"]  # 1代表下载评论,0代表不下载
         self.comment_max_download_count = config[
@@ -94,6 +185,7 @@ class Weibo(object):
         self.repost_max_download_count = config[
             "repost_max_download_count"
         ]  # 如果设置了下转发，每条微博转发数会限制在这个值内
+        self.csv_reposts = config.get("csv_reposts", 0)  # 1代表把转发也写入csv，0代表csv只写入评论
         self.user_id_as_folder_name = config.get(
             "user_id_as_folder_name", 0
         )  # 结果目录名，取值为0或1，决定结果文件存储在用户昵称文件夹里还是用户id文件夹里
@@ -142,29 +234,35 @@ class Weibo(object):
         self.mongodb_URI = config.get("mongodb_URI")  # MongoDB数据库连接字符串，可以不填
         self.post_config = config.get("post_config")  # post_config，可以不填
         self.page_weibo_count = config.get("page_weibo_count")  # page_weibo_count，爬取一页的微博数，默认10页
+        self.page_concurrency = config.get("page_concurrency", 1)  # 同一用户同时在途的页面请求数，1代表逐页串行获取
+        self.long_weibo_concurrency = config.get("long_weibo_concurrency", 4)  # 同一页中并发获取长微博全文的请求数，1代表逐条获取
+        self.sink_queue_size = config.get("sink_queue_size", 0)  # 每个写入方式在后台最多缓存的批数，0代表在抓取线程中同步写入
+        self.rate_controller = RateController.from_config(config)  # 所有微博接口请求共享的速率控制器
         
         # 初始化 LLM 分析器
-        self.llm_analyzer = LLMAnalyzer(config) if config.get("llm_config") else None
+        # 要解析和保存的微博字段，默认为全部字段
+        self.weibo_fields = frozenset(config.get("weibo_fields") or WEIBO_FIELDS)
+        self.llm_analyzer = (
+            LLMAnalyzer(config)
+            if config.get("llm_config") and "llm_analysis" in self.weibo_fields
+            else None
+        )
         
         user_id_list = config["user_id_list"]
-        requests_session = requests.Session()
+        # 所有对外请求都通过http_client创建的连接池发出，微博接口的session单独持有cookie
+        http_client.configure(config.get("http_config"))
+        # 微博接口的5xx和429不在adapter中重试，而是返回给weibo_get，由速率控制器放慢后再重试
+        self.api_retry_statuses = frozenset(http_client.get_option("status_forcelist")) | {429}
+        self.api_max_retries = http_client.get_option("max_retries")
+        requests_session = http_client.create_session(
+            pool_maxsize=max(10, self.page_concurrency + self.long_weibo_concurrency),
+            status_forcelist=[],
+        )
         requests_session.cookies.update(core_cookies)
 
         self.session = requests_session
-        try:
-            # 请求只带 SUB
-            # 服务器下发适配 m.weibo.cn 的新指纹
-            self.session.get("https://m.weibo.cn", headers=self.headers, timeout=10)
-            logger.info("Session 预热成功，服务器已下发最新指纹。")
-            
-        except Exception as e:
-            #请求失败时，启用备份
-            logger.warning(f"Session 预热失败 ({e})，正在启用备份 Cookie...")
-            self.session.cookies.update(backup_cookies) # 把旧指纹装进去救急
+        self.backup_cookies = backup_cookies  # 预热失败时使用
 
-        adapter = HTTPAdapter(max_retries=5)
-        self.session.mount('http://', adapter)
-        self.session.mount('https://', adapter)
         # 避免卡住
         if isinstance(user_id_list, list):
             random.shuffle(user_id_list)
@@ -192,16 +290,79 @@ class Weibo(object):
             ]
 
         self.user_config_list = user_config_list  # 要爬取的微博用户的user_config列表
-        self.user_config = {}  # 用户配置,包含用户id和since_date
-        self.start_date = ""  # 获取用户第一条微博时的日期
-        self.query = ""
-        self.user = {}  # 存储目标微博用户信息
-        self.got_count = 0  # 存储爬取到的微博数
-        self.weibo = []  # 存储爬取到的所有微博信息
-        self.weibo_id_list = []  # 存储爬取到的所有微博id
-        self.long_sleep_count_before_each_user = 0 #每个用户前的长时间sleep避免被ban
+        self.user_concurrency = config.get("user_concurrency", 1)  # 同时抓取的用户数，1代表逐个用户抓取
+        self.local = threading.local()  # 保存各线程当前的抓取上下文
+        self.file_lock = threading.RLock()  # 并行抓取时保护users.csv和用户配置文件的写入
+        self.captcha_lock = threading.Lock()  # 同一时间只提示一个验证码
         self.store_binary_in_sqlite = config.get("store_binary_in_sqlite", 0)
+        self.page_journal = config.get("page_journal", 1)  # 是否记录抓取日志，中断后自动从上次的页码继续
+        # 已抓取的微博id，seen_index为1时在overwrite模式下保存到文件，下次运行时不再重复追加写入已写入的微博
+        if getattr(sys, 'frozen', False):
+            base_dir = os.path.dirname(sys.executable)
+        else:
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.seen_index = SeenIndex(
+            os.path.join(base_dir, "weibo", "seen_ids.db")
+            if config.get("seen_index", 0) and const.MODE == "overwrite"
+            else None
+        )
+        # 为1时仍解析之前的运行已写入的微博以更新计数，为0时跳过这些微博，见is_known_card
+        self.seen_index_refresh = config.get("seen_index_refresh", 1)
+        self.crawl_processes = config.get("crawl_processes", 1)  # 按用户分片并行抓取的进程数，1代表单进程
+        self.parse_processes = config.get("parse_processes", 1)  # 解析微博的进程数，1代表在抓取线程中解析
+        self.parse_pool = None
+        self.parse_pool_lock = threading.Lock()
+        self.sqlite_queue = None  # 多进程模式下，SQLite写入经此队列交给写入进程
+        self.sqlite_ack_queue = None
+        self.sqlite_writer_gone = None  # 写入进程退出后由主进程设置
+        self.shard = 0
+        # 原始响应存档，为None时不存档
+        archive_config = config.get("archive")
+        self.archive = None
+        if archive_config:
+            self.archive = ResponseArchive(
+                archive_config.get("path", "./weibo/.archive"),
+                archive_config.get("compression"),
+            )
+        self.replay = None  # 由reparse.py设置，用存档中的响应代替网络请求
+        # 按源微博id缓存解析后的源微博，为None时不缓存
+        retweet_cache_config = config.get("retweet_cache")
+        self.retweet_cache = None
+        if retweet_cache_config:
+            self.retweet_cache = RetweetCache(
+                retweet_cache_config.get("max_size", 1000),
+                retweet_cache_config.get("ttl", 3600),
+                retweet_cache_config.get("path") or None,
+                self.get_retweet_cache_fingerprint(),
+            )
+        # 多节点共享的任务队列，各节点从中租用用户任务，为None时只抓取本机配置的用户
+        self.work_queue_config = config.get("work_queue")
+        self.work_queue = None
+        if self.work_queue_config:
+            self.work_queue = create_work_queue(self.work_queue_config)
         
+    @property
+    def context(self):
+        """当前线程的抓取上下文"""
+        context = getattr(self.local, "context", None)
+        if context is None:
+            context = self.local.context = CrawlContext()
+        return context
+
+    @context.setter
+    def context(self, context):
+        self.local.context = context
+
+    def bind_context(self, func):
+        """返回在当前抓取上下文中执行func的函数，供线程池中的任务使用"""
+        context = self.context
+
+        def run(*args, **kwargs):
+            self.context = context
+            return func(*args, **kwargs)
+
+        return run
+
     def validate_config(self, config):
         """验证配置是否正确"""
 
@@ -271,6 +432,140 @@ class Weibo(object):
             logger.warning("最大下载评论数 (comment_max_download_count) 应该为正整数")
             sys.exit()
 
+        page_concurrency = config.get("page_concurrency", 1)
+        if not isinstance(page_concurrency, int) or page_concurrency < 1:
+            logger.warning("同时请求的页面数 (page_concurrency) 应为正整数")
+            sys.exit()
+
+        long_weibo_concurrency = config.get("long_weibo_concurrency", 4)
+        if not isinstance(long_weibo_concurrency, int) or long_weibo_concurrency < 1:
+            logger.warning("同时获取的长微博数 (long_weibo_concurrency) 应为正整数")
+            sys.exit()
+        sink_queue_size = config.get("sink_queue_size", 0)
+        if not isinstance(sink_queue_size, int) or sink_queue_size < 0:
+            logger.warning("后台写入队列长度 (sink_queue_size) 应为非负整数")
+            sys.exit()
+
+        user_concurrency = config.get("user_concurrency", 1)
+        if not isinstance(user_concurrency, int) or user_concurrency < 1:
+            logger.warning("同时抓取的用户数 (user_concurrency) 应为正整数")
+            sys.exit()
+
+        crawl_processes = config.get("crawl_processes", 1)
+        if not isinstance(crawl_processes, int) or crawl_processes < 1:
+            logger.warning("抓取进程数 (crawl_processes) 应为正整数")
+            sys.exit()
+
+        parse_processes = config.get("parse_processes", 1)
+        if not isinstance(parse_processes, int) or parse_processes < 1:
+            logger.warning("解析进程数 (parse_processes) 应为正整数")
+            sys.exit()
+
+        # 验证until_date
+        until_date = config.get("until_date", "")
+        if until_date != "" and (not isinstance(until_date, int)) and (not self.is_datetime(until_date)) and (not self.is_date(until_date)):
+            logger.warning("until_date值应为yyyy-mm-dd形式、yyyy-mm-ddTHH:MM:SS形式或整数，请重新输入")
+            sys.exit()
+        if until_date != "" and self.normalize_date(until_date, "23:59:59") < self.normalize_date(
+            config["since_date"], "00:00:00"
+        ):
+            logger.warning("until_date不能早于since_date，请重新输入")
+            sys.exit()
+        if until_date != "" and const.MODE == "append":
+            logger.warning("append模式下不支持设置until_date")
+            sys.exit()
+
+        if config.get("csv_reposts", 0) not in [0, 1]:
+            logger.warning("csv_reposts值应为0或1,请重新输入")
+            sys.exit()
+
+        if config.get("page_journal", 1) not in [0, 1]:
+            logger.warning("page_journal值应为0或1,请重新输入")
+            sys.exit()
+
+        if config.get("seen_index", 0) not in [0, 1]:
+            logger.warning("seen_index值应为0或1,请重新输入")
+            sys.exit()
+
+        if config.get("seen_index_refresh", 1) not in [0, 1]:
+            logger.warning("seen_index_refresh值应为0或1,请重新输入")
+            sys.exit()
+
+        archive = config.get("archive")
+        if archive:
+            if not isinstance(archive, dict):
+                logger.warning("archive值应为dict类型")
+                sys.exit()
+            compression = archive.get("compression")
+            if compression not in [None, "gzip", "zstd"]:
+                logger.warning("archive的compression值应为gzip或zstd")
+                sys.exit()
+            if compression == "zstd" and zstandard is None:
+                logger.warning("系统中可能没有安装zstandard库，请先运行 pip install zstandard ，再运行程序")
+                sys.exit()
+
+        weibo_fields = config.get("weibo_fields")
+        if weibo_fields:
+            if not isinstance(weibo_fields, list):
+                logger.warning("weibo_fields值应为list类型")
+                sys.exit()
+            for field in weibo_fields:
+                if field not in WEIBO_FIELDS:
+                    logger.warning("weibo_fields中的%s不是可选的微博字段，可选字段为：%s", field, ", ".join(WEIBO_FIELDS))
+                    sys.exit()
+            # 下载文件、评论和转发以及检查cookie时需要用到的字段
+            dependencies = [
+                ("pics", ["original_pic_download", "retweet_pic_download"]),
+                ("video_url", ["original_video_download", "retweet_video_download"]),
+                ("live_photo_url", ["original_live_photo_download", "retweet_live_photo_download"]),
+                ("comments_count", ["download_comment"]),
+                ("reposts_count", ["download_repost"]),
+            ]
+            for field, arguments in dependencies:
+                for argument in arguments:
+                    if config.get(argument) and field not in weibo_fields:
+                        logger.warning("%s为1时weibo_fields中需要包含%s", argument, field)
+                        sys.exit()
+            if const.CHECK_COOKIE["CHECK"] and "text" not in weibo_fields:
+                logger.warning("检查cookie时weibo_fields中需要包含text")
+                sys.exit()
+
+        retweet_cache = config.get("retweet_cache")
+        if retweet_cache:
+            if not isinstance(retweet_cache, dict):
+                logger.warning("retweet_cache值应为dict类型")
+                sys.exit()
+            for key, default in [("max_size", 1000), ("ttl", 3600)]:
+                value = retweet_cache.get(key, default)
+                if not isinstance(value, int) or value < 1:
+                    logger.warning("retweet_cache的%s值应为正整数", key)
+                    sys.exit()
+
+        work_queue = config.get("work_queue")
+        if work_queue:
+            if not isinstance(work_queue, dict):
+                logger.warning("work_queue值应为dict类型")
+                sys.exit()
+            if work_queue.get("backend", "sqlite") not in ["sqlite"]:
+                logger.warning("work_queue的backend目前只支持sqlite")
+                sys.exit()
+            lease_seconds = work_queue.get("lease_seconds", 600)
+            if not isinstance(lease_seconds, int) or lease_seconds < 3:
+                logger.warning("任务租约时长 (lease_seconds) 应为不小于3的整数")
+                sys.exit()
+            for key, default, minimum in [
+                ("pages_per_job", 0, 0),
+                ("max_attempts", 3, 1),
+                ("retry_delay", 60, 0),
+            ]:
+                value = work_queue.get(key, default)
+                if not isinstance(value, int) or value < minimum:
+                    logger.warning("work_queue的%s值应为不小于%d的整数", key, minimum)
+                    sys.exit()
+            if config.get("crawl_processes", 1) > 1:
+                logger.warning("work_queue不能与crawl_processes同时使用，多进程抓取请在同一任务队列上启动多个程序")
+                sys.exit()
+
         repost_max_count = config["repost_max_download_count"]
         if not isinstance(repost_max_count, int):
             logger.warning("最大下载转发数 (repost_max_download_count) 应为整数类型")
@@ -279,6 +574,17 @@ class Weibo(object):
             logger.warning("最大下载转发数 (repost_max_download_count) 应该为正整数")
             sys.exit()
 
+    def normalize_date(self, value, day_time):
+        """把since_date、until_date配置转为yyyy-mm-ddTHH:MM:SS形式
+
+        整数代表该天数之前的日期，只有日期时补上day_time。
+        """
+        if isinstance(value, int):
+            value = (date.today() - timedelta(value)).strftime("%Y-%m-%d")
+        if self.is_date(value):
+            return "{}T{}".format(value, day_time)
+        return value
+
     def is_datetime(self, since_date):
         """判断日期格式是否为 %Y-%m-%dT%H:%M:%S"""
         try:
@@ -298,9 +604,9 @@ class Weibo(object):
     def get_json(self, params):
         url = "https://m.weibo.cn/api/container/getIndex?"
         try:
-            r = self.session.get(url, params=params, headers=self.headers, verify=False, timeout=10)
+            r = self.weibo_get(url, params=params, verify=False, timeout=10)
             r.raise_for_status()
-            response_json = r.json()
+            response_json = jsoncodec.loads(r.content)
             return response_json, r.status_code
         except RequestException as e:
             logger.error(f"请求失败，错误信息：{e}")
@@ -309,6 +615,52 @@ class Weibo(object):
             logger.error(f"JSON 解码失败，错误信息：{ve}")
             return {}, 500
 
+    def warm_up_session(self):
+        """开始抓取前预热session，重新解析存档时不发出请求"""
+        if self.replay:
+            return
+        try:
+            # 请求只带 SUB
+            # 服务器下发适配 m.weibo.cn 的新指纹
+            self.session.get("https://m.weibo.cn", headers=self.headers, timeout=10)
+            logger.info("Session 预热成功，服务器已下发最新指纹。")
+            
+        except Exception as e:
+            #请求失败时，启用备份
+            logger.warning(f"Session 预热失败 ({e})，正在启用备份 Cookie...")
+            self.session.cookies.update(self.backup_cookies) # 把旧指纹装进去救急
+
+    def weibo_get(self, url, **kwargs):
+        """向微博接口发出GET请求，发出前经过速率控制，并根据响应调整请求速率"""
+        if self.replay:
+            return self.replay.get(url, kwargs.get("params"))
+        kwargs.setdefault("headers", self.headers)
+        for attempt in range(self.api_max_retries + 1):
+            self.rate_controller.acquire()
+            try:
+                response = self.session.get(url, **kwargs)
+            except requests.Timeout:
+                self.rate_controller.on_throttle("请求超时")
+                raise
+            status = response.status_code
+            if status in (403, 418) or status in self.api_retry_statuses:
+                self.rate_controller.on_throttle("HTTP {}".format(status))
+                # 403/418不重试，5xx和429放慢后重试
+                if status in self.api_retry_statuses and attempt < self.api_max_retries:
+                    continue
+            else:
+                self.rate_controller.on_success()
+            break
+        if self.archive and response.status_code == 200:
+            self.archive.record(
+                url,
+                kwargs.get("params"),
+                response,
+                self.user_config.get("user_id", ""),
+                self.query,
+            )
+        return response
+
     def handle_captcha(self, js):
         """
         处理验证码挑战，提示用户手动完成验证。
@@ -320,7 +672,10 @@ class Weibo(object):
             bool: 如果用户成功完成验证码，返回 True；否则返回 False。
         """
         logger.debug(f"收到的 JSON 数据：{js}")
-        
+        with self.captcha_lock:
+            return self._handle_captcha(js)
+
+    def _handle_captcha(self, js):
         captcha_url = js.get("url")
         if captcha_url:
             logger.warning("检测到验证码挑战。正在打开验证码页面以供手动验证。")
@@ -363,18 +718,18 @@ class Weibo(object):
         params["count"] = self.page_weibo_count
         max_retries = 5
         retries = 0
-        backoff_factor = 5
 
         while retries < max_retries:
             try:
-                response = self.session.get(url, params=params, headers=self.headers, timeout=10)
+                response = self.weibo_get(url, params=params, timeout=10)
                 response.raise_for_status()  # 如果响应状态码不是 200，会抛出 HTTPError
-                js = response.json()
+                js = jsoncodec.loads(response.content)
                 if 'data' in js:
                     logger.info(f"成功获取到页面 {page} 的数据。")
                     return js
                 else:
                     logger.warning("未能获取到数据，可能需要验证码验证。")
+                    self.rate_controller.on_throttle("验证码")
                     if self.handle_captcha(js):
                         logger.info("用户已完成验证码验证，继续请求数据。")
                         retries = 0  # 重置重试计数器
@@ -384,14 +739,11 @@ class Weibo(object):
                         sys.exit()
             except RequestException as e:
                 retries += 1
-                sleep_time = backoff_factor * (2 ** retries)
-                logger.error(f"请求失败，错误信息：{e}。等待 {sleep_time} 秒后重试...")
-                sleep(sleep_time)
+                logger.error(f"请求失败，错误信息：{e}。稍后重试...")
             except ValueError as ve:
                 retries += 1
-                sleep_time = backoff_factor * (2 ** retries)
-                logger.error(f"JSON 解码失败，错误信息：{ve}。等待 {sleep_time} 秒后重试...")
-                sleep(sleep_time)
+                self.rate_controller.on_throttle("响应解析失败")
+                logger.error(f"JSON 解码失败，错误信息：{ve}。稍后重试...")
         logger.error("超过最大重试次数，跳过当前页面。")
         return {}
     
@@ -399,7 +751,7 @@ class Weibo(object):
         """将爬取到的用户信息写入csv文件"""
         file_dir = os.path.split(os.path.realpath(__file__))[0] + os.sep + "weibo"
         if not os.path.isdir(file_dir):
-            os.makedirs(file_dir)
+            os.makedirs(file_dir, exist_ok=True)
         file_path = file_dir + os.sep + "users.csv"
         self.user_csv_file_path = file_path
         result_headers = [
@@ -433,9 +785,10 @@ class Weibo(object):
             ]
         ]
         # 已经插入信息的用户无需重复插入，返回的id是空字符串或微博id 发布日期%Y-%m-%d
-        last_weibo_msg = csvutil.insert_or_update_user(
-            logger, result_headers, result_data, file_path
-        )
+        with self.file_lock:
+            last_weibo_msg = csvutil.insert_or_update_user(
+                logger, result_headers, result_data, file_path
+            )
         self.last_weibo_id = last_weibo_msg.split(" ")[0] if last_weibo_msg else ""
         self.last_weibo_date = (
             last_weibo_msg.split(" ")[1]
@@ -486,9 +839,11 @@ class Weibo(object):
                 verified BOOLEAN DEFAULT 0,
                 verified_type INT,
                 verified_reason varchar(140),
+                content_hash varchar(32),
                 PRIMARY KEY (id)
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
         self.mysql_create_table(mysql_config, create_table)
+        self.mysql_add_hash_column(mysql_config, "user")
         self.mysql_insert(mysql_config, "user", [self.user])
         logger.info("%s信息写入MySQL数据库完毕", self.user["screen_name"])
 
@@ -506,29 +861,18 @@ class Weibo(object):
         """获取用户信息"""
         params = {"containerid": "100505" + str(self.user_config["user_id"])}
         url = "https://m.weibo.cn/api/container/getIndex"
-        
-        # 这里在读取下一个用户的时候很容易被ban，需要优化休眠时长
-        # 加一个count，不需要一上来啥都没干就sleep
-        if self.long_sleep_count_before_each_user > 0:
-            sleep_time = random.randint(30, 60)
-            # 添加log，否则一般用户不知道以为程序卡了
-            logger.info(f"""短暂sleep {sleep_time}秒，避免被ban""")        
-            sleep(sleep_time)
-            logger.info("sleep结束")  
-        self.long_sleep_count_before_each_user = self.long_sleep_count_before_each_user + 1      
 
         max_retries = 5  # 设置最大重试次数，避免无限循环
         retries = 0
-        backoff_factor = 5  # 指数退避的基数（秒）
-        
+
         while retries < max_retries:
             try:
-                response = self.session.get(url, params=params, headers=self.headers, timeout=10)
+                response = self.weibo_get(url, params=params, timeout=10)
                 response.raise_for_status()
-                js = response.json()
+                js = jsoncodec.loads(response.content)
                 if 'data' in js and 'userInfo' in js['data']:
                     info = js["data"]["userInfo"]
-                    user_info = OrderedDict()
+                    user_info = UserRecord()
                     user_info["id"] = self.user_config["user_id"]
                     user_info["screen_name"] = info.get("screen_name", "")
                     user_info["gender"] = info.get("gender", "")
@@ -581,6 +925,7 @@ class Weibo(object):
                     return 0
                 else:
                     logger.warning("未能获取到用户信息，可能需要验证码验证。")
+                    self.rate_controller.on_throttle("验证码")
                     if self.handle_captcha(js):
                         logger.info("用户已完成验证码验证，继续请求用户信息。")
                         retries = 0  # 重置重试计数器
@@ -590,33 +935,104 @@ class Weibo(object):
                         sys.exit()
             except RequestException as e:
                 retries += 1
-                sleep_time = backoff_factor * (2 ** retries)
-                logger.error(f"请求失败，错误信息：{e}。等待 {sleep_time} 秒后重试...")
-                sleep(sleep_time)
+                logger.error(f"请求失败，错误信息：{e}。稍后重试...")
             except ValueError as ve:
                 retries += 1
-                sleep_time = backoff_factor * (2 ** retries)
-                logger.error(f"JSON 解码失败，错误信息：{ve}。等待 {sleep_time} 秒后重试...")
-                sleep(sleep_time)
+                self.rate_controller.on_throttle("响应解析失败")
+                logger.error(f"JSON 解码失败，错误信息：{ve}。稍后重试...")
         logger.error("超过最大重试次数，程序将退出。")
         sys.exit("超过最大重试次数，程序已退出。")
 
-    def get_long_weibo(self, id):
-        """获取长微博"""
+    def get_long_weibo(self, weibo_info, long_statuses=None):
+        """获取长微博，long_statuses为prefetch_long_weibos预先获取的结果，获取失败时按weibo_info解析"""
+        if long_statuses and weibo_info["id"] in long_statuses:
+            status = long_statuses[weibo_info["id"]]
+        else:
+            status = self.get_long_status(weibo_info)
+        return self.parse_weibo(status or weibo_info)
+
+    def get_long_status(self, weibo_info):
+        """获取长微博的完整信息，获取失败时返回None
+
+        先请求只返回全文的statuses/extend接口，用全文替换weibo_info中被截断的正文；
+        接口失败或图片超过9张（接口不返回完整的图片列表）时再请求微博详情页。
+        """
+        weibo_id = weibo_info["id"]
+        if (weibo_info.get("pic_num") or 0) <= 9:
+            text = self.get_long_text(weibo_id)
+            if text:
+                status = dict(weibo_info)
+                status["text"] = text
+                status["isLongText"] = False
+                return status
+        return self.get_detail_status(weibo_id)
+
+    def get_long_text(self, id):
+        """通过statuses/extend接口获取长微博全文"""
+        url = "https://m.weibo.cn/statuses/extend"
+        try:
+            response = self.weibo_get(url, params={"id": id}, timeout=10)
+            response.raise_for_status()
+            js = jsoncodec.loads(response.content)
+        except (RequestException, ValueError) as e:
+            logger.debug("长微博全文接口请求失败 %s: %s", id, e)
+            return None
+        data = js.get("data") if isinstance(js, dict) and js.get("ok") else None
+        if isinstance(data, dict):
+            return data.get("longTextContent")
+        return None
+
+    def get_detail_status(self, id):
+        """从微博详情页中截取完整的微博信息"""
         url = "https://m.weibo.cn/detail/%s" % id
         logger.info(f"""URL: {url} """)
         for i in range(5):
-            sleep(random.uniform(1.0, 2.5))
-            html = self.session.get(url, headers=self.headers, verify=False).text
+            try:
+                html = self.weibo_get(url, verify=False, timeout=10).text
+            except RequestException as e:
+                logger.debug("长微博详情页请求失败 %s: %s", id, e)
+                continue
             html = html[html.find('"status":') :]
             html = html[: html.rfind('"call"')]
             html = html[: html.rfind(",")]
             html = "{" + html + "}"
-            js = json.loads(html, strict=False)
+            try:
+                js = jsoncodec.loads(html, strict=False)
+            except ValueError:
+                continue
             weibo_info = js.get("status")
             if weibo_info:
-                weibo = self.parse_weibo(weibo_info)
-                return weibo
+                return weibo_info
+        return None
+
+    def prefetch_long_weibos(self, cards):
+        """并发获取一页中全部长微博及长源微博的完整信息，返回{微博id: get_long_status的结果}
+
+        未开启并发或本页长微博少于2条时返回空dict，由get_one_weibo逐条获取。
+        """
+        infos = []
+        for w in cards:
+            if w["card_type"] != 9:
+                continue
+            weibo_info = w["mblog"]
+            if self.is_long_weibo(weibo_info):
+                infos.append(weibo_info)
+            retweeted_status = weibo_info.get("retweeted_status")
+            if (
+                not self.only_crawl_original
+                and retweeted_status
+                and retweeted_status.get("id")
+                and self.is_long_retweet(retweeted_status)
+                and not (self.retweet_cache and self.retweet_cache.get(retweeted_status["id"]))
+            ):
+                infos.append(retweeted_status)
+        if self.long_weibo_concurrency <= 1 or len(infos) < 2:
+            return {}
+        with ThreadPoolExecutor(
+            max_workers=min(self.long_weibo_concurrency, len(infos))
+        ) as executor:
+            statuses = list(executor.map(self.bind_context(self.get_long_status), infos))
+        return {info["id"]: status for info, status in zip(infos, statuses)}
 
     def get_pics(self, weibo_info):
         """获取微博原始图片url"""
@@ -652,8 +1068,8 @@ class Weibo(object):
                                 media_info.get("stream_url"))
         return video_url
 
-    def download_one_file(self, url, file_path, type, weibo_id):
-        """下载单个文件(图片/视频)"""
+    def download_one_file(self, url, file_path, weibo_id):
+        """下载单个文件(图片/视频)，返回是否下载成功"""
         try:
 
             file_exist = os.path.isfile(file_path)
@@ -663,63 +1079,73 @@ class Weibo(object):
                 sqlite_exist = self.sqlite_exist_file(file_path)
 
             if not need_download:
-                return 
+                return True
 
-            s = requests.Session()
-            s.mount('http://', HTTPAdapter(max_retries=5))
-            s.mount('https://', HTTPAdapter(max_retries=5))
+            s = http_client.get_session("media")
             try_count = 0
             success = False
             MAX_TRY_COUNT = 3
-            detected_extension = None
+            # 先以分块方式写入临时文件，校验通过后再原子地重命名为目标文件。
+            # 临时文件旁的.json标记记录了url、总长度和ETag等信息，中断后可用Range请求续传
+            temp_path = file_path + ".part"
+            marker_path = temp_path + ".json"
             while try_count < MAX_TRY_COUNT:
                 try:
-                    response = s.get(
-                        url, headers=self.headers, timeout=(5, 10), verify=False
-                    )
-                    response.raise_for_status()
-                    downloaded = response.content
-                    try_count += 1
-
-                    # 获取文件后缀
-                    url_path = url.split('?')[0]  # 去除URL中的参数
-                    inferred_extension = os.path.splitext(url_path)[1].lower().strip('.')
-
-                    # 通过 Magic Number 检测文件类型
-                    if downloaded.startswith(b'\xFF\xD8\xFF'):
-                        # JPEG 文件
-                        if not downloaded.endswith(b'\xff\xd9'):
-                            logger.debug(f"[DEBUG] JPEG 文件不完整: {url} ({try_count}/{MAX_TRY_COUNT})")
-                            continue  # 文件不完整，继续重试
-                        detected_extension = '.jpg'
-                    elif downloaded.startswith(b'\x89PNG\r\n\x1A\n'):
-                        # PNG 文件
-                        if not downloaded.endswith(b'IEND\xaeB`\x82'):
-                            logger.debug(f"[DEBUG] PNG 文件不完整: {url} ({try_count}/{MAX_TRY_COUNT})")
-                            continue  # 文件不完整，继续重试
-                        detected_extension = '.png'
-                    else:
-                        # 其他类型，使用原有逻辑处理
-                        if inferred_extension in ['mp4', 'mov', 'webm', 'gif', 'bmp', 'tiff']:
-                            detected_extension = '.' + inferred_extension
+                    marker = self.load_part_marker(temp_path, marker_path, url)
+                    offset = os.path.getsize(temp_path) if marker else 0
+                    headers = dict(self.headers)
+                    if offset:
+                        headers["Range"] = "bytes={}-".format(offset)
+                        if marker.get("validator"):
+                            headers["If-Range"] = marker["validator"]
+                    with s.get(
+                        url, headers=headers, timeout=(5, 10), verify=False, stream=True
+                    ) as response:
+                        if response.status_code == 416 and offset and offset == marker.get("total"):
+                            # 临时文件已完整，只是上次未来得及校验
+                            content_type = marker.get("content_type", "")
+                        elif response.status_code == 416 or (
+                            response.status_code == 206 and self.content_range_start(response) != offset
+                        ):
+                            # 服务器不接受续传位置，丢弃临时文件从头下载
+                            self.remove_part_file(temp_path, marker_path)
+                            try_count += 1
+                            continue
                         else:
-                            # 尝试从 Content-Type 获取扩展名
+                            response.raise_for_status()
                             content_type = response.headers.get('Content-Type', '').lower()
-                            if 'image/jpeg' in content_type:
-                                detected_extension = '.jpg'
-                            elif 'image/png' in content_type:
-                                detected_extension = '.png'
-                            elif 'video/mp4' in content_type:
-                                detected_extension = '.mp4'
-                            elif 'video/quicktime' in content_type:
-                                detected_extension = '.mov'
-                            elif 'video/webm' in content_type:
-                                detected_extension = '.webm'
-                            elif 'image/gif' in content_type:
-                                detected_extension = '.gif'
-                            else:
-                                # 使用原有的扩展名，如果无法确定
-                                detected_extension = '.' + inferred_extension if inferred_extension else ''
+                            if content_type.startswith(("text/", "application/json")):
+                                # 服务器返回的是错误页面而不是媒体文件
+                                self.remove_part_file(temp_path, marker_path)
+                                try_count += 1
+                                logger.debug(f"[DEBUG] 响应类型错误 {content_type}: {url} ({try_count}/{MAX_TRY_COUNT})")
+                                continue
+                            resumed = response.status_code == 206
+                            marker = {
+                                "url": url,
+                                "total": self.response_total_length(response, offset if resumed else 0),
+                                "validator": response.headers.get("ETag") or response.headers.get("Last-Modified"),
+                                "content_type": content_type,
+                            }
+                            with open(marker_path, "w") as f:
+                                json.dump(marker, f)
+                            with open(temp_path, "ab" if resumed else "wb") as f:
+                                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                                    f.write(chunk)
+                    try_count += 1
+
+                    size = os.path.getsize(temp_path)
+                    if marker["total"] is not None and size != marker["total"]:
+                        if size > marker["total"]:
+                            self.remove_part_file(temp_path, marker_path)
+                        logger.debug(f"[DEBUG] 文件长度不符 {size}/{marker['total']}: {url} ({try_count}/{MAX_TRY_COUNT})")
+                        continue  # 长度不足时保留临时文件，下次重试续传
+
+                    detected_extension = self.detect_file_extension(temp_path, url, content_type)
+                    if detected_extension is None:
+                        self.remove_part_file(temp_path, marker_path)
+                        logger.debug(f"[DEBUG] 文件不完整: {url} ({try_count}/{MAX_TRY_COUNT})")
+                        continue  # 文件不完整，继续重试
 
                     # 动态调整文件路径的扩展名
                     if detected_extension:
@@ -727,9 +1153,9 @@ class Weibo(object):
 
                     # 保存文件
                     if not os.path.isfile(file_path):
-                        with open(file_path, "wb") as f:
-                            f.write(downloaded)
-                            logger.debug("[DEBUG] save " + file_path)
+                        os.replace(temp_path, file_path)
+                        logger.debug("[DEBUG] save " + file_path)
+                    self.remove_part_file(temp_path, marker_path)
 
                     success = True
                     logger.debug("[DEBUG] success " + url + "  " + str(try_count))
@@ -743,43 +1169,101 @@ class Weibo(object):
                 except Exception as e:
                     logger.exception(f"[ERROR] 下载过程中发生错误: {e}")
                     break  # 对于其他异常，退出重试
+            if not success and not os.path.isfile(marker_path):
+                # 没有续传标记的临时文件无法校验，直接删除
+                self.remove_part_file(temp_path, marker_path)
 
             if success:
                 if "sqlite" in self.write_mode and not sqlite_exist:
-                    self.insert_file_sqlite(
-                        file_path, weibo_id, url, downloaded
-                    )
+                    self.insert_file_sqlite(file_path, weibo_id, url)
             else:
                 logger.debug("[DEBUG] failed " + url + " TOTALLY")
-                error_file = self.get_filepath(type) + os.sep + "not_downloaded.txt"
-                with open(error_file, "ab") as f:
-                    error_entry = f"{weibo_id}:{file_path}:{url}\n"
-                    f.write(error_entry.encode(sys.stdout.encoding))
+            return success
         except Exception as e:
-            # 生成原始微博URL
-            original_url = f"https://m.weibo.cn/detail/{weibo_id}"  # 新增
-            error_file = self.get_filepath(type) + os.sep + "not_downloaded.txt"
-            with open(error_file, "ab") as f:
-                # 修改错误条目格式，添加原始URL
-                error_entry = f"{weibo_id}:{file_path}:{url}:{original_url}\n"  # 修改
-                f.write(error_entry.encode(sys.stdout.encoding))
             logger.exception(e)
+            return False
+
+    def load_part_marker(self, temp_path, marker_path, url):
+        """读取临时文件的续传标记，标记缺失、损坏或url不一致时删除临时文件并返回None"""
+        try:
+            with open(marker_path) as f:
+                marker = json.load(f)
+            if marker.get("url") == url and os.path.isfile(temp_path):
+                return marker
+        except (OSError, ValueError):
+            pass
+        self.remove_part_file(temp_path, marker_path)
+        return None
+
+    def remove_part_file(self, temp_path, marker_path):
+        """删除下载临时文件及其续传标记"""
+        for path in (temp_path, marker_path):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def content_range_start(self, response):
+        """返回206响应Content-Range中的起始字节位置"""
+        match = re.match(r"bytes (\d+)-\d+/", response.headers.get("Content-Range", ""))
+        return int(match.group(1)) if match else None
+
+    def response_total_length(self, response, offset):
+        """返回文件的总长度，无法确定时返回None"""
+        match = re.match(r"bytes \d+-\d+/(\d+)", response.headers.get("Content-Range", ""))
+        if match:
+            return int(match.group(1))
+        length = response.headers.get("Content-Length")
+        if length and "Content-Encoding" not in response.headers:
+            return offset + int(length)
+        return None
+
+    def detect_file_extension(self, path, url, content_type):
+        """根据文件首尾字节、url和Content-Type确定扩展名，图片不完整时返回None"""
+        with open(path, "rb") as f:
+            head = f.read(16)
+            f.seek(max(os.path.getsize(path) - 16, 0))
+            tail = f.read()
+
+        # 获取文件后缀
+        url_path = url.split('?')[0]  # 去除URL中的参数
+        inferred_extension = os.path.splitext(url_path)[1].lower().strip('.')
+
+        # 通过 Magic Number 检测文件类型
+        if head.startswith(b'\xFF\xD8\xFF'):
+            # JPEG 文件
+            return '.jpg' if tail.endswith(b'\xff\xd9') else None
+        if head.startswith(b'\x89PNG\r\n\x1A\n'):
+            # PNG 文件
+            return '.png' if tail.endswith(b'IEND\xaeB`\x82') else None
+        # 其他类型，使用原有逻辑处理
+        if inferred_extension in ['mp4', 'mov', 'webm', 'gif', 'bmp', 'tiff']:
+            return '.' + inferred_extension
+        # 尝试从 Content-Type 获取扩展名
+        if 'image/jpeg' in content_type:
+            return '.jpg'
+        elif 'image/png' in content_type:
+            return '.png'
+        elif 'video/mp4' in content_type:
+            return '.mp4'
+        elif 'video/quicktime' in content_type:
+            return '.mov'
+        elif 'video/webm' in content_type:
+            return '.webm'
+        elif 'image/gif' in content_type:
+            return '.gif'
+        # 使用原有的扩展名，如果无法确定
+        return '.' + inferred_extension if inferred_extension else ''
 
     def sqlite_exist_file(self, url):
         if not os.path.exists(self.get_sqlte_path()):
             return True
-        con = self.get_sqlite_connection()
-        cur = con.cursor()
-
         query_sql = """SELECT url FROM bins WHERE path=? """
-        count = cur.execute(query_sql, (url,)).fetchone()
-        con.close()
+        count = self.sqlite_query_one(query_sql, (url,), tables=("bins",))
         if count is None:
             return False
 
         return True
 
-    def insert_file_sqlite(self, file_path, weibo_id, url, binary):
+    def insert_file_sqlite(self, file_path, weibo_id, url):
         if not weibo_id:
             return
         if self.store_binary_in_sqlite != 1:  # 新增配置判断
@@ -787,8 +1271,11 @@ class Weibo(object):
         extension = Path(file_path).suffix
         if not extension:
             return
-        if len(binary) <= 0:
+        if os.path.getsize(file_path) <= 0:
             return
+        # 仅在需要存入数据库时才把文件读入内存
+        with open(file_path, "rb") as f:
+            binary = f.read()
 
         file_data = OrderedDict()
         file_data["weibo_id"] = weibo_id
@@ -797,12 +1284,11 @@ class Weibo(object):
         file_data["path"] = file_path
         file_data["url"] = url
 
-        con = self.get_sqlite_connection()
-        self.sqlite_insert(con, file_data, "bins")
-        con.close()
+        self.sqlite_insert(file_data, "bins")
 
-    def handle_download(self, file_type, file_dir, urls, w):
-        """处理下载相关操作"""
+    def get_download_jobs(self, file_type, file_dir, urls, w):
+        """获取一条微博中待下载文件的(url, 文件路径, 微博id)列表"""
+        jobs = []
         file_prefix = w["created_at"][:11].replace("-", "") + "_" + str(w["id"])
         if file_type == "img":
             if "," in urls:
@@ -815,7 +1301,7 @@ class Weibo(object):
                         file_suffix = url[index:]
                     file_name = file_prefix + "_" + str(i + 1) + file_suffix
                     file_path = file_dir + os.sep + file_name
-                    self.download_one_file(url, file_path, file_type, w["id"])
+                    jobs.append((url, file_path, w["id"]))
             else:
                 index = urls.rfind(".")
                 if len(urls) - index > 5:
@@ -824,7 +1310,7 @@ class Weibo(object):
                     file_suffix = urls[index:]
                 file_name = file_prefix + file_suffix
                 file_path = file_dir + os.sep + file_name
-                self.download_one_file(urls, file_path, file_type, w["id"])
+                jobs.append((urls, file_path, w["id"]))
         elif file_type == "video" or file_type == "live_photo":
             file_suffix = ".mp4"
             if ";" in urls:
@@ -834,13 +1320,25 @@ class Weibo(object):
                         file_suffix = ".mov"
                     file_name = file_prefix + "_" + str(i + 1) + file_suffix
                     file_path = file_dir + os.sep + file_name
-                    self.download_one_file(url, file_path, file_type, w["id"])
+                    jobs.append((url, file_path, w["id"]))
             else:
                 if urls.endswith(".mov"):
                     file_suffix = ".mov"
                 file_name = file_prefix + file_suffix
                 file_path = file_dir + os.sep + file_name
-                self.download_one_file(urls, file_path, file_type, w["id"])
+                jobs.append((urls, file_path, w["id"]))
+        return jobs
+
+    def write_not_downloaded(self, file_type, failed):
+        """将下载失败的文件汇总写入not_downloaded.txt"""
+        error_file = self.get_filepath(file_type) + os.sep + "not_downloaded.txt"
+        with open(error_file, "ab") as f:
+            for url, file_path, weibo_id in failed:
+                # 生成原始微博URL
+                original_url = f"https://m.weibo.cn/detail/{weibo_id}"
+                error_entry = f"{weibo_id}:{file_path}:{url}:{original_url}\n"
+                f.write(error_entry.encode(sys.stdout.encoding))
+        logger.warning("%d个文件下载失败，已记录到%s", len(failed), error_file)
 
     def download_files(self, file_type, weibo_type, wrote_count):
         try:
@@ -868,7 +1366,8 @@ class Weibo(object):
             
             # 检查是否有文件需要下载
             has_files = False
-            for w in self.weibo[wrote_count:]:
+            new_weibos = self.get_new_weibos(wrote_count)
+            for w in new_weibos:
                 if weibo_type == "retweet":
                     if w.get("retweet"):
                         w = w["retweet"]
@@ -880,17 +1379,21 @@ class Weibo(object):
             
             if has_files:
                 if not os.path.isdir(file_dir):
-                    os.makedirs(file_dir)
+                    os.makedirs(file_dir, exist_ok=True)
                 
-                for w in tqdm(self.weibo[wrote_count:], desc="Download progress"):
+                jobs = []
+                for w in new_weibos:
                     if weibo_type == "retweet":
                         if w.get("retweet"):
                             w = w["retweet"]
                         else:
                             continue
                     if w.get(key):
-                        self.handle_download(file_type, file_dir, w.get(key), w)
-                
+                        jobs.extend(self.get_download_jobs(file_type, file_dir, w.get(key), w))
+                failed = self.download_pool.run(self.download_one_file, jobs)
+                if failed:
+                    self.write_not_downloaded(file_type, failed)
+
                 logger.info("%s下载完毕,保存路径:", describe)
                 logger.info(file_dir)
             else:
@@ -898,53 +1401,6 @@ class Weibo(object):
         except Exception as e:
             logger.exception(e)
 
-    def get_location(self, selector):
-        """获取微博发布位置"""
-        location_icon = "timeline_card_small_location_default.png"
-        span_list = selector.xpath("//span")
-        location = ""
-        for i, span in enumerate(span_list):
-            if span.xpath("img/@src"):
-                if location_icon in span.xpath("img/@src")[0]:
-                    location = span_list[i + 1].xpath("string(.)")
-                    break
-        return location
-
-    def get_article_url(self, selector):
-        """获取微博中头条文章的url"""
-        article_url = ""
-        text = selector.xpath("string(.)")
-        if text.startswith("发布了头条文章"):
-            url = selector.xpath("//a/@data-url")
-            if url and url[0].startswith("http://t.cn"):
-                article_url = url[0]
-        return article_url
-
-    def get_topics(self, selector):
-        """获取参与的微博话题"""
-        span_list = selector.xpath("//span[@class='surl-text']")
-        topics = ""
-        topic_list = []
-        for span in span_list:
-            text = span.xpath("string(.)")
-            if len(text) > 2 and text[0] == "#" and text[-1] == "#":
-                topic_list.append(text[1:-1])
-        if topic_list:
-            topics = ",".join(topic_list)
-        return topics
-
-    def get_at_users(self, selector):
-        """获取@用户"""
-        a_list = selector.xpath("//a")
-        at_users = ""
-        at_list = []
-        for a in a_list:
-            if "@" + a.xpath("@href")[0][3:] == a.xpath("string(.)"):
-                at_list.append(a.xpath("string(.)")[1:])
-        if at_list:
-            at_users = ",".join(at_list)
-        return at_users
-
     def string_to_int(self, string):
         """字符串转换为整数"""
         if isinstance(string, int):
@@ -982,22 +1438,28 @@ class Weibo(object):
 
     def standardize_info(self, weibo):
         """标准化信息，去除乱码"""
+        encoding = sys.stdout.encoding
+        is_utf8 = codecs.lookup(encoding).name == "utf-8"
         for k, v in weibo.items():
-            if (
-                "bool" not in str(type(v))
-                and "int" not in str(type(v))
-                and "list" not in str(type(v))
-                and "long" not in str(type(v))
-            ):
-                weibo[k] = (
-                    v.replace("\u200b", "")
-                    .encode(sys.stdout.encoding, "ignore")
-                    .decode(sys.stdout.encoding)
-                )
+            if not isinstance(v, (bool, int, list)):
+                v = v.replace("\u200b", "")
+                if is_utf8:
+                    # utf-8能编码除代理字符外的所有字符，能直接编码时无需转换
+                    try:
+                        v.encode("utf-8")
+                        weibo[k] = v
+                        continue
+                    except UnicodeEncodeError:
+                        pass
+                weibo[k] = v.encode(encoding, "ignore").decode(encoding)
         return weibo
 
     def parse_weibo(self, weibo_info):
-        weibo = OrderedDict()
+        return self.analyze_weibo(self.parse_weibo_info(weibo_info))
+
+    def parse_weibo_info(self, weibo_info):
+        """解析一条微博，只依赖weibo_info本身，可以在解析进程中执行"""
+        weibo = WeiboRecord()
         if weibo_info["user"]:
             weibo["user_id"] = weibo_info["user"]["id"]
             weibo["screen_name"] = weibo_info["user"]["screen_name"]
@@ -1006,42 +1468,112 @@ class Weibo(object):
             weibo["screen_name"] = ""
         weibo["id"] = int(weibo_info["id"])
         weibo["bid"] = weibo_info["bid"]
-        text_body = weibo_info["text"]
-        selector = etree.HTML(f"{text_body}<hr>" if text_body.isspace() else text_body)
-        if self.remove_html_tag:
-            text_list = selector.xpath("//text()")
-            # 若text_list中的某个字符串元素以 @ 或 # 开始，则将该元素与前后元素合并为新元素，否则会带来没有必要的换行
-            text_list_modified = []
-            for ele in range(len(text_list)):
-                if ele > 0 and (text_list[ele-1].startswith(('@','#')) or text_list[ele].startswith(('@','#'))):
-                    text_list_modified[-1] += text_list[ele]
-                else:
-                    text_list_modified.append(text_list[ele])
-            weibo["text"] = "\n".join(text_list_modified)
-        else:
-            weibo["text"] = text_body
-        weibo["article_url"] = self.get_article_url(selector)
-        weibo["pics"] = self.get_pics(weibo_info)
-        weibo["video_url"] = self.get_video_url(weibo_info)  # 普通视频URL
-        weibo["live_photo_url"] = self.get_live_photo_url(weibo_info)  # Live Photo视频URL
-        weibo["location"] = self.get_location(selector)
         weibo["created_at"] = weibo_info["created_at"]
-        weibo["source"] = weibo_info["source"]
-        weibo["attitudes_count"] = self.string_to_int(
-            weibo_info.get("attitudes_count", 0)
-        )
-        weibo["comments_count"] = self.string_to_int(
-            weibo_info.get("comments_count", 0)
-        )
-        weibo["reposts_count"] = self.string_to_int(weibo_info.get("reposts_count", 0))
-        weibo["topics"] = self.get_topics(selector)
-        weibo["at_users"] = self.get_at_users(selector)
-        
-        # 使用 LLM 分析微博内容
+        # 只计算weibo_fields中的字段，没有用到正文相关字段时不解析html
+        fields = self.weibo_fields
+        if not HTML_FIELDS.isdisjoint(fields):
+            extracted = html_extract.extract(weibo_info["text"], self.remove_html_tag)
+            if "text" in fields:
+                weibo["text"] = extracted.text
+            if "article_url" in fields:
+                weibo["article_url"] = extracted.article_url
+            if "location" in fields:
+                weibo["location"] = extracted.location
+            if "topics" in fields:
+                weibo["topics"] = extracted.topics
+            if "at_users" in fields:
+                weibo["at_users"] = extracted.at_users
+        if "pics" in fields:
+            weibo["pics"] = self.get_pics(weibo_info)
+        if "video_url" in fields:
+            weibo["video_url"] = self.get_video_url(weibo_info)  # 普通视频URL
+        if "live_photo_url" in fields:
+            weibo["live_photo_url"] = self.get_live_photo_url(weibo_info)  # Live Photo视频URL
+        if "source" in fields:
+            weibo["source"] = weibo_info["source"]
+        if "attitudes_count" in fields:
+            weibo["attitudes_count"] = self.string_to_int(
+                weibo_info.get("attitudes_count", 0)
+            )
+        if "comments_count" in fields:
+            weibo["comments_count"] = self.string_to_int(
+                weibo_info.get("comments_count", 0)
+            )
+        if "reposts_count" in fields:
+            weibo["reposts_count"] = self.string_to_int(weibo_info.get("reposts_count", 0))
+        return self.standardize_info(weibo)
+
+    def analyze_weibo(self, weibo):
+        """使用 LLM 分析微博内容"""
         if self.llm_analyzer:
             weibo = self.llm_analyzer.analyze_weibo(weibo)
-            logger.info("完整分析结果：\n%s", json.dumps(weibo, ensure_ascii=False, indent=2))
-        return self.standardize_info(weibo)
+            logger.info("完整分析结果：\n%s", jsoncodec.dumps(weibo, indent=True))
+            weibo = self.standardize_info(weibo)
+        return weibo
+
+    def is_long_weibo(self, weibo_info):
+        """是否需要请求长微博页面获取全文"""
+        if LONG_WEIBO_FIELDS.isdisjoint(self.weibo_fields):
+            return False
+        return True if weibo_info.get("pic_num") > 9 else weibo_info.get("isLongText")
+
+    def is_long_retweet(self, retweeted_status):
+        """源微博是否需要请求长微博页面获取全文"""
+        if LONG_WEIBO_FIELDS.isdisjoint(self.weibo_fields):
+            return False
+        return retweeted_status.get("isLongText")
+
+    def parse_mblog(self, weibo_info):
+        """解析一条微博中不需要请求长微博页面的部分
+
+        返回(微博, 源微博, 微博发布时间, 源微博发布时间)，需要请求长微博页面或不存在的部分为None，
+        由get_one_weibo处理。
+        """
+        weibo = None
+        if not self.is_long_weibo(weibo_info):
+            weibo = self.parse_weibo_info(weibo_info)
+        retweet = None
+        retweet_created_at = None
+        retweeted_status = weibo_info.get("retweeted_status")
+        if retweeted_status and retweeted_status.get("id"):
+            if not self.is_long_retweet(retweeted_status):
+                retweet = self.parse_weibo_info(retweeted_status)
+            retweet_created_at = self.standardize_date(retweeted_status["created_at"])
+        created_at = self.standardize_date(weibo_info["created_at"])
+        return weibo, retweet, created_at, retweet_created_at
+
+    def get_parse_pool(self):
+        with self.parse_pool_lock:
+            if self.parse_pool is None:
+                self.parse_pool = ProcessPoolExecutor(
+                    max_workers=self.parse_processes,
+                    initializer=init_parse_worker,
+                    initargs=(self.remove_html_tag, self.weibo_fields),
+                )
+            return self.parse_pool
+
+    def parse_cards(self, cards):
+        """用解析进程分批预先解析一页中的微博，返回与cards一一对应的parse_mblog结果
+
+        未开启解析进程或微博较少时返回空列表，由get_one_weibo在当前线程中解析。
+        """
+        mblogs = [card["mblog"] for card in cards if card["card_type"] == 9]
+        if self.parse_processes <= 1 or len(mblogs) < PARSE_POOL_MIN_BATCH:
+            return []
+        size = int(math.ceil(len(mblogs) / self.parse_processes))
+        batches = [mblogs[i:i + size] for i in range(0, len(mblogs), size)]
+        results = iter(
+            [result for batch in self.get_parse_pool().map(parse_mblogs, batches) for result in batch]
+        )
+        return [next(results) if card["card_type"] == 9 else None for card in cards]
+
+    def unwrap_card(self, w):
+        """card_type为11的卡片组中，第一张卡片才是微博"""
+        if w["card_type"] == 11:
+            temp = w.get("card_group",[0])
+            if len(temp) >= 1:
+                w = temp[0] or w
+        return w
 
     def print_user_info(self):
         """打印用户信息"""
@@ -1095,49 +1627,65 @@ class Weibo(object):
         self.print_one_weibo(weibo)
         logger.info("-" * 120)
 
-    def get_one_weibo(self, info):
-        """获取一条微博的全部信息"""
+    def get_one_weibo(self, info, parsed=None, long_statuses=None):
+        """获取一条微博的全部信息，parsed为解析进程中parse_mblog的结果，long_statuses为本页预先获取的长微博"""
         try:
             weibo_info = info["mblog"]
-            weibo_id = weibo_info["id"]
             retweeted_status = weibo_info.get("retweeted_status")
-            is_long = (
-                True if weibo_info.get("pic_num") > 9 else weibo_info.get("isLongText")
-            )
+            is_long = self.is_long_weibo(weibo_info)
+            parsed_weibo, parsed_retweet, created_at, retweet_created_at = parsed or (None,) * 4
             if retweeted_status and retweeted_status.get("id"):  # 转发
-                retweet_id = retweeted_status.get("id")
-                is_long_retweet = retweeted_status.get("isLongText")
                 if is_long:
-                    weibo = self.get_long_weibo(weibo_id)
-                    if not weibo:
-                        weibo = self.parse_weibo(weibo_info)
+                    weibo = self.get_long_weibo(weibo_info, long_statuses)
+                elif parsed_weibo is not None:
+                    weibo = self.analyze_weibo(parsed_weibo)
                 else:
                     weibo = self.parse_weibo(weibo_info)
-                if is_long_retweet:
-                    retweet = self.get_long_weibo(retweet_id)
-                    if not retweet:
-                        retweet = self.parse_weibo(retweeted_status)
-                else:
-                    retweet = self.parse_weibo(retweeted_status)
-                (
-                    retweet["created_at"],
-                    retweet["full_created_at"],
-                ) = self.standardize_date(retweeted_status["created_at"])
-                weibo["retweet"] = retweet
+                weibo["retweet"] = self.get_retweet(
+                    retweeted_status, parsed_retweet, retweet_created_at, long_statuses
+                )
             else:  # 原创
                 if is_long:
-                    weibo = self.get_long_weibo(weibo_id)
-                    if not weibo:
-                        weibo = self.parse_weibo(weibo_info)
+                    weibo = self.get_long_weibo(weibo_info, long_statuses)
+                elif parsed_weibo is not None:
+                    weibo = self.analyze_weibo(parsed_weibo)
                 else:
                     weibo = self.parse_weibo(weibo_info)
-            weibo["created_at"], weibo["full_created_at"] = self.standardize_date(
+            weibo["created_at"], weibo["full_created_at"] = created_at or self.standardize_date(
                 weibo_info["created_at"]
             )
             return weibo
         except Exception as e:
             logger.exception(e)
 
+    def get_retweet_cache_fingerprint(self):
+        """影响源微博解析结果的配置的摘要，这些配置不同的运行不共用保存在文件中的缓存"""
+        key = jsoncodec.dumps(
+            [RETWEET_CACHE_FORMAT, sorted(self.weibo_fields), self.remove_html_tag]
+        )
+        return "{:08x}".format(zlib.crc32(key.encode("utf-8")))
+
+    def get_retweet(self, retweeted_status, parsed_retweet=None, retweet_created_at=None, long_statuses=None):
+        """获取转发微博的源微博，开启retweet_cache时优先使用未过期的缓存"""
+        retweet_id = retweeted_status["id"]
+        if self.retweet_cache:
+            retweet = self.retweet_cache.get(retweet_id)
+            if retweet is not None:
+                return retweet
+        if self.is_long_retweet(retweeted_status):
+            retweet = self.get_long_weibo(retweeted_status, long_statuses)
+        elif parsed_retweet is not None:
+            retweet = self.analyze_weibo(parsed_retweet)
+        else:
+            retweet = self.parse_weibo(retweeted_status)
+        (
+            retweet["created_at"],
+            retweet["full_created_at"],
+        ) = retweet_created_at or self.standardize_date(retweeted_status["created_at"])
+        if self.retweet_cache:
+            self.retweet_cache.put(retweet_id, retweet)
+        return retweet
+
     def get_weibo_comments(self, weibo, max_count, on_downloaded):
         """
         :weibo standardlized weibo
@@ -1184,15 +1732,11 @@ class Weibo(object):
         if max_id:
             params["max_id"] = max_id
         url = "https://m.weibo.cn/comments/hotflow?max_id_type=0"
-        req = self.session.get(
-            url,
-            params=params,
-            headers=self.headers,
-        )
+        req = self.weibo_get(url, params=params)
         json = None
         error = False
         try:
-            json = req.json()
+            json = jsoncodec.loads(req.content)
         except Exception as e:
             # 没有cookie会抓取失败
             # 微博日期小于某个日期的用这个url会被403 需要用老办法尝试一下
@@ -1218,10 +1762,6 @@ class Weibo(object):
         if on_downloaded:
             on_downloaded(weibo, comments)
 
-        # 随机睡眠一下
-        if max_count % 40 == 0:
-            sleep(random.randint(1, 5))
-
         cur_count += count
         max_id = data.get("max_id")
 
@@ -1248,10 +1788,10 @@ class Weibo(object):
         url = "https://m.weibo.cn/api/comments/show?id={id}&page={page}".format(
             id=id, page=page
         )
-        req = self.session.get(url)
+        req = self.weibo_get(url)
         json = None
         try:
-            json = req.json()
+            json = jsoncodec.loads(req.content)
         except Exception as e:
             logger.warning("未能抓取完整评论 微博id: {id}".format(id=id))
             return
@@ -1271,10 +1811,6 @@ class Weibo(object):
         cur_count += count
         page += 1
 
-        # 随机睡眠一下
-        if page % 2 == 0:
-            sleep(random.randint(1, 5))
-
         req_page = data.get("max")
 
         if req_page == 0:
@@ -1301,15 +1837,11 @@ class Weibo(object):
         id = weibo["id"]
         url = "https://m.weibo.cn/api/statuses/repostTimeline"
         params = {"id": id, "page": page}
-        req = self.session.get(
-            url,
-            params=params,
-            headers=self.headers,
-        )
+        req = self.weibo_get(url, params=params)
 
         json = None
         try:
-            json = req.json()
+            json = jsoncodec.loads(req.content)
         except Exception as e:
             logger.warning(
                 "未能抓取完整转发 微博id: {id}".format(id=id)
@@ -1331,10 +1863,6 @@ class Weibo(object):
         cur_count += count
         page += 1
 
-        # 随机睡眠一下
-        if page % 2 == 0:
-            sleep(random.randint(2, 5))
-
         req_page = data.get("max")
 
         if req_page == 0:
@@ -1353,29 +1881,33 @@ class Weibo(object):
         return isTop
     
 
-    def get_one_page(self, page):
-        """获取一页的全部微博"""
+    def get_one_page(self, page, js=None):
+        """获取一页的全部微博，js为已预先获取的页面数据"""
         try:
-            js = self.get_weibo_json(page)
-            import json
-            with open('js.json','w') as f:
-                #写入方式1，等价于下面这行
-                json.dump(js,f) #把列表numbers内容写入到"list.json"文件中
+            if js is None:
+                js = self.get_weibo_json(page)
             if js["ok"]:
                 weibos = js["data"]["cards"]
                 
                 if self.query:
                     weibos = weibos[0]["card_group"]
+                weibos = [self.unwrap_card(w) for w in weibos]
+                known = [self.is_known_card(w) for w in weibos]
+                # 解析进程只负责解析，是否结束仍在下面按顺序判断
+                unknown = [w for w, is_known in zip(weibos, known) if not is_known]
+                parsed_list = self.parse_cards(unknown)
+                parsed_map = dict(zip(map(id, unknown), parsed_list))
+                long_statuses = self.prefetch_long_weibos(self.get_prefetch_cards(unknown))
                 # 如果需要检查cookie，在循环第一个人的时候，就要看看仅自己可见的信息有没有，要是没有直接报错
-                for w in weibos:
-                    if w["card_type"] == 11:
-                        temp = w.get("card_group",[0])
-                        if len(temp) >= 1:
-                            w = temp[0] or w
-                        else:
-                            w = w
+                for w, is_known in zip(weibos, known):
+                    if is_known:
+                        # 已抓取过的微博不再解析，也不再请求长微博，但仍要按发布时间判断是否结束
+                        if self.is_known_weibo_end(w):
+                            self.log_page_end(page)
+                            return True
+                        continue
                     if w["card_type"] == 9:
-                        wb = self.get_one_weibo(w)
+                        wb = self.get_one_weibo(w, parsed_map.get(id(w)), long_statuses)
                         if wb:
                             if (
                                 const.CHECK_COOKIE["CHECK"]
@@ -1388,7 +1920,7 @@ class Weibo(object):
                                 logger.info("cookie检查通过")
                                 if const.CHECK_COOKIE["EXIT_AFTER_CHECK"]:
                                     return True
-                            if wb["id"] in self.weibo_id_list:
+                            if wb["id"] in self.seen_ids:
                                 continue
                             created_at = datetime.strptime(wb["created_at"], DTFORMAT)
                             since_date = datetime.strptime(
@@ -1400,18 +1932,19 @@ class Weibo(object):
                                 # 由于微博本身的调整，下面判断是否为置顶的代码已失效，默认所有用户第一条均为置顶
                                 if self.is_pinned_weibo(w):
                                     continue
-                                if const.CHECK_COOKIE["GUESS_PIN"]:
-                                    const.CHECK_COOKIE["GUESS_PIN"] = False
+                                if self.guess_pin:
+                                    self.guess_pin = False
                                     continue
 
                                 if self.first_crawler:
                                     # 置顶微博的具体时间不好判定，将非置顶微博当成最新微博，写入上次抓取id的csv
                                     self.latest_weibo_id = str(wb["id"])
-                                    csvutil.update_last_weibo_id(
-                                        wb["user_id"],
-                                        str(wb["id"]) + " " + wb["created_at"],
-                                        self.user_csv_file_path,
-                                    )
+                                    with self.file_lock:
+                                        csvutil.update_last_weibo_id(
+                                            wb["user_id"],
+                                            str(wb["id"]) + " " + wb["created_at"],
+                                            self.user_csv_file_path,
+                                        )
                                     self.first_crawler = False
                                 if str(wb["id"]) == self.last_weibo_id:
                                     if const.CHECK_COOKIE["CHECK"] and (
@@ -1448,27 +1981,20 @@ class Weibo(object):
                                 ):
                                     continue
                                 else:
-                                    logger.info(
-                                        "{}已获取{}({})的第{}页{}微博{}".format(
-                                            "-" * 30,
-                                            self.user["screen_name"],
-                                            self.user["id"],
-                                            page,
-                                            '包含"' + self.query + '"的'
-                                            if self.query
-                                            else "",
-                                            "-" * 30,
-                                        )
-                                    )
+                                    self.log_page_end(page)
                                     return True
+                            if self.until_date and created_at > datetime.strptime(
+                                self.until_date, DTFORMAT
+                            ):
+                                continue  # 晚于until_date的微博不抓取
                             if (not self.only_crawl_original) or ("retweet" not in wb.keys()):
                                 self.weibo.append(wb)
-                                self.weibo_id_list.append(wb["id"])
+                                self.seen_ids.add(wb["id"])
                                 self.got_count += 1
                                 # 这里是系统日志输出，尽量别太杂
                                 logger.info(
                                     "已获取用户 {} 的微博，内容为 {}".format(
-                                        self.user["screen_name"], wb["text"]
+                                        self.user["screen_name"], wb.get("text", wb["id"])
                                     )
                                 )
                                 # self.print_weibo(wb)
@@ -1490,6 +2016,66 @@ class Weibo(object):
         except Exception as e:
             logger.exception(e)
 
+    def is_known_card(self, w):
+        """是否为已抓取过的微博，已抓取过的微博不再解析，也不再请求长微博
+
+        包括本次运行中已抓取的微博（如同一用户的其他关键词已抓取到），seen_index_refresh为0时
+        还包括之前的运行已写入的微博；为1时后者仍会解析，以便数据库中的计数得到更新，见get_new_weibos。
+        append模式由last_weibo_id判断结束，需要检查cookie时需要解析微博正文，这两种情况不跳过。
+        """
+        if w["card_type"] != 9 or const.MODE != "overwrite":
+            return False
+        if const.CHECK_COOKIE["CHECK"] and not const.CHECK_COOKIE["CHECKED"]:
+            return False
+        weibo_id = int(w["mblog"]["id"])
+        return weibo_id in self.seen_ids or (
+            not self.seen_index_refresh and weibo_id in self.stored_ids
+        )
+
+    def get_prefetch_cards(self, cards):
+        """本页中可能被抓取的微博，早于since_date的微博之后及晚于until_date的微博不预先获取长微博"""
+        result = []
+        for w in cards:
+            if w["card_type"] != 9:
+                continue
+            if const.MODE == "append" and str(w["mblog"]["id"]) == self.last_weibo_id:
+                break
+            if self.is_pinned_weibo(w):
+                result.append(w)
+                continue
+            try:
+                created_at, _ = self.standardize_date(w["mblog"]["created_at"])
+            except ValueError:
+                result.append(w)
+                continue
+            if created_at < self.user_config["since_date"]:
+                break
+            if self.until_date and created_at > self.until_date:
+                continue
+            result.append(w)
+        return result
+
+    def is_known_weibo_end(self, w):
+        """按未解析的发布时间判断已抓取过的微博是否早于since_date"""
+        if self.is_pinned_weibo(w):
+            return False
+        created_at, _ = self.standardize_date(w["mblog"]["created_at"])
+        return created_at < self.user_config["since_date"]
+
+    def log_page_end(self, page):
+        logger.info(
+            "{}已获取{}({})的第{}页{}微博{}".format(
+                "-" * 30,
+                self.user["screen_name"],
+                self.user["id"],
+                page,
+                '包含"' + self.query + '"的'
+                if self.query
+                else "",
+                "-" * 30,
+            )
+        )
+
     def get_page_count(self):
         """获取微博页数"""
         try:
@@ -1513,10 +2099,19 @@ class Weibo(object):
                 "中的“设置cookie”部分设置cookie信息"
             )
 
+    def get_new_weibos(self, wrote_count):
+        """self.weibo[wrote_count:]中之前的运行未写入过的微博
+
+        seen_index中已有的微博仍会写入数据库和json以更新计数，但不再追加到csv、发送POST、下载文件或获取评论和转发。
+        """
+        if not self.stored_ids:
+            return self.weibo[wrote_count:]
+        return [w for w in self.weibo[wrote_count:] if w["id"] not in self.stored_ids]
+
     def get_write_info(self, wrote_count):
         """获取要写入的微博信息"""
         write_info = []
-        for w in self.weibo[wrote_count:]:
+        for w in self.get_new_weibos(wrote_count):
             wb = OrderedDict()
             for k, v in w.items():
                 if k not in ["user_id", "screen_name", "retweet"]:
@@ -1564,7 +2159,7 @@ class Weibo(object):
             if type in ["img", "video", "live_photo"]:
                 file_dir = os.path.join(file_dir, type)
             if not os.path.isdir(file_dir):
-                os.makedirs(file_dir)
+                os.makedirs(file_dir, exist_ok=True)
             if type in ["img", "video", "live_photo"]:
                 return file_dir
             return os.path.join(file_dir, f"{self.user_config['user_id']}.{type}")
@@ -1574,22 +2169,9 @@ class Weibo(object):
     def get_result_headers(self):
         """获取要写入结果文件的表头"""
         result_headers = [
-            "id",
-            "bid",
-            "正文",
-            "头条文章url",
-            "原始图片url",
-            "视频url",
-            "Live Photo视频url",
-            "位置",
-            "日期",
-            "工具",
-            "点赞数",
-            "评论数",
-            "转发数",
-            "话题",
-            "@用户",
-            "完整日期",
+            header
+            for field, header in WEIBO_HEADERS
+            if field not in WEIBO_FIELDS or field in self.weibo_fields
         ]
         if not self.only_crawl_original:
             result_headers2 = ["是否原创", "源用户id", "源用户昵称"]
@@ -1624,7 +2206,7 @@ class Weibo(object):
             if need_header:
                 writer.writerow(self.get_comment_headers())
                 
-            for comment in comments:
+            for comment in self.flatten_comments(comments):
                 data = [
                     comment.get('id', ''),
                     comment.get('bid', ''),
@@ -1640,14 +2222,37 @@ class Weibo(object):
                 ]
                 writer.writerow(data)
 
-    def write_comments_csv(self, wrote_count):
-        for w in self.weibo[wrote_count:]:
-            if w["comments_count"] > 0:
-                self.get_weibo_comments(
-                    w,
-                    self.comment_max_download_count,
-                    self.csv_insert_comments
-                )
+    def flatten_comments(self, comments):
+        """依次返回各条评论及随其返回的回复"""
+        for comment in comments:
+            if not comment:
+                continue
+            yield comment
+            replies = comment.get("comments")
+            if isinstance(replies, list):
+                for reply in replies:
+                    if reply:
+                        yield reply
+
+    def csv_insert_reposts(self, reposts):
+        """把转发追加写入<用户>_reposts.csv，reposts为parse_sqlite_repost解析后的转发"""
+        if not reposts:
+            return
+        repost_file = self.get_filepath("csv").replace(".csv", "_reposts.csv")
+        need_header = not os.path.exists(repost_file)
+        with open(repost_file, "a", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            if need_header:
+                writer.writerow(RepostRecord.fields)
+            writer.writerows([repost.get(key, "") for key in RepostRecord.fields] for repost in reposts)
+
+    def write_interactions_csv(self, interactions, reposts):
+        """评论按原格式写入<用户>_comments.csv，设置了csv_reposts时转发写入<用户>_reposts.csv"""
+        for weibo, comments, _ in interactions:
+            if comments:
+                self.csv_insert_comments(weibo, comments)
+        if self.csv_reposts:
+            self.csv_insert_reposts(reposts)
 
     def csv_helper(self, headers, result_data, file_path):
         """将指定信息写入csv文件"""
@@ -1700,17 +2305,28 @@ class Weibo(object):
             data["weibo"] = weibo_info
         return data
 
-    def write_json(self, wrote_count):
-        """将爬到的信息写入json文件"""
+    def update_json_records(self, data, key, records):
+        """按id合并评论或转发，已经存在于json中的更新为最新值"""
+        merged = OrderedDict((str(r["id"]), r) for r in data.get(key, []))
+        for record in records:
+            merged[str(record["id"])] = record
+        data[key] = list(merged.values())
+
+    def write_json(self, wrote_count, comments=None, reposts=None):
+        """将爬到的信息写入json文件，下载了评论、转发时一并写入"""
         data = {}
         path = self.get_filepath("json")
         if os.path.isfile(path):
-            with codecs.open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            with open(path, "rb") as f:
+                data = jsoncodec.loads(f.read())
         weibo_info = self.weibo[wrote_count:]
         data = self.update_json_data(data, weibo_info)
-        with codecs.open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False)
+        if comments is not None:
+            self.update_json_records(data, "comments", comments)
+        if reposts is not None:
+            self.update_json_records(data, "reposts", reposts)
+        with open(path, "wb") as f:
+            f.write(jsoncodec.dumpb(data))
         logger.info("%d条微博写入json文件完毕,保存路径:", self.got_count)
         logger.info(path)
 
@@ -1721,7 +2337,7 @@ class Weibo(object):
         }
         for attempt in range(max_retries + 1):
             try:
-                response = self.session.get(url, json=data, headers=headers)
+                response = http_client.get_session("post").get(url, json=data, headers=headers)
                 if response.status_code == requests.codes.ok:
                     return response.json()
                 else:
@@ -1736,8 +2352,8 @@ class Weibo(object):
     def write_post(self, wrote_count):
         """将爬到的信息通过POST发出"""
         data = {}
-        data['user'] = self.user
-        weibo_info = self.weibo[wrote_count:]
+        data['user'] = to_dict(self.user)
+        weibo_info = [w.to_dict() for w in self.get_new_weibos(wrote_count)]
         if data.get('weibo'):
             data['weibo'] += weibo_info
         else:
@@ -1763,15 +2379,24 @@ class Weibo(object):
             client = MongoClient(self.mongodb_URI)
             db = client["weibo"]
             collection = db[collection]
-            if len(self.write_mode) > 1:
-                new_info_list = copy.deepcopy(info_list)
-            else:
-                new_info_list = info_list
-            for info in new_info_list:
-                if not collection.find_one({"id": info["id"]}):
-                    collection.insert_one(info)
-                else:
-                    collection.update_one({"id": info["id"]}, {"$set": info})
+            info_list = [upsert.with_hash(to_dict(info)) for info in info_list]
+            # 先查出已保存的content_hash和计数，未变化的文档跳过，只有计数变化的文档只更新计数
+            projection = dict.fromkeys(["id", upsert.HASH_FIELD, *upsert.COUNTER_FIELDS], 1)
+            projection["_id"] = 0
+            stored = {}
+            for chunk in upsert.chunks([info["id"] for info in info_list]):
+                for doc in collection.find({"id": {"$in": chunk}}, projection):
+                    stored[str(doc["id"])] = doc
+            new, changed, counter_only, _ = upsert.classify(info_list, stored)
+            if new:
+                collection.insert_many(new)
+            for info in changed:
+                collection.update_one({"id": info["id"]}, {"$set": info})
+            for info in counter_only:
+                collection.update_one(
+                    {"id": info["id"]},
+                    {"$set": {key: info[key] for key in upsert.counters_of(info)}},
+                )
         except pymongo.errors.ServerSelectionTimeoutError:
             logger.warning("系统中可能没有安装或启动MongoDB数据库，请先根据系统环境安装或启动MongoDB，再运行程序")
             sys.exit()
@@ -1781,6 +2406,13 @@ class Weibo(object):
         self.info_to_mongodb("weibo", self.weibo[wrote_count:])
         logger.info("%d条微博写入MongoDB数据库完毕", self.got_count)
 
+    def interactions_to_mongodb(self, comments, reposts):
+        """将评论和转发写入MongoDB数据库的comments和reposts集合"""
+        if comments:
+            self.info_to_mongodb("comments", comments)
+        if reposts:
+            self.info_to_mongodb("reposts", reposts)
+
     def mysql_create(self, connection, sql):
         """创建MySQL数据库或表"""
         try:
@@ -1815,10 +2447,31 @@ class Weibo(object):
         connection = pymysql.connect(**mysql_config)
         self.mysql_create(connection, sql)
 
+    def mysql_add_hash_column(self, mysql_config, table):
+        """给旧版本建的表添加content_hash列"""
+        import pymysql
+
+        if self.mysql_config:
+            mysql_config = self.mysql_config
+        mysql_config["db"] = "weibo"
+        connection = pymysql.connect(**mysql_config)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "ALTER TABLE {} ADD COLUMN {} varchar(32)".format(table, upsert.HASH_FIELD)
+                )
+        except pymysql.err.OperationalError as e:
+            if e.args[0] != 1060:  # 1060: 列已存在
+                raise
+        finally:
+            connection.close()
+
     def mysql_insert(self, mysql_config, table, data_list):
         """
         向MySQL表插入或更新数据
 
+        各行先与表中已保存的content_hash和计数列比较，未变化的行跳过，只有计数变化的行只更新计数列
+
         Parameters
         ----------
         mysql_config: map
@@ -1835,6 +2488,7 @@ class Weibo(object):
         import pymysql
 
         if len(data_list) > 0:
+            data_list = [upsert.with_hash(data) for data in data_list]
             keys = ", ".join(data_list[0].keys())
             values = ", ".join(["%s"] * len(data_list[0]))
             if self.mysql_config:
@@ -1850,8 +2504,21 @@ class Weibo(object):
                 [" {key} = values({key})".format(key=key) for key in data_list[0]]
             )
             sql += update
+            counters = upsert.counters_of(data_list[0])
             try:
-                cursor.executemany(sql, [tuple(data.values()) for data in data_list])
+                stored = self.mysql_stored_rows(
+                    cursor, table, counters, [data["id"] for data in data_list]
+                )
+                new, changed, counter_only, _ = upsert.classify(data_list, stored)
+                if new or changed:
+                    cursor.executemany(sql, [tuple(data.values()) for data in new + changed])
+                if counter_only:
+                    cursor.executemany(
+                        "UPDATE {} SET {} WHERE id = %s".format(
+                            table, ", ".join("{} = %s".format(key) for key in counters)
+                        ),
+                        [tuple(data[key] for key in counters) + (data["id"],) for data in counter_only],
+                    )
                 connection.commit()
             except Exception as e:
                 connection.rollback()
@@ -1859,6 +2526,21 @@ class Weibo(object):
             finally:
                 connection.close()
 
+    def mysql_stored_rows(self, cursor, table, counters, ids):
+        """查询MySQL表中已保存的行的content_hash和计数列，返回{str(id): 行}"""
+        columns = ["id", upsert.HASH_FIELD] + counters
+        stored = {}
+        for chunk in upsert.chunks(ids):
+            cursor.execute(
+                "SELECT {} FROM {} WHERE id IN ({})".format(
+                    ", ".join(columns), table, ", ".join(["%s"] * len(chunk))
+                ),
+                chunk,
+            )
+            for row in cursor.fetchall():
+                stored[str(row[0])] = dict(zip(columns, row))
+        return stored
+
     def weibo_to_mysql(self, wrote_count):
         """将爬取的微博信息写入MySQL数据库"""
         mysql_config = {
@@ -1869,38 +2551,44 @@ class Weibo(object):
             "charset": "utf8mb4",
         }
         # 创建'weibo'表
+        weibo_columns = self.get_weibo_columns(
+            [
+                ("id", "varchar(20) NOT NULL"),
+                ("bid", "varchar(12) NOT NULL"),
+                ("user_id", "varchar(20)"),
+                ("screen_name", "varchar(30)"),
+                ("text", "text"),
+                ("article_url", "varchar(100)"),
+                ("topics", "varchar(200)"),
+                ("at_users", "varchar(1000)"),
+                ("pics", "varchar(3000)"),
+                ("video_url", "varchar(1000)"),
+                ("live_photo_url", "varchar(1000)"),
+                ("location", "varchar(100)"),
+                ("created_at", "DATETIME"),
+                ("source", "varchar(30)"),
+                ("attitudes_count", "INT"),
+                ("comments_count", "INT"),
+                ("reposts_count", "INT"),
+                ("retweet_id", "varchar(20)"),
+                ("content_hash", "varchar(32)"),
+            ]
+        )
         create_table = """
                 CREATE TABLE IF NOT EXISTS weibo (
-                id varchar(20) NOT NULL,
-                bid varchar(12) NOT NULL,
-                user_id varchar(20),
-                screen_name varchar(30),
-                text text,
-                article_url varchar(100),
-                topics varchar(200),
-                at_users varchar(1000),
-                pics varchar(3000),
-                video_url varchar(1000),
-                live_photo_url varchar(1000),
-                location varchar(100),
-                created_at DATETIME,
-                source varchar(30),
-                attitudes_count INT,
-                comments_count INT,
-                reposts_count INT,
-                retweet_id varchar(20),
+                {},
                 PRIMARY KEY (id)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""".format(
+            ",\n                ".join(weibo_columns)
+        )
         self.mysql_create_table(mysql_config, create_table)
+        self.mysql_add_hash_column(mysql_config, "weibo")
 
         # 要插入的微博列表
         weibo_list = []
         # 要插入的转发微博列表
         retweet_list = []
-        if len(self.write_mode) > 1:
-            info_list = copy.deepcopy(self.weibo[wrote_count:])
-        else:
-            info_list = self.weibo[wrote_count:]
+        info_list = [w.to_dict() for w in self.weibo[wrote_count:]]
         for w in info_list:
             w["created_at"] = w["full_created_at"]
             del w["full_created_at"]
@@ -1921,11 +2609,61 @@ class Weibo(object):
         self.mysql_insert(mysql_config, "weibo", weibo_list)
         logger.info("%d条微博写入MySQL数据库完毕", self.got_count)
 
+    def interactions_to_mysql(self, comments, reposts):
+        """将评论和转发写入MySQL数据库的comments和reposts表"""
+        mysql_config = {
+            "host": "localhost",
+            "port": 3306,
+            "user": "root",
+            "password": "123456",
+            "charset": "utf8mb4",
+        }
+        if comments:
+            create_table = """
+                    CREATE TABLE IF NOT EXISTS comments (
+                    id varchar(20) NOT NULL,
+                    bid varchar(20),
+                    root_id varchar(20),
+                    created_at varchar(40),
+                    weibo_id varchar(20) NOT NULL,
+                    user_id varchar(20) NOT NULL,
+                    user_screen_name varchar(64),
+                    user_avatar_url varchar(300),
+                    text text,
+                    pic_url varchar(300),
+                    like_count INT,
+                    content_hash varchar(32),
+                    PRIMARY KEY (id),
+                    KEY idx_weibo_id (weibo_id)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+            self.mysql_create_table(mysql_config, create_table)
+            # 没有点赞时解析结果为''，MySQL的INT列不接受
+            rows = [dict(c.items(), like_count=c["like_count"] or 0) for c in comments]
+            self.mysql_insert(mysql_config, "comments", rows)
+        if reposts:
+            create_table = """
+                    CREATE TABLE IF NOT EXISTS reposts (
+                    id varchar(20) NOT NULL,
+                    bid varchar(20),
+                    created_at varchar(40),
+                    weibo_id varchar(20) NOT NULL,
+                    user_id varchar(20) NOT NULL,
+                    user_screen_name varchar(64),
+                    user_avatar_url varchar(300),
+                    text text,
+                    like_count INT,
+                    content_hash varchar(32),
+                    PRIMARY KEY (id),
+                    KEY idx_weibo_id (weibo_id)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+            self.mysql_create_table(mysql_config, create_table)
+            rows = [dict(r.items(), like_count=r["like_count"] or 0) for r in reposts]
+            self.mysql_insert(mysql_config, "reposts", rows)
+
     def weibo_to_sqlite(self, wrote_count):
-        con = self.get_sqlite_connection()
         weibo_list = []
         retweet_list = []
-        info_list = copy.deepcopy(self.weibo[wrote_count:])
+        info_list = [w.to_dict() for w in self.weibo[wrote_count:]]
         for w in info_list:
             if "retweet" in w:
                 w["retweet"]["retweet_id"] = ""
@@ -1936,32 +2674,18 @@ class Weibo(object):
                 w["retweet_id"] = ""
             weibo_list.append(w)
 
-        comment_max_count = self.comment_max_download_count
-        repost_max_count = self.comment_max_download_count
-        download_comment = self.download_comment and comment_max_count > 0
-        download_repost = self.download_repost and repost_max_count > 0
-
-        count = 0
         for weibo in weibo_list:
-            self.sqlite_insert_weibo(con, weibo)
-            if (download_comment) and (weibo["comments_count"] > 0):
-                self.get_weibo_comments(
-                    weibo, comment_max_count, self.sqlite_insert_comments
-                )
-                count += 1
-                if count % 20:
-                    sleep(random.randint(3, 6))
-            if (download_repost) and (weibo["reposts_count"] > 0):
-                self.get_weibo_reposts(
-                    weibo, repost_max_count, self.sqlite_insert_reposts
-                )
-                count += 1
-                if count % 20:
-                    sleep(random.randint(3, 6))
+            self.sqlite_insert_weibo(weibo)
 
+        stored_ids = set()
         for weibo in retweet_list:
-            self.sqlite_insert_weibo(con, weibo)
-        con.close()
+            # 多条微博转发同一条源微博时只写入一次，开启retweet_cache时源微博重新解析前不再重复写入
+            if weibo["id"] in stored_ids:
+                continue
+            stored_ids.add(weibo["id"])
+            if self.retweet_cache and not self.retweet_cache.claim_store(weibo["id"]):
+                continue
+            self.sqlite_insert_weibo(weibo)
 
     def export_comments_to_csv_for_current_user(self):
         """将当前用户相关的评论从 SQLite 导出到该用户目录下的 CSV 文件"""
@@ -1984,7 +2708,7 @@ class Weibo(object):
             csv_path = self.get_filepath("csv")
             user_dir = os.path.dirname(csv_path)
             if not os.path.isdir(user_dir):
-                os.makedirs(user_dir)
+                os.makedirs(user_dir, exist_ok=True)
             # 使用用户昵称作为文件名的一部分，避免再出现纯数字 user_id
             screen_name = self.user.get("screen_name") or user_id
             safe_screen_name = re.sub(r'[\\/:*?"<>|]', "_", str(screen_name))
@@ -2056,33 +2780,68 @@ class Weibo(object):
         except Exception as e:
             logger.exception(e)
 
-    def sqlite_insert_comments(self, weibo, comments):
-        if not comments or len(comments) == 0:
-            return
-        con = self.get_sqlite_connection()
+    def interactions_to_sqlite(self, comments, reposts):
+        """将解析后的评论和转发写入SQLite数据库"""
         for comment in comments:
-            data = self.parse_sqlite_comment(comment, weibo)
-            self.sqlite_insert(con, data, "comments")
-            if "comments" in comment and isinstance(comment["comments"], list):
-                for c in comment["comments"]:
-                    data = self.parse_sqlite_comment(c, weibo)
-                    self.sqlite_insert(con, data, "comments")
-        con.close()
-
-    def sqlite_insert_reposts(self, weibo, reposts):
-        if not reposts or len(reposts) == 0:
-            return
-        con = self.get_sqlite_connection()
+            self.sqlite_insert(comment, "comments")
         for repost in reposts:
-            data = self.parse_sqlite_repost(repost, weibo)
-            self.sqlite_insert(con, data, "reposts")
+            self.sqlite_insert(repost, "reposts")
+
+    def get_interactions(self, wrote_count):
+        """获取self.weibo[wrote_count:]中之前的运行未写入过的各条微博的评论和转发
+
+        每条微博的评论和转发只请求一次，再交给各个写入方式，返回[(微博, 评论列表, 转发列表)]。
+        """
+        comment_max_count = self.comment_max_download_count
+        repost_max_count = self.repost_max_download_count
+        download_comment = (
+            self.download_comment
+            and comment_max_count > 0
+            and INTERACTION_SINKS.intersection(self.write_mode)
+        )
+        download_repost = (
+            self.download_repost
+            and repost_max_count > 0
+            and (
+                RECORD_SINKS.intersection(self.write_mode)
+                or (self.csv_reposts and "csv" in self.write_mode)
+            )
+        )
+        interactions = []
+        if not download_comment and not download_repost:
+            return interactions
+        for weibo in self.get_new_weibos(wrote_count):
+            comments, reposts = [], []
+            if download_comment and weibo["comments_count"] > 0:
+                self.get_weibo_comments(
+                    weibo, comment_max_count, lambda _, page: comments.extend(page)
+                )
+            if download_repost and weibo["reposts_count"] > 0:
+                self.get_weibo_reposts(
+                    weibo, repost_max_count, lambda _, page: reposts.extend(page)
+                )
+            if comments or reposts:
+                interactions.append((weibo, comments, reposts))
+        return interactions
+
+    def parse_interactions(self, interactions):
+        """把评论（含其下的回复）和转发解析为写入数据库的记录，评论图片也在此时下载
 
-        con.close()
+        只写入csv时评论按原始数据写入，不解析评论（也不下载评论图片）。
+        """
+        parse_comments = bool(RECORD_SINKS.intersection(self.write_mode))
+        comments, reposts = [], []
+        for weibo, weibo_comments, weibo_reposts in interactions:
+            for comment in self.flatten_comments(weibo_comments) if parse_comments else ():
+                comments.append(self.parse_sqlite_comment(comment, weibo))
+            for repost in weibo_reposts:
+                reposts.append(self.parse_sqlite_repost(repost, weibo))
+        return comments, reposts
 
     def parse_sqlite_comment(self, comment, weibo):
         if not comment:
             return
-        sqlite_comment = OrderedDict()
+        sqlite_comment = CommentRecord()
         sqlite_comment["id"] = comment["id"]
 
         self._try_get_value("bid", "bid", sqlite_comment, comment)
@@ -2103,21 +2862,21 @@ class Weibo(object):
         sqlite_comment["pic_url"] = ""
         if comment.get("pic"):
             sqlite_comment["pic_url"] = comment["pic"]["large"]["url"]
-        if sqlite_comment["pic_url"]:
+        if sqlite_comment["pic_url"] and not self.replay:  # 重新解析存档时不下载评论图片
             pic_url = sqlite_comment["pic_url"]
 
             # 评论图片目录：weibo/<用户目录>/<用户昵称>_comments_img
             csv_path = self.get_filepath("csv")
             user_dir = os.path.dirname(csv_path)
             if not os.path.isdir(user_dir):
-                os.makedirs(user_dir)
+                os.makedirs(user_dir, exist_ok=True)
             screen_name = self.user.get("screen_name") or str(
                 self.user_config.get("user_id", "")
             )
             safe_screen_name = re.sub(r'[\\/:*?"<>|]', "_", str(screen_name))
             pic_path = os.path.join(user_dir, f"{safe_screen_name}_comments_img")
             if not os.path.exists(pic_path):
-                os.makedirs(pic_path)
+                os.makedirs(pic_path, exist_ok=True)
 
             # 文件名包含 微博用户昵称 + weibo_id + 评论用户昵称 + comments
             # 为避免重名，如果已存在则在末尾追加 _1/_2/... 序号
@@ -2137,7 +2896,7 @@ class Weibo(object):
             pic_full_path = os.path.join(pic_path, pic_name)
             if not os.path.exists(pic_full_path):
                 try:
-                    response = self.session.get(pic_url, timeout=10)
+                    response = http_client.get_session("media").get(pic_url, timeout=10)
                     with open(pic_full_path, "wb") as f:
                         f.write(response.content)
                     logger.info("评论图片下载成功: %s", pic_full_path)
@@ -2149,7 +2908,7 @@ class Weibo(object):
     def parse_sqlite_repost(self, repost, weibo):
         if not repost:
             return
-        sqlite_repost = OrderedDict()
+        sqlite_repost = RepostRecord()
         sqlite_repost["id"] = repost["id"]
 
         self._try_get_value("bid", "bid", sqlite_repost, repost)
@@ -2176,9 +2935,9 @@ class Weibo(object):
         if value:
             dict[source_name] = value
 
-    def sqlite_insert_weibo(self, con: sqlite3.Connection, weibo: dict):
+    def sqlite_insert_weibo(self, weibo: dict):
         sqlite_weibo = self.parse_sqlite_weibo(weibo)
-        self.sqlite_insert(con, sqlite_weibo, "weibo")
+        self.sqlite_insert(sqlite_weibo, "weibo")
 
     def parse_sqlite_weibo(self, weibo):
         if not weibo:
@@ -2188,30 +2947,33 @@ class Weibo(object):
         sqlite_weibo["id"] = weibo["id"]
         sqlite_weibo["bid"] = weibo["bid"]
         sqlite_weibo["screen_name"] = weibo["screen_name"]
-        sqlite_weibo["text"] = weibo["text"]
-        sqlite_weibo["article_url"] = weibo["article_url"]
-        sqlite_weibo["topics"] = weibo["topics"]
-        sqlite_weibo["pics"] = weibo["pics"]
-        sqlite_weibo["video_url"] = weibo["video_url"]
-        sqlite_weibo["live_photo_url"] = weibo["live_photo_url"]
-        sqlite_weibo["location"] = weibo["location"]
+        # 不在weibo_fields中的字段没有解析，也不写入
+        for key in [
+            "text",
+            "article_url",
+            "topics",
+            "pics",
+            "video_url",
+            "live_photo_url",
+            "location",
+        ]:
+            if key in weibo:
+                sqlite_weibo[key] = weibo[key]
         sqlite_weibo["created_at"] = weibo["full_created_at"]
-        sqlite_weibo["source"] = weibo["source"]
-        sqlite_weibo["attitudes_count"] = weibo["attitudes_count"]
-        sqlite_weibo["comments_count"] = weibo["comments_count"]
-        sqlite_weibo["reposts_count"] = weibo["reposts_count"]
+        for key in ["source", "attitudes_count", "comments_count", "reposts_count"]:
+            if key in weibo:
+                sqlite_weibo[key] = weibo[key]
         sqlite_weibo["retweet_id"] = weibo["retweet_id"]
-        sqlite_weibo["at_users"] = weibo["at_users"]
+        if "at_users" in weibo:
+            sqlite_weibo["at_users"] = weibo["at_users"]
         return sqlite_weibo
 
     def user_to_sqlite(self):
-        con = self.get_sqlite_connection()
-        self.sqlite_insert_user(con, self.user)
-        con.close()
+        self.sqlite_insert_user(self.user)
 
-    def sqlite_insert_user(self, con: sqlite3.Connection, user: dict):
+    def sqlite_insert_user(self, user: dict):
         sqlite_user = self.parse_sqlite_user(user)
-        self.sqlite_insert(con, sqlite_user, "user")
+        self.sqlite_insert(sqlite_user, "user")
 
     def parse_sqlite_user(self, user):
         if not user:
@@ -2232,18 +2994,77 @@ class Weibo(object):
         sqlite_user["bio"] = user["description"]
         return sqlite_user
 
-    def sqlite_insert(self, con: sqlite3.Connection, data: dict, table: str):
+    def sqlite_insert(self, data: dict, table: str):
         if not data:
             return
-        cur = con.cursor()
-        keys = ",".join(data.keys())
-        values = ",".join(["?"] * len(data))
-        sql = """INSERT OR REPLACE INTO {table}({keys}) VALUES({values})
-                """.format(
-            table=table, keys=keys, values=values
-        )
-        cur.execute(sql, list(data.values()))
-        con.commit()
+        if self.sqlite_queue is not None:
+            # 多进程模式下由写入进程统一写入
+            self.put_sqlite_message(("insert", table, dict(data)))
+            return
+        self.get_sqlite_writer().insert(table, data)
+
+    def check_sqlite_writer(self):
+        """多进程模式下写入进程已退出时抛出异常，避免一直等待"""
+        if self.sqlite_writer_gone is not None and self.sqlite_writer_gone.is_set():
+            raise RuntimeError("SQLite写入进程已退出")
+
+    def put_sqlite_message(self, message):
+        """把消息交给写入进程，队列已满时等待，写入进程退出时抛出异常"""
+        while True:
+            self.check_sqlite_writer()
+            try:
+                self.sqlite_queue.put(message, timeout=1)
+                return
+            except Full:
+                continue
+
+    def flush_sqlite(self):
+        """把已缓存的数据写入SQLite，多进程模式下等待写入进程写完本进程已提交的全部数据"""
+        if self.sqlite_queue is not None:
+            self.put_sqlite_message(("flush", self.shard, None))
+            while True:
+                try:
+                    self.sqlite_ack_queue.get(timeout=1)
+                    return
+                except Empty:
+                    self.check_sqlite_writer()
+        elif self.sqlite_writer is not None:
+            self.sqlite_writer.flush()
+
+    def sqlite_query_one(self, sql, params=(), tables=()):
+        """查询SQLite中的一行
+
+        多进程模式下数据库只由写入进程打开和写入，抓取进程用只读连接查询，
+        查不到本进程已提交但写入进程尚未写入的行。
+        """
+        if self.sqlite_queue is None:
+            return self.get_sqlite_writer().query_one(sql, params, tables)
+        with self.sqlite_lock:
+            if self.sqlite_reader is None:
+                uri = "file:{}?mode=ro".format(pathname2url(os.path.abspath(self.get_sqlte_path())))
+                self.sqlite_reader = sqlite3.connect(uri, uri=True, timeout=30, check_same_thread=False)
+            return self.sqlite_reader.execute(sql, params).fetchone()
+
+    def get_sqlite_writer(self):
+        """返回本进程共用的SQLite写入器，第一次调用时打开数据库"""
+        with self.sqlite_lock:
+            if self.sqlite_writer is None:
+                self.get_sqlite_connection().close()  # 数据库不存在时先建表
+                self.sqlite_writer = SQLiteWriter(
+                    self.get_sqlte_path(), SQLITE_WRITE_BATCH_SIZE, SQLITE_UPSERT_TABLES
+                )
+            return self.sqlite_writer
+
+    def close_sqlite(self):
+        """写入剩余数据并关闭SQLite写入器"""
+        with self.sqlite_lock:
+            if self.sqlite_writer is not None:
+                self.sqlite_writer.close()
+                log_sqlite_stats(self.sqlite_writer.stats)
+                self.sqlite_writer = None
+            if self.sqlite_reader is not None:
+                self.sqlite_reader.close()
+                self.sqlite_reader = None
 
     def get_sqlite_connection(self):
         path = self.get_sqlte_path()
@@ -2252,22 +3073,24 @@ class Weibo(object):
         if dir_path and not os.path.exists(dir_path):
             os.makedirs(dir_path, exist_ok=True)
         
-        create_db = not os.path.exists(path)
-        
         try:
-            con = sqlite3.connect(path)
-            if create_db:
-                self.create_sqlite_table(connection=con)
+            con = sqlite3.connect(path, timeout=30)
+            self.create_sqlite_table(connection=con)
             return con
         except sqlite3.Error as e:
             print(f"无法打开数据库: {path}\n错误详情: {str(e)}")
             raise
 
     def create_sqlite_table(self, connection: sqlite3.Connection):
-        sql = self.get_sqlite_create_sql()
-        cur = connection.cursor()
-        cur.executescript(sql)
-        connection.commit()
+        """建表或把已有的数据库升级到最新结构，并补上weibo_fields中新增字段的列"""
+        version = sqlite_schema.migrate(connection, self.get_sqlite_create_sql())
+        if version < sqlite_schema.SCHEMA_VERSION:
+            logger.info("SQLite数据库结构已从版本%d升级到版本%d", version, sqlite_schema.SCHEMA_VERSION)
+        added = sqlite_schema.add_missing_columns(
+            connection, "weibo", self.get_projected_columns(SQLITE_WEIBO_COLUMNS)
+        )
+        if added:
+            logger.info("SQLite数据库weibo表添加了列: %s", ", ".join(added))
 
     def get_sqlte_path(self):
         return "./weibo/weibodata.db"
@@ -2292,24 +3115,7 @@ class Weibo(object):
                 );
 
                 CREATE TABLE IF NOT EXISTS weibo (
-                    id varchar(20) NOT NULL
-                    ,bid varchar(12) NOT NULL
-                    ,user_id varchar(20)
-                    ,screen_name varchar(30)
-                    ,text varchar(2000)
-                    ,article_url varchar(100)
-                    ,topics varchar(200)
-                    ,at_users varchar(1000)
-                    ,pics varchar(3000)
-                    ,video_url varchar(1000)
-                    ,live_photo_url varchar(1000)
-                    ,location varchar(100)
-                    ,created_at DATETIME
-                    ,source varchar(30)
-                    ,attitudes_count INT
-                    ,comments_count INT
-                    ,reposts_count INT
-                    ,retweet_id varchar(20)
+                    {weibo_columns}
                     ,PRIMARY KEY (id)
                 );
 
@@ -2350,9 +3156,28 @@ class Weibo(object):
                     ,like_count integer
                     ,PRIMARY KEY (id)
                 );
-                """
+                """.format(
+            weibo_columns="\n                    ,".join(
+                self.get_weibo_columns(SQLITE_WEIBO_COLUMNS)
+            )
+        )
         return create_sql
 
+    def get_projected_columns(self, columns):
+        """按weibo_fields筛选微博表的列，columns为(列名, 类型)列表"""
+        return [
+            (name, column_type)
+            for name, column_type in columns
+            if name not in WEIBO_FIELDS or name in self.weibo_fields
+        ]
+
+    def get_weibo_columns(self, columns):
+        """按weibo_fields筛选微博表的列，返回建表语句中的各列定义"""
+        return [
+            "{} {}".format(name, column_type)
+            for name, column_type in self.get_projected_columns(columns)
+        ]
+
     def update_user_config_file(self, user_config_file_path):
         """更新用户配置文件"""
         with open(user_config_file_path, "rb") as f:
@@ -2380,79 +3205,338 @@ class Weibo(object):
 
     def write_data(self, wrote_count):
         """将爬到的信息写入文件或数据库"""
-        if self.got_count > wrote_count:
-            if "csv" in self.write_mode:
-                self.write_csv(wrote_count)
-                if self.download_comment:
-                    self.write_comments_csv(wrote_count)
-            if "json" in self.write_mode:
-                self.write_json(wrote_count)
-            if "post" in self.write_mode:
-                self.write_post(wrote_count)
-            if "mysql" in self.write_mode:
-                self.weibo_to_mysql(wrote_count)
-            if "mongo" in self.write_mode:
-                self.weibo_to_mongodb(wrote_count)
-            if "sqlite" in self.write_mode:
-                self.weibo_to_sqlite(wrote_count)
-            if self.original_pic_download:
-                self.download_files("img", "original", wrote_count)
-            if self.original_video_download:
-                self.download_files("video", "original", wrote_count)
-            if self.original_live_photo_download:
-                self.download_files("live_photo", "original", wrote_count)
-            # 下载转发微博文件（如果不禁爬转发）
-            if not self.only_crawl_original:
-                if self.retweet_pic_download:
-                    self.download_files("img", "retweet", wrote_count)
-                if self.retweet_video_download:
-                    self.download_files("video", "retweet", wrote_count)
-                if self.retweet_live_photo_download:
-                    self.download_files("live_photo", "retweet", wrote_count)
+        if len(self.weibo) > wrote_count:
+            # 评论和转发只获取、解析一次，各写入方式共用
+            interactions = []
+
+            def get_interactions():
+                if not interactions:
+                    interactions.append(self.load_interactions(wrote_count))
+                return interactions[0]
+
+            for _, sink in self.get_sinks():
+                sink(wrote_count, get_interactions)
+
+    def get_sinks(self):
+        """返回各写入方式及媒体下载的(名称, 写入函数)列表
+
+        写入函数的参数为(wrote_count, get_interactions)，写入self.weibo[wrote_count:]，
+        需要评论和转发时调用get_interactions()获取(原始评论和转发, 评论记录, 转发记录)。
+        """
+        sinks = []
+        if "csv" in self.write_mode:
+            sinks.append(("csv", self.sink_csv))
+        if "json" in self.write_mode:
+            sinks.append(("json", self.sink_json))
+        if "post" in self.write_mode:
+            sinks.append(("post", lambda wrote_count, _: self.write_post(wrote_count)))
+        if "mysql" in self.write_mode:
+            sinks.append(("mysql", self.sink_mysql))
+        if "mongo" in self.write_mode:
+            sinks.append(("mongo", self.sink_mongodb))
+        if "sqlite" in self.write_mode:
+            sinks.append(("sqlite", self.sink_sqlite))
+        if self.get_download_types():
+            sinks.append(("download", self.sink_download))
+        return sinks
+
+    def load_interactions(self, wrote_count):
+        """获取并解析self.weibo[wrote_count:]的评论和转发"""
+        interactions = self.get_interactions(wrote_count)
+        comments, reposts = self.parse_interactions(interactions)
+        return interactions, comments, reposts
+
+    def sink_csv(self, wrote_count, get_interactions):
+        self.write_csv(wrote_count)
+        interactions, _, reposts = get_interactions()
+        self.write_interactions_csv(interactions, reposts)
+
+    def sink_json(self, wrote_count, get_interactions):
+        _, comments, reposts = get_interactions()
+        self.write_json(
+            wrote_count,
+            comments if self.download_comment else None,
+            reposts if self.download_repost else None,
+        )
+
+    def sink_mysql(self, wrote_count, get_interactions):
+        self.weibo_to_mysql(wrote_count)
+        _, comments, reposts = get_interactions()
+        self.interactions_to_mysql(comments, reposts)
+
+    def sink_mongodb(self, wrote_count, get_interactions):
+        self.weibo_to_mongodb(wrote_count)
+        _, comments, reposts = get_interactions()
+        self.interactions_to_mongodb(comments, reposts)
+
+    def sink_sqlite(self, wrote_count, get_interactions):
+        self.weibo_to_sqlite(wrote_count)
+        _, comments, reposts = get_interactions()
+        self.interactions_to_sqlite(comments, reposts)
+
+    def get_download_types(self):
+        """返回要下载的(文件类型, 原创或转发)列表"""
+        types = []
+        if self.original_pic_download:
+            types.append(("img", "original"))
+        if self.original_video_download:
+            types.append(("video", "original"))
+        if self.original_live_photo_download:
+            types.append(("live_photo", "original"))
+        # 下载转发微博文件（如果不禁爬转发）
+        if not self.only_crawl_original:
+            if self.retweet_pic_download:
+                types.append(("img", "retweet"))
+            if self.retweet_video_download:
+                types.append(("video", "retweet"))
+            if self.retweet_live_photo_download:
+                types.append(("live_photo", "retweet"))
+        return types
+
+    def sink_download(self, wrote_count, _):
+        for file_type, weibo_type in self.get_download_types():
+            self.download_files(file_type, weibo_type, wrote_count)
 
     def get_pages(self):
         """获取全部微博"""
+        finished = False
         try:
             # 用户id不可用
             if self.get_user_info() != 0:
                 return
             logger.info("准备搜集 {} 的微博".format(self.user["screen_name"]))
-            if const.MODE == "append" and (
-                "first_crawler" not in self.__dict__ or self.first_crawler is False
-            ):
+            self.sink_pipeline = self.create_sink_pipeline()
+            if const.MODE == "append" and self.first_crawler is False:
                 # 本次运行的某用户首次抓取，用于标记最新的微博id
                 self.first_crawler = True
-                const.CHECK_COOKIE["GUESS_PIN"] = True
+                self.guess_pin = True
             since_date = datetime.strptime(self.user_config["since_date"], DTFORMAT)
             today = datetime.today()
             if since_date <= today:    # since_date 若为未来则无需执行
                 page_count = self.get_page_count()
-                wrote_count = 0
-                page1 = 0
-                random_pages = random.randint(1, 5)
                 self.start_date = datetime.now().strftime(DTFORMAT)
-                pages = range(self.start_page, page_count + 1)
-                for page in tqdm(pages, desc="Progress"):
-                    is_end = self.get_one_page(page)
-                    if is_end:
-                        break
-
-                    if page % 20 == 0:  # 每爬20页写入一次文件
-                        self.write_data(wrote_count)
-                        wrote_count = self.got_count
+                # 任务队列中的任务可以只包含用户的一段页码
+                start_page = self.user_config.get("start_page", self.start_page)
+                end_page = min(self.user_config.get("end_page", page_count), page_count)
+                resume_page = self.resume_from_journal(start_page)
+                if self.until_date and resume_page == start_page:
+                    resume_page = self.seek_until_date(start_page, end_page)
+                start_page = resume_page
+                wrote_count = len(self.weibo)
+                if start_page is None:
+                    pages = range(0)  # 上次中断前已到达结束条件
+                else:
+                    pages = range(start_page, end_page + 1)
+                if self.page_concurrency > 1:
+                    wrote_count = asyncio.run(
+                        self.get_pages_concurrently(pages, wrote_count)
+                    )
+                else:
+                    for page in tqdm(pages, desc="Progress"):
+                        count = len(self.weibo)
+                        is_end = self.get_one_page(page)
+                        self.journal_page(page, count, is_end)
+                        if is_end:
+                            break
 
-                    # 通过加入随机等待避免被限制。爬虫速度过快容易被系统限制(一段时间后限
-                    # 制会自动解除)，加入随机等待模拟人的操作，可降低被系统限制的风险。默
-                    # 认是每爬取1到5页随机等待6到10秒，如果仍然被限，可适当增加sleep时间
-                    if (page - page1) % random_pages == 0 and page < page_count:
-                        sleep(random.randint(6, 10))
-                        page1 = page
-                        random_pages = random.randint(1, 5)
+                        # 请求间隔由rate_controller统一控制，被限制时会自动放慢
+                        if page % 20 == 0:  # 每爬20页写入一次文件
+                            wrote_count = self.write_pages(wrote_count)
 
-                self.write_data(wrote_count)  # 将剩余不足20页的微博写入文件
+                self.write_pages(wrote_count)  # 将剩余不足20页的微博写入文件
+                self.close_sink_pipeline()
+                finished = True
             logger.info("微博爬取完成，共爬取%d条微博", self.got_count)
         except Exception as e:
             logger.exception(e)
+        finally:
+            try:
+                # 出错时也要等已提交的微博写完，再关闭抓取日志
+                self.close_sink_pipeline()
+            except Exception as e:
+                logger.exception(e)
+            if self.journal:
+                self.journal.close(finished)
+                self.journal = None
+
+    def get_page_oldest_date(self, js):
+        """获取页面中最早一条非置顶微博的发布时间，页面没有微博时返回None"""
+        if not js.get("ok"):
+            return None
+        cards = js["data"]["cards"]
+        if self.query and cards:
+            cards = cards[0].get("card_group", [])
+        oldest = None
+        for card in cards:
+            card = self.unwrap_card(card)
+            if card["card_type"] != 9 or self.is_pinned_weibo(card):
+                continue
+            created_at, _ = self.standardize_date(card["mblog"]["created_at"])
+            created_at = datetime.strptime(created_at, DTFORMAT)
+            if oldest is None or created_at < oldest:
+                oldest = created_at
+        return oldest
+
+    def seek_until_date(self, start_page, end_page):
+        """二分查找第一个包含不晚于until_date的微博的页码
+
+        微博按发布时间从新到旧分页，某页最早的微博不晚于until_date时，之后的页也都满足，
+        因此只需请求约log2(页数)个页面，即可跳过until_date之后的全部页面。
+        """
+        until_date = datetime.strptime(self.until_date, DTFORMAT)
+        low, high = start_page, end_page
+        while low < high:
+            middle = (low + high) // 2
+            oldest = self.get_page_oldest_date(self.get_weibo_json(middle))
+            if oldest is None or oldest <= until_date:
+                high = middle
+            else:
+                low = middle + 1
+        logger.info("跳过晚于%s的微博，从第%d页开始抓取", self.until_date, low)
+        return low
+
+    def get_journal_path(self):
+        """获取当前用户（及关键词）抓取日志的路径"""
+        if getattr(sys, 'frozen', False):
+            base_dir = os.path.dirname(sys.executable)
+        else:
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+        name = str(self.user_config["user_id"])
+        if self.query:
+            name += "_{:08x}".format(zlib.crc32(self.query.encode("utf-8")))
+        if "end_page" in self.user_config:
+            # 同一用户的各页码范围任务可能在同一节点上同时抓取，各用一个抓取日志
+            name += "_{}-{}".format(self.user_config.get("start_page", self.start_page), self.user_config["end_page"])
+        return os.path.join(base_dir, "weibo", ".journal", name + ".jsonl")
+
+    def resume_from_journal(self, start_page):
+        """打开当前用户的抓取日志，返回本次开始抓取的页码
+
+        若上次抓取中断，先写入上次已抓取但未写入的微博，再从日志中的下一页继续；
+        上次中断前已到达结束条件时返回None。append模式依赖last_weibo_id判断结束，不使用抓取日志。
+        """
+        if not self.page_journal or const.MODE != "overwrite":
+            return start_page
+        meta = {
+            "user_id": str(self.user_config["user_id"]),
+            "query": self.query,
+            "start_page": start_page,
+            "end_page": self.user_config.get("end_page"),
+            "only_crawl_original": self.only_crawl_original,
+            "since_date": self.user_config["since_date"],
+            "until_date": self.until_date,
+        }
+        self.journal = PageJournal(self.get_journal_path(), meta)
+        state = self.journal.load()
+        if state is None:
+            self.journal.open(resume=False)
+            return start_page
+        last_page, is_end, pending, ids = state
+        logger.info(
+            "从抓取日志恢复 %s 的抓取进度，上次已抓取到第%d页", self.user["screen_name"], last_page
+        )
+        self.journal.open(resume=True)
+        self.seen_ids.update(ids)
+        self.weibo.extend(map(WeiboRecord.from_dict, pending))
+        self.got_count = len(ids)  # 包括中断前已写入的微博
+        if pending:
+            self.write_pages(0)
+        return None if is_end else last_page + 1
+
+    def journal_page(self, page, count, is_end):
+        """把一页中新抓取的微博(self.weibo[count:])记入抓取日志"""
+        if self.journal:
+            self.journal.record_page(page, self.weibo[count:], is_end)
+
+    def write_pages(self, wrote_count):
+        """写入self.weibo[wrote_count:]并在抓取日志中记录，返回已写入的微博数（即self.weibo的长度）
+
+        开启了后台写入时只把这批微博交给写入线程，写入完成后再在抓取日志中记录。
+        """
+        flush_page = self.journal.last_page if self.journal else None
+        if self.sink_pipeline:
+            self.sink_pipeline.submit((self.snapshot_context(wrote_count), flush_page))
+        else:
+            self.write_data(wrote_count)
+            self.finish_write(wrote_count, flush_page)
+        return len(self.weibo)
+
+    def finish_write(self, wrote_count, flush_page):
+        """self.weibo[wrote_count:]写入后保存已抓取的id，并在抓取日志中记录第flush_page页及之前已写入"""
+        self.seen_index.persist(
+            self.user_config["user_id"], [w["id"] for w in self.weibo[wrote_count:]]
+        )
+        if self.journal:
+            # 记录写入完成前先提交SQLite中缓存的数据，中断后不会漏写已记为完成的页面
+            if "sqlite" in self.write_mode:
+                self.flush_sqlite()
+            self.journal.record_flush(flush_page)
+
+    def snapshot_context(self, wrote_count):
+        """复制当前抓取上下文交给写入线程，其中weibo只含本批的self.weibo[wrote_count:]"""
+        context = copy.copy(self.context)
+        context.weibo = self.weibo[wrote_count:]
+        context.sink_pipeline = None
+        return context
+
+    def create_sink_pipeline(self):
+        """创建当前用户的后台写入流水线，sink_queue_size为0时返回None"""
+        if self.sink_queue_size <= 0:
+            return None
+
+        def run_sink(sink):
+            def run(batch):
+                self.context = batch.payload[0]
+                if self.weibo:
+                    sink(0, lambda: batch.once("interactions", lambda: self.load_interactions(0)))
+
+            return run
+
+        def on_done(payload):
+            self.context, flush_page = payload
+            self.finish_write(0, flush_page)
+
+        return SinkPipeline(
+            [(name, run_sink(sink)) for name, sink in self.get_sinks()],
+            on_done,
+            self.sink_queue_size,
+        )
+
+    def close_sink_pipeline(self):
+        """等待后台写入完成并结束写入线程，写入出错时抛出异常"""
+        pipeline = self.sink_pipeline
+        if pipeline:
+            self.sink_pipeline = None
+            pipeline.close()
+
+    async def get_pages_concurrently(self, pages, wrote_count=0):
+        """保持page_concurrency个页面请求在途，并按页码顺序解析已返回的页面
+
+        since_date和append模式下last_weibo_id的提前结束判断仍由get_one_page按顺序完成，
+        结束后尚未返回的请求会被丢弃。返回已写入的微博数。
+        """
+        window = PageWindow(
+            self.bind_context(self.get_weibo_json), pages, self.page_concurrency
+        )
+        progress = tqdm(total=len(pages), desc="Progress")
+        try:
+            while True:
+                result = await window.next()
+                if result is None:
+                    break
+                page, js = result
+                progress.update(1)
+                count = len(self.weibo)
+                is_end = self.get_one_page(page, js)
+                self.journal_page(page, count, is_end)
+                if is_end:
+                    break
+                if page % 20 == 0:  # 每爬20页写入一次文件
+                    wrote_count = self.write_pages(wrote_count)
+        finally:
+            window.cancel()
+            progress.close()
+        return wrote_count
 
     def get_user_config_list(self, file_path):
         """获取文件中的微博id信息"""
@@ -2493,36 +3577,272 @@ class Weibo(object):
                         user_config_list.append(user_config)
         return user_config_list
 
-    def initialize_info(self, user_config):
+    def initialize_info(self, user_config, query=""):
         """初始化爬虫信息"""
-        self.weibo = []
-        self.user = {}
-        self.user_config = user_config
-        self.got_count = 0
-        self.weibo_id_list = []
+        self.context = CrawlContext(user_config, query)
+        # 同一用户的各个关键词共用一个已抓取id集合
+        self.seen_ids = self.seen_index.ids(user_config["user_id"])
+        self.stored_ids = self.seen_index.stored(user_config["user_id"])
+
+    def crawl_user(self, user_config):
+        """抓取一个用户的全部微博（按其query_list逐个关键词抓取）"""
+        if len(user_config["query_list"]):
+            for query in user_config["query_list"]:
+                self.initialize_info(user_config, query)
+                self.get_pages()
+        else:
+            self.initialize_info(user_config)
+            self.get_pages()
+
+        # 当前用户所有微博和评论抓取完毕后，再导出该用户的评论 CSV
+        self.flush_sqlite()
+        self.export_comments_to_csv_for_current_user()
+
+        logger.info("信息抓取完毕")
+        logger.info("*" * 100)
+        # 页码范围任务只抓取了用户的一部分微博，不更新用户配置文件中的since_date
+        if self.user_config_file_path and self.user and "end_page" not in user_config:
+            with self.file_lock:
+                self.update_user_config_file(self.user_config_file_path)
+
+    def start_sharded(self):
+        """按用户id哈希把用户分给crawl_processes个子进程抓取，SQLite由单独的写入进程写入"""
+        shards = [[] for _ in range(self.crawl_processes)]
+        for user_config in self.user_config_list:
+            index = zlib.crc32(str(user_config["user_id"]).encode()) % self.crawl_processes
+            shards[index].append(user_config)
+
+        # 子进程各自持有速率控制器，按进程数平分请求速率，总速率与单进程时相同
+        worker_config = dict(self.config, crawl_processes=1)
+        rate_limit = dict(worker_config.get("rate_limit") or {})
+        rate_limit["max_rate"] = rate_limit.get("max_rate", self.rate_controller.max_rate) / self.crawl_processes
+        rate_limit["initial_rate"] = rate_limit.get("initial_rate", self.rate_controller.rate) / self.crawl_processes
+        worker_config["rate_limit"] = rate_limit
+
+        sqlite_queue = None
+        ack_queues = [None] * self.crawl_processes
+        writer = None
+        writer_gone = multiprocessing.Event()
+        if "sqlite" in self.write_mode:
+            self.get_sqlite_connection().close()  # 先在主进程中建好数据库和表
+            sqlite_queue = multiprocessing.Queue(maxsize=SQLITE_QUEUE_SIZE)
+            ack_queues = [multiprocessing.Queue() for _ in range(self.crawl_processes)]
+            writer = multiprocessing.Process(
+                target=run_sqlite_writer,
+                args=(self.get_sqlte_path(), sqlite_queue, ack_queues),
+            )
+            writer.start()
+
+        file_lock = multiprocessing.RLock()
+        workers = [
+            multiprocessing.Process(
+                target=crawl_shard,
+                args=(worker_config, shard, i, sqlite_queue, ack_queues[i], file_lock, writer_gone),
+            )
+            for i, shard in enumerate(shards)
+            if shard
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(timeout=1)
+                # 写入进程意外退出时通知抓取进程，它们在提交或等待写入时抛出异常而不是一直等待
+                if writer and not writer.is_alive() and not writer_gone.is_set():
+                    logger.error("SQLite写入进程已退出，退出码%s", writer.exitcode)
+                    writer_gone.set()
+        if writer:
+            if writer.is_alive():
+                sqlite_queue.put(None)
+            writer.join()
+
+    def crawl_from_queue(self, max_jobs=None):
+        """不断从任务队列租用任务并抓取，直到队列中没有可租用的任务"""
+        lease_seconds = self.work_queue_config.get("lease_seconds", 600)
+        worker_id = self.work_queue_config.get("worker_id")
+        if not worker_id:
+            worker_id = default_worker_id()
+        elif self.user_concurrency > 1:
+            worker_id = "{}-{}".format(worker_id, threading.get_ident())
+        pages_per_job = self.work_queue_config.get("pages_per_job", 0)
+        max_attempts = self.work_queue_config.get("max_attempts", 3)
+        retry_delay = self.work_queue_config.get("retry_delay", 60)
+        done = 0
+        while max_jobs is None or done < max_jobs:
+            job = self.work_queue.lease(worker_id, lease_seconds)
+            if job is None:
+                break
+            payload = job.payload
+            logger.info(
+                "租用任务%s: 用户%s，第%s-%s页",
+                job.id,
+                payload["user_id"],
+                payload.get("start_page", self.start_page),
+                payload.get("end_page", "末"),
+            )
+            try:
+                with LeaseKeeper(self.work_queue, job, worker_id, lease_seconds, logger):
+                    if pages_per_job and "end_page" not in payload:
+                        self.split_user_job(payload, pages_per_job)
+                    else:
+                        self.crawl_user(payload)
+            except Exception as e:
+                # 出错的任务延后重试，本节点继续抓取其他任务
+                logger.exception(e)
+                retry_after = retry_delay * 2 ** (job.attempts - 1)
+                self.work_queue.fail(job, worker_id, retry_after, max_attempts)
+                if job.attempts >= max_attempts:
+                    logger.error("任务%s已失败%d次，不再重试", job.id, job.attempts)
+                else:
+                    logger.warning("任务%s抓取出错，%d秒后重试", job.id, retry_after)
+                continue
+            except BaseException:
+                self.work_queue.release(job, worker_id)
+                raise
+            self.work_queue.complete(job, worker_id)
+            done += 1
+
+    def split_user_job(self, user_config, pages_per_job):
+        """按用户当前的微博页数把整个用户的任务拆成每pages_per_job页一个的任务，加入任务队列"""
+        self.initialize_info(user_config)
+        if self.get_user_info() != 0:
+            return
+        page_count = self.get_page_count() or 0
+        start_page = user_config.get("start_page", self.start_page)
+        payloads = [
+            dict(user_config, start_page=page, end_page=min(page + pages_per_job - 1, page_count))
+            for page in range(start_page, page_count + 1, pages_per_job)
+        ]
+        self.work_queue.enqueue(payloads, self.work_queue_config.get("requeue_after", 3600))
+        logger.info("用户%s共%d页，拆分为%d个任务", user_config["user_id"], page_count, len(payloads))
+
+    def start_from_queue(self):
+        """把本机配置的用户加入任务队列，再与其他节点一起从队列中租用任务抓取"""
+        self.work_queue.enqueue(
+            self.user_config_list,
+            self.work_queue_config.get("requeue_after", 3600),
+        )
+        if self.user_concurrency > 1 and const.CHECK_COOKIE["CHECK"]:
+            # 检查cookie依赖第一个用户先抓取完成
+            self.crawl_from_queue(max_jobs=1)
+        if self.user_concurrency > 1:
+            with ThreadPoolExecutor(max_workers=self.user_concurrency) as executor:
+                for future in [
+                    executor.submit(self.crawl_from_queue)
+                    for _ in range(self.user_concurrency)
+                ]:
+                    future.result()
+        else:
+            self.crawl_from_queue()
 
     def start(self):
         """运行爬虫"""
         try:
-            for user_config in self.user_config_list:
-                if len(user_config["query_list"]):
-                    for query in user_config["query_list"]:
-                        self.query = query
-                        self.initialize_info(user_config)
-                        self.get_pages()
-                else:
-                    self.initialize_info(user_config)
-                    self.get_pages()
-
-                # 当前用户所有微博和评论抓取完毕后，再导出该用户的评论 CSV
-                self.export_comments_to_csv_for_current_user()
-
-                logger.info("信息抓取完毕")
-                logger.info("*" * 100)
-                if self.user_config_file_path and self.user:
-                    self.update_user_config_file(self.user_config_file_path)
+            if self.crawl_processes > 1:
+                # 主进程不抓取，由各子进程分别预热
+                self.start_sharded()
+                return
+            self.warm_up_session()
+            if self.work_queue:
+                self.start_from_queue()
+                return
+            user_config_list = self.user_config_list
+            if self.user_concurrency > 1 and const.CHECK_COOKIE["CHECK"] and user_config_list:
+                # 检查cookie依赖第一个用户先抓取完成
+                self.crawl_user(user_config_list[0])
+                user_config_list = user_config_list[1:]
+            if self.user_concurrency > 1:
+                # 各用户在独立的线程和抓取上下文中抓取，共享rate_controller的请求速率预算
+                with ThreadPoolExecutor(max_workers=self.user_concurrency) as executor:
+                    for future in [
+                        executor.submit(self.crawl_user, user_config)
+                        for user_config in user_config_list
+                    ]:
+                        future.result()
+            else:
+                for user_config in user_config_list:
+                    self.crawl_user(user_config)
         except Exception as e:
             logger.exception(e)
+        finally:
+            self.close_sqlite()
+            if self.archive:
+                self.archive.close()
+            if self.parse_pool:
+                self.parse_pool.shutdown()
+                self.parse_pool = None
+
+_parse_worker = None
+
+
+def init_parse_worker(remove_html_tag, weibo_fields):
+    """解析进程的初始化函数，创建只用于解析的Weibo对象，不读取配置也不发出请求"""
+    global _parse_worker
+    _parse_worker = Weibo.__new__(Weibo)
+    _parse_worker.remove_html_tag = remove_html_tag
+    _parse_worker.weibo_fields = weibo_fields
+
+
+def parse_mblogs(mblogs):
+    """在解析进程中解析一批微博，解析出错的微博返回None，由抓取线程重新解析并记录错误"""
+    results = []
+    for mblog in mblogs:
+        try:
+            results.append(_parse_worker.parse_mblog(mblog))
+        except Exception:
+            results.append(None)
+    return results
+
+
+def log_sqlite_stats(stats):
+    if stats:
+        logger.info(
+            "SQLite共新增%d行，更新%d行，仅更新计数%d行，跳过未变化的%d行",
+            stats["inserted"],
+            stats["updated"],
+            stats["counters"],
+            stats["unchanged"],
+        )
+    if stats["failed"]:
+        logger.error("SQLite共有%d行因数据有误未能写入", stats["failed"])
+
+
+def run_sqlite_writer(db_path, queue, ack_queues):
+    """写入进程：独占SQLite数据库，批量写入各抓取进程经队列发来的数据
+
+    队列消息为("insert", 表名, 数据)或("flush", 分片序号, None)，收到None时写完剩余数据后退出。
+    """
+    writer = SQLiteWriter(db_path, SQLITE_WRITE_BATCH_SIZE, SQLITE_UPSERT_TABLES)
+    try:
+        while True:
+            try:
+                message = queue.get(timeout=1)
+            except Empty:
+                writer.flush()
+                continue
+            if message is None:
+                break
+            kind, key, data = message
+            if kind == "insert":
+                writer.insert(key, data)
+            else:
+                writer.flush()
+                ack_queues[key].put(True)
+    finally:
+        writer.close()
+        log_sqlite_stats(writer.stats)
+
+
+def crawl_shard(config, user_config_list, shard, sqlite_queue, ack_queue, file_lock, writer_gone):
+    """子进程入口：抓取分配到本进程的用户"""
+    wb = Weibo(config)
+    wb.user_config_list = user_config_list
+    wb.shard = shard
+    wb.sqlite_queue = sqlite_queue
+    wb.sqlite_ack_queue = ack_queue
+    wb.sqlite_writer_gone = writer_gone
+    wb.file_lock = file_lock
+    wb.start()
 
 
 def handle_config_renaming(config, oldName, newName):